@@ -0,0 +1,64 @@
+#!/bin/sh
+# Keeps /etc/nginx/instance-hosts.map in sync with the server on multi-host setups.
+#
+# Run by the nginx image's entrypoint (/docker-entrypoint.d) before nginx starts. With
+# ROUTING_MAP_URL set (e.g. https://api.example.com/instances/routing/nginx-map?host=vm1) and
+# ROUTING_MAP_TOKEN set to the server's ROUTING_MAP_TOKEN (sent as a bearer token), it
+# fetches the map once, then every ROUTING_MAP_REFRESH_SECONDS in the background, and reloads
+# nginx when the map changes. A map that fails `nginx -t` is rolled back.
+
+MAP_FILE=/etc/nginx/instance-hosts.map
+REFRESH_SECONDS="${ROUTING_MAP_REFRESH_SECONDS:-15}"
+
+if [ -z "$ROUTING_MAP_URL" ]; then
+    echo "instance-map-refresh: ROUTING_MAP_URL is not set, the instance map stays as it is"
+    exit 0
+fi
+if [ -z "$ROUTING_MAP_TOKEN" ]; then
+    echo "instance-map-refresh: ROUTING_MAP_TOKEN is not set, the server will refuse the request"
+fi
+
+# Returns 0 when the map file changed
+fetch_map() {
+    if ! wget -q -T 10 --header "Authorization: Bearer $ROUTING_MAP_TOKEN" -O "$MAP_FILE.new" "$ROUTING_MAP_URL"; then
+        echo "instance-map-refresh: could not fetch $ROUTING_MAP_URL"
+        rm -f "$MAP_FILE.new"
+        return 1
+    fi
+    # Anything else (an error page, a login redirect) is not a map
+    if ! head -n 1 "$MAP_FILE.new" | grep -q '^# Generated for Docker host'; then
+        echo "instance-map-refresh: unexpected response from $ROUTING_MAP_URL"
+        rm -f "$MAP_FILE.new"
+        return 1
+    fi
+    if cmp -s "$MAP_FILE.new" "$MAP_FILE"; then
+        rm -f "$MAP_FILE.new"
+        return 1
+    fi
+    cp "$MAP_FILE" "$MAP_FILE.previous"
+    mv "$MAP_FILE.new" "$MAP_FILE"
+    return 0
+}
+
+# Returns 0 when a new, valid map is in place
+update_map() {
+    fetch_map || return 1
+    if ! nginx -t -q; then
+        echo "instance-map-refresh: new map rejected by nginx -t, keeping the previous one"
+        mv "$MAP_FILE.previous" "$MAP_FILE"
+        return 1
+    fi
+    return 0
+}
+
+# nginx reads the first map when it starts
+update_map
+
+(
+    while true; do
+        sleep "$REFRESH_SECONDS"
+        if update_map; then
+            nginx -s reload && echo "instance-map-refresh: map updated, nginx reloaded"
+        fi
+    done
+) &
@@ -231,13 +231,39 @@ copy_submission_to_project() {
     fi
 }
 
+# Function to copy the template the server copied into the container (its local template cache)
+# into the project directory. The server also makes the baseline commit to the target repository.
+copy_seeded_template_to_project() {
+    local template_dir="$1"
+    local project_path="/home/coder/project"
+
+    echo "Copying pre-seeded template from $template_dir to $project_path..."
+    if command -v rsync >/dev/null 2>&1; then
+        sudo rsync -a "$template_dir/" "$project_path/"
+    else
+        (
+            cd "$template_dir"
+            shopt -s dotglob nullglob
+            for item in *; do
+                sudo cp -r "$item" "$project_path/"
+            done
+        )
+    fi
+    sudo rm -rf "$template_dir"
+    sudo chown -R coder:coder "$project_path"
+    echo "Successfully copied pre-seeded template to $project_path"
+}
+
 # Main workflow: clone to temp directory, commit/push, then copy submission to project
 TEMP_WORK_DIR="/tmp/target_repo_work_$$"
+SEEDED_TEMPLATE_DIR="/tmp/ai-oa-template"
 
 # Only proceed if project directory is empty
 if [ ! "$(ls -A /home/coder/project 2>/dev/null)" ]; then
+    if [ -d "$SEEDED_TEMPLATE_DIR" ]; then
+        copy_seeded_template_to_project "$SEEDED_TEMPLATE_DIR"
     # Clone target repository to temp directory
-    if clone_target_repo_to_temp "$TEMP_WORK_DIR"; then
+    elif clone_target_repo_to_temp "$TEMP_WORK_DIR"; then
         # Clone template repository into temp directory's submission subdirectory
         clone_template_repo_to_temp "$TEMP_WORK_DIR" || echo "⚠️ Template repo clone failed, continuing anyway..."
         
@@ -32,6 +32,37 @@ function getServerUrls() {
   };
 }
 
+// Last ETag and body per polled URL. The server answers 304 Not Modified when we send back the
+// ETag of an unchanged resource, so polls skip the queries and the payload download.
+const conditionalCache = new Map();
+
+// fetch() for polled GET endpoints: revalidates with If-None-Match and, on 304, returns the
+// cached body as a regular 200 response so callers need no special handling
+async function fetchConditional(url, options = {}) {
+  const cached = conditionalCache.get(url);
+  const headers = { ...(options.headers || {}) };
+  if (cached) {
+    headers['If-None-Match'] = cached.etag;
+  }
+  const response = await fetch(url, { ...options, headers });
+
+  if (response.status === 304 && cached) {
+    return new Response(cached.body, {
+      status: 200,
+      headers: { 'Content-Type': 'application/json', ETag: cached.etag }
+    });
+  }
+
+  const etag = response.headers.get('ETag');
+  if (response.ok && etag) {
+    const body = await response.text();
+    conditionalCache.set(url, { etag, body });
+    return new Response(body, { status: response.status, headers: response.headers });
+  }
+  conditionalCache.delete(url);
+  return response;
+}
+
 // Global variables to store environment prompts - accessed throughout the module
 let globalInitialPrompt = '';
 let globalFinalPrompt = '';
@@ -797,6 +828,7 @@ function openChat() {
   // Clean up when the panel is closed.
   global.chatPanel.onDidDispose(() => {
     global.chatPanel = undefined;
+    stopTimerUpdates();
   });
 }
 
@@ -841,6 +873,9 @@ async function startTimer(instanceId) {
     const data = await response.json();
     console.log(`Timer started: ${JSON.stringify(data)}`);
     
+    // Push later timer and phase changes to the webview
+    watchTimerUpdates(instanceId);
+    
     // Send the timer status back to the webview
     if (global.chatPanel) {
       global.chatPanel.webview.postMessage({
@@ -897,8 +932,8 @@ async function startProjectTimer(instanceId) {
     const data = await response.json();
     console.log(`Project timer started: ${JSON.stringify(data)}`);
     
-    // Set up periodic logging of project timer status
-    startProjectTimerDebugLogging(instanceId);
+    // Push later timer and phase changes to the webview
+    watchTimerUpdates(instanceId);
     
     // Send the timer status back to the webview
     if (global.chatPanel) {
@@ -923,45 +958,73 @@ async function startProjectTimer(instanceId) {
   }
 }
 
-// Debug helper function to periodically check and log project timer status
-function startProjectTimerDebugLogging(instanceId) {
-  console.log(`Setting up debug logging for project timer on instance ${instanceId}`);
-  
-  // Check project timer status every 10 seconds and log it
-  const debugInterval = setInterval(async () => {
-    try {
-      const { SERVER_TIMER_STATUS_URL } = getServerUrls();
-      const response = await fetch(
-        `${SERVER_TIMER_STATUS_URL}?instanceId=${instanceId}`,
-        {
-          method: 'GET',
-          headers: { 'Content-Type': 'application/json' }
-        }    
-      );
-      
-      if (!response.ok) {
-        console.error(`Debug log: Failed to get timer status: ${response.status}`);
-        return;
-      }
-      
-      const data = await response.json();
-      if (data.success && data.timer) {
-        // Only log if this is a project timer
-        if (data.timer.timerType === 'project') {
-          const timeRemaining = data.timer.timeRemaining;
-          const minutes = Math.floor(timeRemaining / 60);
-          const seconds = timeRemaining % 60;
-          
-          console.log(`PROJECT TIMER DEBUG - Time remaining: ${minutes}:${seconds.toString().padStart(2, '0')} - Raw data: ${JSON.stringify(data.timer)}`);
+// Watch the instance's timer and phase state and forward changes to the webview.
+// Long-polls /timer/poll: the server holds each request until the state changes (start, reset,
+// expiry, phase marker) or ~25s pass, so an idle candidate costs about two requests a minute.
+// When the server holds too many polls it answers at once with Retry-After (~25s): the same
+// request rate, but changes arrive up to that much later.
+function watchTimerUpdates(instanceId) {
+  if (global.timerWatcher && global.timerWatcher.instanceId === instanceId && !global.timerWatcher.stopped) {
+    return; // Already watching this instance
+  }
+  stopTimerUpdates();
+  const watcher = { instanceId, stopped: false };
+  global.timerWatcher = watcher;
+  console.log(`Watching timer updates for instance ${instanceId}`);
+
+  const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+  (async () => {
+    let tag = null;
+    while (!watcher.stopped && global.chatPanel) {
+      try {
+        const { SERVER_URL } = getServerUrls();
+        const params = new URLSearchParams({ instanceId: String(instanceId), timeout: '25' });
+        if (tag) {
+          params.set('tag', tag);
+        }
+        const response = await fetch(`${SERVER_URL}/timer/poll?${params}`);
+
+        if (response.status === 304) {
+          // No change; the server asks us to back off when it is holding too many polls
+          const retryAfter = parseInt(response.headers.get('Retry-After') || '0', 10);
+          if (retryAfter > 0) {
+            await sleep(retryAfter * 1000);
+          }
+          continue;
+        }
+        if (!response.ok) {
+          throw new Error(`HTTP error: ${response.status}`);
+        }
+
+        const data = await response.json();
+        const isFirst = tag === null;
+        tag = data.tag;
+        // The first answer is the state the caller already sent to the webview
+        if (isFirst || watcher.stopped || !global.chatPanel) {
+          continue;
+        }
+
+        console.log(`Timer state changed: phase=${data.phase || 'none'} timer=${JSON.stringify(data.timer)}`);
+        if (data.timer) {
+          global.chatPanel.webview.postMessage({
+            command: data.timer.timerType === 'project' ? 'projectTimerStatus' : 'timerStatus',
+            data: data.timer
+          });
         }
+      } catch (error) {
+        console.error(`Error watching timer updates: ${error.message}`);
+        await sleep(5000);
       }
-    } catch (error) {
-      console.error(`Debug log: Error checking project timer status: ${error.message}`);
     }
-  }, 10000);
-  
-  // Store the interval ID in a global variable so we can clear it later if needed
-  global.projectTimerDebugInterval = debugInterval;
+  })();
+}
+
+function stopTimerUpdates() {
+  if (global.timerWatcher) {
+    global.timerWatcher.stopped = true;
+    global.timerWatcher = undefined;
+  }
 }
 
 // Get the status of a timer
@@ -972,7 +1035,7 @@ async function getTimerStatus(instanceId) {
     // Get server URLs dynamically
     const { SERVER_TIMER_STATUS_URL, SERVER_URL } = getServerUrls();
     
-    const response = await fetch(
+    const response = await fetchConditional(
       `${SERVER_TIMER_STATUS_URL}?instanceId=${instanceId}`,
       {
         method: 'GET',
@@ -1022,7 +1085,7 @@ async function checkTimerAndInterviewStatus(instanceId) {
     console.log(`Checking timer and interview status for instance ${instanceId}`);
     const { SERVER_TIMER_STATUS_URL, SERVER_URL } = getServerUrls();
     
-    const response = await fetch(
+    const response = await fetchConditional(
       `${SERVER_TIMER_STATUS_URL}?instanceId=${instanceId}`,
       {
         method: 'GET',
@@ -1049,8 +1112,8 @@ async function checkTimerAndInterviewStatus(instanceId) {
       if (data.timer.timerType === 'project') {
         console.log('Project work timer detected');
         
-        // Start project timer debug logging
-        startProjectTimerDebugLogging(instanceId);
+        // Push later timer and phase changes to the webview
+        watchTimerUpdates(instanceId);
         
         // We're in the project work phase
         if (global.chatPanel) {
@@ -1091,6 +1154,9 @@ async function checkTimerAndInterviewStatus(instanceId) {
           }
         }
         
+        // Push later timer and phase changes to the webview
+        watchTimerUpdates(instanceId);
+        
         // Send the timer status to the webview for UI updates regardless
         if (global.chatPanel) {
           global.chatPanel.webview.postMessage({
@@ -1328,7 +1394,7 @@ async function getChatHistory(instanceId) {
     const url = `${SERVER_CHAT_URL}/history?instanceId=${instanceId}`;
     console.log(`Fetching chat history from: ${url}`);
     
-    const response = await fetch(url);
+    const response = await fetchConditional(url);
     
     if (!response.ok) {
       throw new Error(`HTTP error: ${response.status}`);
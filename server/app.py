@@ -2,37 +2,17 @@ from flask import Flask, request
 from flask_cors import CORS
 import os
 from dotenv import load_dotenv
-from routes.chat import chat_bp
-from routes.candidates import candidates_bp
-from routes.tests import tests_bp
-from routes.instances import instances_bp
-from routes.timer import timer_bp
-from routes.reports import reports_bp
-from routes.auth import auth_bp
-from routes.telemetry import telemetry_bp
-from routes.welcome import welcome_bp
-from database.db_postgresql import init_database, test_connection
-from database.migrations_postgresql import run_migrations
 import logging
 
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+from observability.logs import configure_logging
 
-# Reduce werkzeug logging verbosity (Flask's HTTP request logs)
-logging.getLogger('werkzeug').setLevel(logging.WARNING)
+# Set up logging (queue-based, see observability/logs.py)
+configure_logging()
+logger = logging.getLogger(__name__)
 
 # Load environment variables
 load_dotenv('../server/.env')  # Load from existing .env file
 
-# Create Flask app
-app = Flask(__name__)
-# Configure Flask to be more flexible with trailing slashes
-app.url_map.strict_slashes = False
-
 # Configure CORS to support credentials and specific origins
 allowed_origins = [
     'http://localhost:5173',
@@ -40,64 +20,101 @@ allowed_origins = [
     'https://admin.verihire.me'
 ]
 
-CORS(
-    app,
-     supports_credentials=True,
-    origins=allowed_origins,
-     allow_headers=['Content-Type', 'Authorization', 'X-User-ID', 'X-Company-ID', 'X-Auth0-User-ID'],
-    methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS']
-)
-
-# Request logging middleware removed to reduce log verbosity
-
-# Register routes/blueprints
-logger.info("STARTUP: Registering blueprints...")
-app.register_blueprint(chat_bp, url_prefix='/chat')
-app.register_blueprint(candidates_bp, url_prefix='/candidates')
-app.register_blueprint(tests_bp, url_prefix='/tests')
-app.register_blueprint(instances_bp, url_prefix='/instances')
-app.register_blueprint(timer_bp, url_prefix='/timer')
-app.register_blueprint(reports_bp, url_prefix='/reports')
-app.register_blueprint(auth_bp, url_prefix='/auth')
-app.register_blueprint(telemetry_bp, url_prefix='/telemetry')
-app.register_blueprint(welcome_bp, url_prefix='/')
-logger.info("STARTUP: All blueprints registered")
-
-# Log environment variables (safely)
-logger.info("🔧 STARTUP: Environment configuration:")
-logger.info(f"   - AUTH0_DOMAIN: {os.environ.get('AUTH0_DOMAIN', 'NOT SET')}")
-logger.info(f"   - APPROVED_DOMAINS: {os.environ.get('APPROVED_DOMAINS', 'NOT SET')}")
-logger.info(f"   - API_BASE_URL: {os.environ.get('API_BASE_URL', 'NOT SET')}")
-logger.info(f"   - PORT: {os.environ.get('PORT', 'NOT SET')}")
-logger.info(f"   - DATABASE_URL: {'SET' if os.environ.get('DATABASE_URL') else 'NOT SET'}")
-
-# Test database connection first
-logger.info("🔍 STARTUP: Testing database connection...")
-try:
-    connection_result = test_connection()
-    logger.info(connection_result)
-except Exception as e:
-    logger.error(f"STARTUP: Database connection test failed: {str(e)}")
-    logger.error("💡 Make sure DATABASE_URL is set in your .env file")
-    exit(1)
-
-# Initialize database
-try:
-    logger.info("🗄️ STARTUP: Initializing PostgreSQL database...")
-    init_database()
-    logger.info("STARTUP: Database initialized successfully")
-    
-    # Run migrations to update schema
-    logger.info("STARTUP: Running PostgreSQL migrations...")
-    run_migrations()
-    logger.info("STARTUP: Migrations completed successfully")
-except Exception as e:
-    logger.error(f"STARTUP: Database initialization failed: {str(e)}")
-    logger.error("💡 Check your DATABASE_URL and Supabase connection")
-    exit(1)
+
+def create_app():
+    """
+    Create the Flask app.
+
+    Side-effect free: no database connection, schema changes or file loading happen here.
+    The schema is managed by `python manage.py migrate`; controller state loads on first use.
+    """
+    # Blueprints are imported here so importing this module stays cheap
+    from routes.chat import chat_bp
+    from routes.candidates import candidates_bp
+    from routes.tests import tests_bp
+    from routes.instances import instances_bp
+    from routes.timer import timer_bp
+    from routes.reports import reports_bp
+    from routes.auth import auth_bp
+    from routes.telemetry import telemetry_bp
+    from routes.welcome import welcome_bp
+    from routes.jobs import jobs_bp
+
+    app = Flask(__name__)
+    # Configure Flask to be more flexible with trailing slashes
+    app.url_map.strict_slashes = False
+
+    CORS(
+        app,
+         supports_credentials=True,
+        origins=allowed_origins,
+         allow_headers=['Content-Type', 'Authorization', 'X-User-ID', 'X-Company-ID', 'X-Auth0-User-ID'],
+        methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS']
+    )
+
+    # Request logging middleware removed to reduce log verbosity
+
+    # Request latency and query metrics, served on /metrics
+    from observability.metrics import init_app as init_metrics
+    init_metrics(app)
+
+    # Register routes/blueprints
+    logger.info("STARTUP: Registering blueprints...")
+    app.register_blueprint(chat_bp, url_prefix='/chat')
+    app.register_blueprint(candidates_bp, url_prefix='/candidates')
+    app.register_blueprint(tests_bp, url_prefix='/tests')
+    app.register_blueprint(instances_bp, url_prefix='/instances')
+    app.register_blueprint(timer_bp, url_prefix='/timer')
+    app.register_blueprint(reports_bp, url_prefix='/reports')
+    app.register_blueprint(auth_bp, url_prefix='/auth')
+    app.register_blueprint(telemetry_bp, url_prefix='/telemetry')
+    app.register_blueprint(jobs_bp, url_prefix='/jobs')
+    app.register_blueprint(welcome_bp, url_prefix='/')
+    logger.info("STARTUP: All blueprints registered")
+
+    # Log environment variables (safely)
+    logger.info("🔧 STARTUP: Environment configuration:")
+    logger.info(f"   - AUTH0_DOMAIN: {os.environ.get('AUTH0_DOMAIN', 'NOT SET')}")
+    logger.info(f"   - APPROVED_DOMAINS: {os.environ.get('APPROVED_DOMAINS', 'NOT SET')}")
+    logger.info(f"   - API_BASE_URL: {os.environ.get('API_BASE_URL', 'NOT SET')}")
+    logger.info(f"   - PORT: {os.environ.get('PORT', 'NOT SET')}")
+    logger.info(f"   - DATABASE_URL: {'SET' if os.environ.get('DATABASE_URL') else 'NOT SET'}")
+
+    return app
+
+
+def start_background_services():
+    """Start per-process background threads (the in-process job worker, the timer expiry scheduler)."""
+    # The log listener thread too, if this process was forked after logging was configured
+    configure_logging()
+    # Run background jobs in this process unless a separate worker (server/worker.py) handles them
+    if os.environ.get('JOBS_IN_PROCESS_WORKER', 'true').lower() == 'true':
+        from controllers.jobs_controller import load_job_handlers, start_worker_thread
+        load_job_handlers()
+        start_worker_thread()
+        logger.info("STARTUP: In-process job worker started")
+    # Every serving process competes for the scheduler lock of its host; one of them runs it
+    if os.environ.get('TIMER_SCHEDULER_ENABLED', 'true').lower() == 'true':
+        from controllers.timer_controller import start_timer_scheduler
+        start_timer_scheduler()
+        logger.info("STARTUP: Timer expiry scheduler started")
+
+
+app = create_app()
 
 if __name__ == '__main__':
+    from manage import migrate
+
     port = int(os.environ.get('PORT', 3000))
+    debug = os.environ.get('FLASK_DEBUG', 'false').lower() == 'true'
+    # Local development convenience: bring the schema up to date before serving
+    # (deployments run `python manage.py migrate` as a separate step instead)
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
+        if not migrate():
+            exit(1)
     logger.info(f"STARTUP: Server starting on port {port}")
     logger.info(f"STARTUP: Using PostgreSQL database (Supabase)")
-    app.run(host='0.0.0.0', port=port, debug=True) 
\ No newline at end of file
+    # With the reloader, only the child process (WERKZEUG_RUN_MAIN) serves requests
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_services()
+    app.run(host='0.0.0.0', port=port, debug=debug)
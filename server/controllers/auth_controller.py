@@ -1,3 +1,4 @@
+import hmac
 import requests
 import jwt
 from jwt import PyJWKClient
@@ -9,7 +10,6 @@ import traceback
 import logging
 
 # Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 def require_session_auth(f):
@@ -60,6 +60,26 @@ def require_session_auth(f):
     
     return decorated_function
 
+def require_bearer_token(env_name):
+    """
+    Decorator for operator endpoints that are not tied to a company session: requires
+    `Authorization: Bearer <token>` matching the environment variable env_name. While that
+    variable is unset the endpoint answers 404.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            expected = os.getenv(env_name)
+            if not expected:
+                return jsonify({'error': 'Not found'}), 404
+            supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+            if not hmac.compare_digest(supplied.encode('utf-8'), expected.encode('utf-8')):
+                logger.warning(f"TOKEN AUTH: Invalid or missing bearer token for {request.path}")
+                return jsonify({'error': 'Authentication required'}), 401
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
 def require_auth(f):
     """Middleware to require authentication - moved from routes to controller"""
     @wraps(f)
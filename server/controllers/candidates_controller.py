@@ -1,16 +1,16 @@
 from database.db_postgresql import get_connection
-import pandas as pd
+from database.pagination import contains, fetch_list, iso_datetime, list_response, parse_list_params
 from werkzeug.utils import secure_filename
+from observability.logs import summarize
 import os
-import numpy as np
 import logging
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 def clean_pandas_row(row):
     """Clean pandas row data by replacing NaN values with None for JSON serialization"""
+    import pandas as pd
     cleaned_row = {}
     for key, value in row.items():
         if pd.isna(value) or (isinstance(value, str) and value.lower() == 'nan'):
@@ -19,33 +19,77 @@ def clean_pandas_row(row):
             cleaned_row[key] = value
     return cleaned_row
 
-def get_all_candidates(company_id=None):
-    """Get all candidates from the database with their assigned tests, filtered by company"""
+# Candidate columns selectable with ?fields= (shared with the per-test candidate lists)
+CANDIDATE_FIELDS = {
+    'id': 'c.id',
+    'name': 'c.name',
+    'email': 'c.email',
+    'tags': 'c.tags',
+    'company_id': 'c.company_id',
+    'completed': 'c.completed',
+    'created_at': 'c.created_at',
+    'updated_at': 'c.updated_at'
+}
+
+CANDIDATE_SORTS = {
+    'created_at': 'c.created_at',
+    'name': "COALESCE(c.name, '')",
+    'email': "COALESCE(c.email, '')",
+    'id': 'c.id'
+}
+
+CANDIDATE_FILTERS = {
+    'q': ('(c.name ILIKE %s OR c.email ILIKE %s)', contains),
+    'email': ('LOWER(c.email) = LOWER(%s)', str),
+    'created_after': ('c.created_at >= %s', iso_datetime),
+    'created_before': ('c.created_at < %s', iso_datetime)
+}
+
+# Assigned tests as one correlated aggregate per row (instead of a query per candidate)
+TESTS_ASSIGNED_EXPR = """
+    COALESCE((
+        SELECT json_agg(json_build_object('id', t.id, 'name', t.name) ORDER BY t.id)
+        FROM test_candidates tc
+        JOIN tests t ON t.id = tc.test_id
+        WHERE tc.candidate_id = c.id
+    ), '[]'::json)
+"""
+
+CANDIDATE_LIST_SPEC = {
+    'fields': {**CANDIDATE_FIELDS, 'testsAssigned': TESTS_ASSIGNED_EXPR},
+    'default_select': f'c.*, {TESTS_ASSIGNED_EXPR} AS "testsAssigned"',
+    'sorts': CANDIDATE_SORTS,
+    'default_sort': 'id',
+    'filters': CANDIDATE_FILTERS,
+    'id': 'c.id'
+}
+
+def get_all_candidates(company_id=None, params=None):
+    """
+    Get all candidates from the database with their assigned tests, filtered by company
+
+    Args:
+        company_id (int, optional): Company to list candidates for
+        params (dict, optional): List query parameters (fields, sort, q, email, created_after,
+            created_before, limit, cursor); see CANDIDATE_LIST_SPEC and database/pagination.py
+
+    Returns:
+        list, or {"items", "next_cursor"} when limit/cursor is given
+    """
+    list_params = parse_list_params(params or {}, CANDIDATE_LIST_SPEC)
     conn = get_connection()
     cursor = conn.cursor()
     
     try:
         # Get candidates filtered by company if provided
+        conditions, query_params = [], []
         if company_id:
-            cursor.execute('SELECT * FROM candidates WHERE company_id = %s', (company_id,))
-        else:
-            cursor.execute('SELECT * FROM candidates')
-        
-        candidates = [dict(row) for row in cursor.fetchall()]
-        
-        # For each candidate, get their assigned tests
-        for candidate in candidates:
-            cursor.execute('''
-                SELECT t.id, t.name
-                FROM tests t
-                JOIN test_candidates tc ON t.id = tc.test_id
-                WHERE tc.candidate_id = %s
-            ''', (candidate['id'],))
-            
-            assigned_tests = [dict(row) for row in cursor.fetchall()]
-            candidate['testsAssigned'] = assigned_tests
-            
-        return candidates
+            conditions.append('c.company_id = %s')
+            query_params.append(company_id)
+        candidates, next_cursor = fetch_list(
+            cursor, CANDIDATE_LIST_SPEC, 'candidates c', conditions, query_params, list_params
+        )
+        return list_response(candidates, next_cursor, list_params)
     finally:
         conn.close()
 
@@ -260,6 +304,7 @@ def get_candidate_tests(candidate_id, company_id=None):
 
 def create_candidates_from_file(df, company_id=None):
     """Create multiple candidates from a pandas DataFrame"""
+    import pandas as pd
     if not company_id:
         raise ValueError('Company ID is required for multi-tenant support')
     
@@ -279,11 +324,11 @@ def create_candidates_from_file(df, company_id=None):
     try:
         # Process each row in the DataFrame
         for index, row in df.iterrows():
-            logger.info(f"Processing row {index + 1}: {dict(row)}")
+            # Per-row details are debug-level: one line per row of a large file adds up
+            logger.debug("Processing row %s", index + 1, extra={'fields': {'row': summarize(row.to_dict())}})
             try:
                 name = str(row['Name']).strip()
                 email = str(row['Email']).strip()
-                logger.info(f"Row {index + 1}: name='{name}', email='{email}'")
                 
                 # Handle tags - properly handle NaN values and ensure they're semicolon-separated
                 tags_value = row.get('Tags', '')
@@ -293,7 +338,7 @@ def create_candidates_from_file(df, company_id=None):
                     # Clean up tags and join with semicolons
                     tags = ';'.join(tag.strip() for tag in str(tags_value).split(';') if tag.strip())
                 
-                logger.info(f"Row {index + 1}: tags='{tags}'")
+                logger.debug("Row %s: tags=%r", index + 1, tags)
                 
                 if not name or not email:
                     error_msg = f"Row {index + 1}: Name and email are required. Got name='{name}', email='{email}'"
@@ -313,7 +358,7 @@ def create_candidates_from_file(df, company_id=None):
                 existing = cursor.fetchall()
                 
                 if existing:
-                    logger.info(f"Row {index + 1}: Found {len(existing)} existing candidates with same email or name")
+                    logger.debug("Row %s: Found %s existing candidates with same email or name", index + 1, len(existing))
                     # Add to duplicates list for frontend resolution
                     results['duplicates'].append({
                         'new': {
@@ -326,7 +371,7 @@ def create_candidates_from_file(df, company_id=None):
                     continue
                 
                 # Insert new candidate with company_id
-                logger.info(f"Row {index + 1}: Inserting new candidate")
+                logger.debug("Row %s: Inserting new candidate", index + 1)
                 cursor.execute(
                     'INSERT INTO candidates (name, email, tags, company_id, completed) VALUES (%s, %s, %s, %s, %s) RETURNING *',
                     (name, email, tags, company_id, False)
@@ -335,7 +380,7 @@ def create_candidates_from_file(df, company_id=None):
                 # Get the inserted candidate directly from the INSERT statement
                 new_candidate = dict(cursor.fetchone())
                 
-                logger.info(f"Row {index + 1}: Successfully created candidate with ID {new_candidate['id']}")
+                logger.debug("Row %s: Successfully created candidate with ID %s", index + 1, new_candidate['id'])
                 results['success'].append(new_candidate)
                 
             except Exception as e:
@@ -377,6 +422,9 @@ def handle_file_upload(file, company_id=None):
         logger.error("Company ID is required but not provided")
         raise ValueError('Company ID is required for multi-tenant support')
         
+    # pandas is only needed for uploads, so it is not imported at module load (slow startup)
+    import pandas as pd
+
     # Read the file based on its extension
     try:
         logger.info(f"Reading file: {file.filename}")
@@ -0,0 +1,225 @@
+"""
+Container resource limits and Docker host capacity.
+
+Every test has a resource profile (tests.mem_limit_mb, nano_cpus, pids_limit; unset columns
+fall back to the CONTAINER_DEFAULT_* settings) that its containers are created with and labelled
+with. The capacity tracker adds up the profiles of the instance containers on a host, against
+the host's memory and CPUs (from `docker info`, overridable per host in DOCKER_HOSTS) with
+overcommit ratios, and reserve_capacity() refuses to create a container that would not fit. create_instance then queues
+the instance (test_instances.provisioning_status = 'queued') for the 'instances.provision_queued'
+job, which creates queued containers in order as capacity frees up.
+"""
+import os
+import time
+import zlib
+from contextlib import contextmanager
+
+from database.db_postgresql import get_connection
+
+CONTAINER_DEFAULT_MEM_LIMIT_MB = int(os.getenv('CONTAINER_DEFAULT_MEM_LIMIT_MB', '2048'))
+CONTAINER_DEFAULT_NANO_CPUS = int(os.getenv('CONTAINER_DEFAULT_NANO_CPUS', '1000000000'))  # 1 CPU
+CONTAINER_DEFAULT_PIDS_LIMIT = int(os.getenv('CONTAINER_DEFAULT_PIDS_LIMIT', '1024'))
+
+# Host size (0 = read from `docker info`), minus what the host itself needs
+CAPACITY_MEMORY_MB = int(os.getenv('CAPACITY_MEMORY_MB', '0'))
+CAPACITY_CPUS = float(os.getenv('CAPACITY_CPUS', '0'))
+CAPACITY_RESERVED_MEMORY_MB = int(os.getenv('CAPACITY_RESERVED_MEMORY_MB', '1024'))
+
+# Memory limits are hard, so memory is not overcommitted by default; CPU is shared by time slice
+CAPACITY_MEMORY_OVERCOMMIT = float(os.getenv('CAPACITY_MEMORY_OVERCOMMIT', '1.0'))
+CAPACITY_CPU_OVERCOMMIT = float(os.getenv('CAPACITY_CPU_OVERCOMMIT', '4.0'))
+
+# Upper bound on instance containers per host (0 = no bound besides memory and CPU)
+CAPACITY_MAX_CONTAINERS = int(os.getenv('CAPACITY_MAX_CONTAINERS', '0'))
+
+# How often queued instances are retried (they are also retried whenever a container stops)
+CAPACITY_QUEUE_POLL_SECONDS = int(os.getenv('CAPACITY_QUEUE_POLL_SECONDS', '30'))
+
+# Serializes check-and-create on a host across server processes (second key: the host)
+CAPACITY_LOCK_KEY = 4173023
+
+HOST_INFO_TTL_SECONDS = 300
+
+LABEL_INSTANCE_ID = 'ai-oa.instance_id'
+LABEL_TEST_ID = 'ai-oa.test_id'
+LABEL_MEM_LIMIT_MB = 'ai-oa.mem_limit_mb'
+LABEL_NANO_CPUS = 'ai-oa.nano_cpus'
+
+# Containers in these states hold their memory (exited ones do not)
+ACTIVE_CONTAINER_STATES = ('created', 'running', 'restarting', 'paused')
+
+RESOURCE_LIMIT_FIELDS = {
+    'memLimitMb': 'mem_limit_mb',
+    'nanoCpus': 'nano_cpus',
+    'pidsLimit': 'pids_limit'
+}
+
+_host_info = {}  # host name -> {'expires', 'memory_mb', 'cpus'}
+
+
+class CapacityError(Exception):
+    """Raised when the Docker host has no room for another container."""
+
+    def __init__(self, snapshot, profile):
+        self.snapshot = snapshot
+        self.profile = profile
+        super().__init__(
+            f"Docker host is at capacity ({snapshot['containers']} containers, "
+            f"{snapshot['memory_mb']['headroom']} MB and {snapshot['cpus']['headroom']} CPUs free)"
+        )
+
+
+def parse_resource_limits(data):
+    """
+    Read the resource limit fields present in a test create/update payload (camelCase or
+    snake_case). Returns {column: value}; null clears a limit back to the default.
+    """
+    limits = {}
+    for js_field, db_field in RESOURCE_LIMIT_FIELDS.items():
+        key = js_field if js_field in data else db_field if db_field in data else None
+        if key is None:
+            continue
+        value = data[key]
+        if value is None or value == '':
+            limits[db_field] = None
+            continue
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f'{js_field} must be a positive integer')
+        if value <= 0:
+            raise ValueError(f'{js_field} must be a positive integer')
+        limits[db_field] = value
+    return limits
+
+def resource_profile(test):
+    """Limits for a test's containers, with defaults for unset ones"""
+    return {
+        'mem_limit_mb': test.get('mem_limit_mb') or CONTAINER_DEFAULT_MEM_LIMIT_MB,
+        'nano_cpus': test.get('nano_cpus') or CONTAINER_DEFAULT_NANO_CPUS,
+        'pids_limit': test.get('pids_limit') or CONTAINER_DEFAULT_PIDS_LIMIT
+    }
+
+def container_resource_options(profile):
+    """Keyword arguments for client.containers.create"""
+    return {
+        'mem_limit': f"{profile['mem_limit_mb']}m",
+        # No swap beyond the memory limit
+        'memswap_limit': f"{profile['mem_limit_mb']}m",
+        'nano_cpus': profile['nano_cpus'],
+        'pids_limit': profile['pids_limit']
+    }
+
+def container_labels(instance_id, test_id, profile):
+    return {
+        LABEL_INSTANCE_ID: str(instance_id),
+        LABEL_TEST_ID: str(test_id),
+        LABEL_MEM_LIMIT_MB: str(profile['mem_limit_mb']),
+        LABEL_NANO_CPUS: str(profile['nano_cpus'])
+    }
+
+def _host_size(client, host):
+    """(memory_mb, cpus) of a Docker host, from `docker info` unless configured"""
+    cached = _host_info.get(host.get('name'))
+    if cached is None or time.monotonic() >= cached['expires']:
+        info = client.info()
+        cached = _host_info[host.get('name')] = {
+            'memory_mb': int(info.get('MemTotal', 0)) // (1024 * 1024),
+            'cpus': info.get('NCPU', 0),
+            'expires': time.monotonic() + HOST_INFO_TTL_SECONDS
+        }
+    return (
+        host.get('memory_mb') or CAPACITY_MEMORY_MB or cached['memory_mb'],
+        host.get('cpus') or CAPACITY_CPUS or cached['cpus']
+    )
+
+def _max_containers(host):
+    return (host or {}).get('max_containers') or CAPACITY_MAX_CONTAINERS
+
+def count_queued_instances():
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT COUNT(*) AS queued FROM test_instances WHERE provisioning_status = 'queued'")
+        return cursor.fetchone()['queued']
+    finally:
+        conn.close()
+
+def get_capacity(client, include_queue=True, host=None):
+    """
+    Current density and headroom of a Docker host (host: its registry entry, for overrides).
+
+    Instance containers created before limits existed carry no labels; they are counted with
+    the default profile.
+    """
+    host = host or {}
+    memory_mb, cpus = _host_size(client, host)
+    # sparse: one API call, no per-container inspect (labels come from the list itself)
+    containers = client.containers.list(all=True, sparse=True, filters={'name': 'instance-'})
+    count, reserved_memory_mb, reserved_nano_cpus = 0, 0, 0
+    for container in containers:
+        if container.attrs.get('State') not in ACTIVE_CONTAINER_STATES:
+            continue
+        labels = container.attrs.get('Labels') or {}
+        count += 1
+        reserved_memory_mb += int(labels.get(LABEL_MEM_LIMIT_MB, CONTAINER_DEFAULT_MEM_LIMIT_MB))
+        reserved_nano_cpus += int(labels.get(LABEL_NANO_CPUS, CONTAINER_DEFAULT_NANO_CPUS))
+
+    memory_capacity = int(max(memory_mb - CAPACITY_RESERVED_MEMORY_MB, 0) * CAPACITY_MEMORY_OVERCOMMIT)
+    cpu_capacity = round(cpus * CAPACITY_CPU_OVERCOMMIT, 2)
+    reserved_cpus = round(reserved_nano_cpus / 1e9, 2)
+    snapshot = {
+        'containers': count,
+        'max_containers': _max_containers(host) or None,
+        'memory_mb': {
+            'host': memory_mb,
+            'capacity': memory_capacity,
+            'reserved': reserved_memory_mb,
+            'headroom': memory_capacity - reserved_memory_mb
+        },
+        'cpus': {
+            'host': cpus,
+            'capacity': cpu_capacity,
+            'reserved': reserved_cpus,
+            'headroom': round(cpu_capacity - reserved_cpus, 2)
+        }
+    }
+    default_profile = resource_profile({})
+    snapshot['saturated'] = not has_room(snapshot, default_profile, host)
+    if include_queue:
+        snapshot['queued'] = count_queued_instances()
+    return snapshot
+
+def has_room(snapshot, profile, host=None):
+    """Whether a container with this profile fits in the snapshot's headroom"""
+    max_containers = _max_containers(host)
+    if max_containers and snapshot['containers'] >= max_containers:
+        return False
+    return (
+        snapshot['memory_mb']['headroom'] >= profile['mem_limit_mb']
+        and snapshot['cpus']['headroom'] * 1e9 >= profile['nano_cpus']
+    )
+
+@contextmanager
+def reserve_capacity(client, profile, host=None):
+    """
+    Hold a host's capacity lock while the caller creates a container with this profile on it;
+    raises CapacityError if it does not fit. Create the container (labelled with
+    container_labels) inside the block, so the next check counts it.
+    """
+    host = host or {}
+    host_key = zlib.crc32(host.get('name', '').encode('utf-8')) & 0x7fffffff
+    conn = get_connection()
+    conn.autocommit = True
+    cursor = conn.cursor()
+    try:
+        cursor.execute('SELECT pg_advisory_lock(%s, %s)', (CAPACITY_LOCK_KEY, host_key))
+        try:
+            snapshot = get_capacity(client, include_queue=False, host=host)
+            if not has_room(snapshot, profile, host):
+                raise CapacityError(snapshot, profile)
+            yield snapshot
+        finally:
+            cursor.execute('SELECT pg_advisory_unlock(%s, %s)', (CAPACITY_LOCK_KEY, host_key))
+    finally:
+        conn.close()
@@ -1,8 +1,12 @@
+import logging
 import os
-import json
 from pathlib import Path
 from openai import AzureOpenAI
 from database.db_postgresql import get_connection
+from database.file_store import SharedJsonFile
+from controllers.events_controller import publish_event
+
+logger = logging.getLogger(__name__)
 
 # Get environment variables
 endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
@@ -16,36 +20,35 @@ CHAT_DATA_FILE = Path(__file__).parent.parent / 'data' / 'chat-history.json'
 # Store chat history with instanceId as the key
 chat_histories = {}
 
+# Legacy file-backed history (chat is stored in Postgres); shared safely between worker processes
+_chat_file = SharedJsonFile(CHAT_DATA_FILE)
+
 def load_chat_histories():
     """Load chat histories from persistent storage"""
     try:
-        # Create data directory if it doesn't exist
-        data_dir = CHAT_DATA_FILE.parent
-        data_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Check if chat data file exists
-        if not CHAT_DATA_FILE.exists():
-            print(f"Chat data file does not exist. Creating empty file at: {CHAT_DATA_FILE}")
-            with open(CHAT_DATA_FILE, 'w') as f:
-                json.dump({}, f)
-            return
-        
-        # Load chat histories
-        with open(CHAT_DATA_FILE, 'r') as f:
-            chat_data = json.load(f)
-        
-        # Clear current histories
-        chat_histories.clear()
-        
-        # Restore chat histories
-        for instance_id, history in chat_data.items():
-            # Remove duplicates before adding to memory
-            history = remove_consecutive_duplicates(history)
-            chat_histories[instance_id] = history
+        with _chat_file.locked():
+            # Check if chat data file exists
+            if not _chat_file.exists():
+                logger.info("Chat data file does not exist. Creating empty file at: %s", CHAT_DATA_FILE)
+                chat_histories.clear()
+                _chat_file.write({})
+                return
+            
+            # Load chat histories
+            chat_data = _chat_file.read()
+            
+            # Clear current histories
+            chat_histories.clear()
+            
+            # Restore chat histories
+            for instance_id, history in chat_data.items():
+                # Remove duplicates before adding to memory
+                history = remove_consecutive_duplicates(history)
+                chat_histories[instance_id] = history
         
-        print(f"Loaded chat histories for {len(chat_histories)} instances")
+        logger.debug("Loaded chat histories for %s instances", len(chat_histories))
     except Exception as e:
-        print(f"Error loading chat histories: {str(e)}")
+        logger.error(f"Error loading chat histories: {str(e)}")
 
 def remove_consecutive_duplicates(history):
     """Remove consecutive duplicate messages from history"""
@@ -59,30 +62,30 @@ def remove_consecutive_duplicates(history):
     for message in history:
         # Skip if this message is identical to the previous one
         if prev_message and prev_message.get('role') == message.get('role') and prev_message.get('content') == message.get('content'):
-            print(f"Removing duplicate message: {message.get('content')[:30]}...")
+            logger.debug("Removing duplicate message: %.30s...", message.get('content'))
             continue
         
         cleaned_history.append(message)
         prev_message = message
     
     if len(history) != len(cleaned_history):
-        print(f"Removed {len(history) - len(cleaned_history)} duplicate messages")
+        logger.debug("Removed %s duplicate messages", len(history) - len(cleaned_history))
     
     return cleaned_history
 
 def save_chat_histories():
     """Save chat histories to persistent storage"""
     try:
-        # First, clean up any duplicates
-        for instance_id in chat_histories:
-            chat_histories[instance_id] = remove_consecutive_duplicates(chat_histories[instance_id])
-            
-        # Save to file
-        with open(CHAT_DATA_FILE, 'w') as f:
-            json.dump(chat_histories, f, indent=2)
-        print(f"Saved chat histories for {len(chat_histories)} instances")
+        with _chat_file.locked():
+            # First, clean up any duplicates
+            for instance_id in chat_histories:
+                chat_histories[instance_id] = remove_consecutive_duplicates(chat_histories[instance_id])
+                
+            # Save to file (atomic replace, so other workers never read a partial file)
+            _chat_file.write(chat_histories)
+        logger.debug("Saved chat histories for %s instances", len(chat_histories))
     except Exception as e:
-        print(f"Error saving chat histories: {str(e)}")
+        logger.error(f"Error saving chat histories: {str(e)}")
 
 def get_chat_history(instance_id):
     """Get chat history for a test instance, normalized to {role, content}."""
@@ -114,6 +117,49 @@ def get_chat_history(instance_id):
     finally:
         conn.close()
 
+def get_chat_history_version(instance_id):
+    """
+    Return (history version, project helper flag) for an instance in one query: together they
+    identify the /chat/history response (see controllers/versions_controller.py).
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''
+            SELECT
+                COALESCE((
+                    SELECT version FROM resource_versions
+                    WHERE resource = 'chat' AND scope_id = %(instance_id)s
+                ), 0) AS version,
+                COALESCE((
+                    SELECT t.project_helper_enabled
+                    FROM test_instances ti
+                    JOIN tests t ON ti.test_id = t.id
+                    WHERE ti.id = %(instance_id)s
+                ), FALSE) AS project_helper_enabled
+        ''', {'instance_id': int(instance_id)})
+        row = cursor.fetchone()
+        return row['version'], bool(row['project_helper_enabled'])
+    finally:
+        conn.close()
+
+def get_latest_phase_marker(instance_id):
+    """Return the latest PHASE_MARKER message of an instance (e.g. 'PHASE_MARKER: project'), or None"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''
+            SELECT message
+            FROM chat_history
+            WHERE instance_id = %s AND message LIKE 'PHASE_MARKER:%%'
+            ORDER BY created_at DESC, id DESC
+            LIMIT 1
+        ''', (int(instance_id),))
+        row = cursor.fetchone()
+        return row['message'] if row else None
+    finally:
+        conn.close()
+
 def get_project_helper_flag(instance_id):
     """Return True if the associated test enables the project helper chatbot."""
     if not instance_id:
@@ -161,6 +207,10 @@ def add_chat_message(instance_id, message):
 
         inserted_id = cursor.fetchone()['id']
 
+        # Phase changes are pushed to /timer/stream and /timer/poll subscribers (on commit)
+        if isinstance(content, str) and content.startswith('PHASE_MARKER:'):
+            publish_event(instance_id, 'phase', {'marker': content}, cursor=cursor)
+
         # If this message marks the test as completed, update test_candidates
         if isinstance(content, str) and content.strip().upper().startswith('PHASE_MARKER: FINAL_COMPLETED'):
             cursor.execute(
@@ -171,6 +221,7 @@ def add_chat_message(instance_id, message):
             if instance_row and instance_row.get('test_id') and instance_row.get('candidate_id'):
                 test_id = instance_row['test_id']
                 candidate_id = instance_row['candidate_id']
+                # The test's completion counts are refreshed by the test_stats triggers
                 cursor.execute(
                     '''
                     UPDATE test_candidates
@@ -179,17 +230,6 @@ def add_chat_message(instance_id, message):
                     ''',
                     (test_id, candidate_id)
                 )
-                if cursor.rowcount > 0:
-                    cursor.execute(
-                        '''
-                        UPDATE tests
-                        SET candidates_completed = (
-                            SELECT COUNT(*) FROM test_candidates WHERE test_id = %s AND completed = TRUE
-                        )
-                        WHERE id = %s
-                        ''',
-                        (test_id, test_id)
-                    )
 
         conn.commit()
 
@@ -248,7 +288,7 @@ async def get_chat_response(messages):
         str: The chat response.
     """
     try:
-        print(f"Creating OpenAI client with endpoint: {endpoint}, api_version: {api_version}")
+        logger.debug("Creating OpenAI client with endpoint: %s, api_version: %s", endpoint, api_version)
         
         # Create an AzureOpenAI client with the given configuration.
         # Use a try-except block to handle both newer and older versions of the API
@@ -260,15 +300,14 @@ async def get_chat_response(messages):
                 azure_endpoint=endpoint
             )
         except TypeError as e:
-            print(f"TypeError creating OpenAI client: {e}. Trying alternative initialization...")
+            logger.warning(f"TypeError creating OpenAI client: {e}. Trying alternative initialization...")
             # Fallback for older versions
             from openai import OpenAI
             client = OpenAI(
                 api_key=api_key
             )
 
-        # Print the model being used for debugging
-        print(f"Using deployment model: {deployment}")
+        logger.debug("Using deployment model: %s", deployment)
 
         # Call the chat completions API with the provided messages.
         result = client.chat.completions.create(
@@ -280,16 +319,16 @@ async def get_chat_response(messages):
         # Check if the result contains choices and return the first reply.
         if result.choices and len(result.choices) > 0:
             response = result.choices[0].message.content
-            print(f"Successfully received response from OpenAI")
+            logger.debug("Received response from OpenAI")
             return response
         else:
             raise ValueError("No choices returned from Azure OpenAI")
     except Exception as e:
-        print(f"Detailed error from OpenAI: {str(e)}")
+        logger.error(f"Error from OpenAI: {str(e)}")
         
         # Return a fallback response for development/testing
         if not endpoint or not api_key:
-            print("Using fallback response due to missing OpenAI credentials")
+            logger.warning("Using fallback response due to missing OpenAI credentials")
             return "I'm a simulated AI response since no valid OpenAI credentials were provided. In a real environment, I would respond to your message based on the content provided."
         
         raise Exception(f"Error calling Azure OpenAI: {str(e)}")
@@ -310,7 +349,7 @@ def create_report_completion(messages, report_schema):
     """
     
     try:
-        print(f"Creating OpenAI client with endpoint: {endpoint}, api_version: {api_version}")
+        logger.debug("Creating OpenAI client with endpoint: %s, api_version: %s", endpoint, api_version)
         
         # Create an AzureOpenAI client with the given configuration.
         # Use a try-except block to handle both newer and older versions of the API
@@ -322,15 +361,14 @@ def create_report_completion(messages, report_schema):
                 azure_endpoint=endpoint
             )
         except TypeError as e:
-            print(f"TypeError creating OpenAI client: {e}. Trying alternative initialization...")
+            logger.warning(f"TypeError creating OpenAI client: {e}. Trying alternative initialization...")
             # Fallback for older versions
             from openai import OpenAI
             client = OpenAI(
                 api_key=api_key
             )
 
-        # Print the model being used for debugging
-        print(f"Using deployment model: {deployment}")
+        logger.debug("Using deployment model: %s", deployment)
 
 
         # Call the chat completions API with the provided messages.
@@ -345,19 +383,16 @@ def create_report_completion(messages, report_schema):
         # Check if the result contains choices and return the first reply.
         if result.choices and len(result.choices) > 0:
             response = result.choices[0].message.parsed
-            print("Successfully received response from OpenAI")
+            logger.debug("Received response from OpenAI")
             return response
         else:
             raise ValueError("No choices returned from Azure OpenAI")
     except Exception as e:
-        print(f"Detailed error from OpenAI: {str(e)}")
+        logger.error(f"Error from OpenAI: {str(e)}")
         
         # Return a fallback response for development/testing
         if not endpoint or not api_key:
-            print("Using fallback response due to missing OpenAI credentials")
+            logger.warning("Using fallback response due to missing OpenAI credentials")
             return "I'm a simulated AI response since no valid OpenAI credentials were provided. In a real environment, I would respond to your message based on the content provided."
         
         raise Exception(f"Error calling Azure OpenAI: {str(e)}")
-
-# Load chat histories on module initialization
-load_chat_histories() 
\ No newline at end of file
@@ -0,0 +1,496 @@
+"""
+Rendering of candidate submissions into prompt text for report generation.
+
+Files are filtered with default ignore rules plus the submission's own
+.gitignore files, capped by size and checked for binary content. Rendered
+file bodies are cached by git blob hash, so re-uploads (and template files
+shared between candidates) only re-render the files that actually changed.
+
+Uploaded archives are read member by member (iter_zip_entries) with limits on
+entry count and uncompressed size, so a submission is decompressed exactly once.
+"""
+import hashlib
+import logging
+import os
+import re
+import shutil
+import stat
+import tempfile
+import threading
+import zipfile
+from collections import OrderedDict
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Paths that are never treated as part of a submission
+ALWAYS_IGNORED_PATTERNS = [
+    '.git/',
+    '.hg/',
+    '.svn/',
+    '__MACOSX/',
+    '.DS_Store',
+    'Thumbs.db',
+    'node_modules/',
+    '__pycache__/',
+    '.venv/',
+    'venv/',
+    '.mypy_cache/',
+    '.pytest_cache/',
+    '.ruff_cache/',
+    '.tox/',
+    '.gradle/',
+    '.next/',
+    '.nuxt/',
+    '.cache/',
+]
+
+# Paths that are kept in the submission but are not worth rendering into the prompt
+RENDER_IGNORED_PATTERNS = [
+    'dist/',
+    'build/',
+    'target/',
+    'out/',
+    'coverage/',
+    'vendor/',
+    '.idea/',
+    '.vscode/',
+    'package-lock.json',
+    'yarn.lock',
+    'pnpm-lock.yaml',
+    'bun.lockb',
+    'Cargo.lock',
+    'poetry.lock',
+    'Pipfile.lock',
+    'uv.lock',
+    'composer.lock',
+    'Gemfile.lock',
+    'go.sum',
+    '*.min.js',
+    '*.min.css',
+    '*.map',
+    '*.pyc',
+    '*.pyo',
+    '*.class',
+    '*.jar',
+    '*.o',
+    '*.a',
+    '*.so',
+    '*.dylib',
+    '*.dll',
+    '*.exe',
+    '*.log',
+]
+
+# Files larger than this are listed in the tree but not rendered
+MAX_RENDER_FILE_BYTES = int(os.getenv('CODEBASE_MAX_FILE_BYTES', str(256 * 1024)))
+
+# Upper bound for the rendered-file cache (characters of rendered text)
+RENDER_CACHE_MAX_CHARS = int(os.getenv('CODEBASE_RENDER_CACHE_CHARS', str(64 * 1024 * 1024)))
+
+# Limits for uploaded submission archives
+SUBMISSION_MAX_ENTRIES = int(os.getenv('SUBMISSION_MAX_ENTRIES', '20000'))
+SUBMISSION_MAX_TOTAL_BYTES = int(os.getenv('SUBMISSION_MAX_TOTAL_BYTES', str(200 * 1024 * 1024)))
+SUBMISSION_MAX_FILE_BYTES = int(os.getenv('SUBMISSION_MAX_FILE_BYTES', str(50 * 1024 * 1024)))
+
+ZIP_READ_CHUNK_BYTES = 64 * 1024
+
+# Git uses the same window to decide whether a blob is binary
+BINARY_SNIFF_BYTES = 8000
+
+_render_cache = OrderedDict()  # blob sha -> (rendered body, token estimate)
+_render_cache_chars = 0
+_render_cache_lock = threading.Lock()
+
+
+def _glob_to_regex(pattern):
+    """Translate a gitignore glob (without leading '!' or trailing '/') to a regex."""
+    i = 0
+    out = []
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '*':
+            if pattern[i:i + 3] == '**/':
+                out.append('(?:.*/)?')
+                i += 3
+                continue
+            if pattern[i:i + 2] == '**':
+                out.append('.*')
+                i += 2
+                continue
+            out.append('[^/]*')
+        elif char == '?':
+            out.append('[^/]')
+        elif char == '[':
+            end = pattern.find(']', i + 1)
+            if end == -1:
+                out.append(re.escape(char))
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                out.append(f'[{body}]')
+                i = end
+        elif char == '\\' and i + 1 < len(pattern):
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(char))
+        i += 1
+    return re.compile(''.join(out) + r'\Z')
+
+
+class IgnoreRules:
+    """A small gitignore matcher: supports negation, anchoring, '**' and directory-only rules.
+
+    Rules from nested .gitignore files are scoped to the directory they were found in,
+    and the last matching rule wins, as in git.
+    """
+
+    def __init__(self, patterns=None):
+        self._rules = []
+        if patterns:
+            self.add_lines(patterns)
+
+    def add_lines(self, lines, base=''):
+        base = base.strip('/')
+        base = f'{base}/' if base else ''
+        for raw in lines:
+            line = raw.rstrip('\n').rstrip('\r')
+            if not line.strip() or line.startswith('#'):
+                continue
+            line = line.rstrip(' ') if not line.endswith('\\ ') else line
+            negate = line.startswith('!')
+            if negate:
+                line = line[1:]
+            elif line.startswith('\\'):
+                line = line[1:]
+            dir_only = line.endswith('/')
+            line = line.strip('/') if dir_only else line
+            anchored = '/' in line
+            line = line.lstrip('/')
+            if not line:
+                continue
+            self._rules.append((base, _glob_to_regex(line), negate, dir_only, anchored))
+
+    def add_gitignore(self, content, base=''):
+        if isinstance(content, bytes):
+            content = content.decode('utf-8', errors='replace')
+        self.add_lines(content.splitlines(), base)
+
+    def copy(self):
+        clone = IgnoreRules()
+        clone._rules = list(self._rules)
+        return clone
+
+    def matches(self, path, is_dir=False):
+        """Return True if this exact path is ignored (ancestors are not considered)."""
+        path = path.strip('/')
+        ignored = False
+        for base, regex, negate, dir_only, anchored in self._rules:
+            if dir_only and not is_dir:
+                continue
+            if base and not path.startswith(base):
+                continue
+            relative = path[len(base):]
+            target = relative if anchored else relative.rsplit('/', 1)[-1]
+            if regex.match(target):
+                ignored = not negate
+        return ignored
+
+    def is_ignored(self, path, is_dir=False):
+        """Return True if the path or any of its parent directories is ignored."""
+        parts = path.strip('/').split('/')
+        for depth in range(1, len(parts)):
+            if self.matches('/'.join(parts[:depth]), is_dir=True):
+                return True
+        return self.matches(path, is_dir=is_dir)
+
+
+def submission_ignore_rules():
+    """Rules for paths that never belong in a submission."""
+    return IgnoreRules(ALWAYS_IGNORED_PATTERNS)
+
+
+def render_ignore_rules():
+    """Rules for paths that are kept in a submission but skipped when rendering."""
+    return IgnoreRules(ALWAYS_IGNORED_PATTERNS + RENDER_IGNORED_PATTERNS)
+
+
+def git_blob_sha(data):
+    """Return the git blob hash for the given bytes."""
+    return hashlib.sha1(b'blob %d\0' % len(data) + data).hexdigest()
+
+
+def is_binary(data):
+    return b'\0' in data[:BINARY_SNIFF_BYTES]
+
+
+def estimate_tokens(text):
+    """Approximate the token count of a piece of text (~4 characters per token)."""
+    if not text:
+        return 0
+    return (len(text) + 3) // 4
+
+
+def _code_fence_language(path):
+    suffix = Path(path).suffix.lstrip('.')
+    return suffix or ''
+
+
+def _render_blob(blob_sha, data):
+    """Render a blob body, reusing a cached rendering when the blob was seen before."""
+    global _render_cache_chars
+    with _render_cache_lock:
+        cached = _render_cache.get(blob_sha)
+        if cached is not None:
+            _render_cache.move_to_end(blob_sha)
+            return cached[0], cached[1], True
+
+    body = data.decode('utf-8', errors='replace')
+    tokens = estimate_tokens(body)
+
+    with _render_cache_lock:
+        if blob_sha not in _render_cache and len(body) <= RENDER_CACHE_MAX_CHARS:
+            _render_cache[blob_sha] = (body, tokens)
+            _render_cache_chars += len(body)
+            while _render_cache_chars > RENDER_CACHE_MAX_CHARS and _render_cache:
+                _, (evicted_body, _) = _render_cache.popitem(last=False)
+                _render_cache_chars -= len(evicted_body)
+    return body, tokens, False
+
+
+def _render_tree(paths):
+    """Render a simple indented source tree for the given file paths."""
+    lines = []
+    seen_dirs = set()
+    for path in sorted(paths):
+        parts = path.split('/')
+        for depth, name in enumerate(parts[:-1]):
+            directory = '/'.join(parts[:depth + 1])
+            if directory not in seen_dirs:
+                seen_dirs.add(directory)
+                lines.append(f"{'    ' * depth}{name}/")
+        lines.append(f"{'    ' * (len(parts) - 1)}{parts[-1]}")
+    return '\n'.join(lines)
+
+
+def render_codebase_entries(entries, root_label='.', ignore_rules=None):
+    """
+    Render submission files into a single prompt document.
+
+    Args:
+        entries: Iterable of (relative_path, data_bytes[, mode]) tuples. Paths use '/' separators.
+        root_label (str): Label shown as the project path in the rendered prompt.
+        ignore_rules (IgnoreRules, optional): Rules to apply. Defaults to render_ignore_rules()
+                                              plus any .gitignore files found in the entries.
+
+    Returns:
+        dict: {
+            'prompt': rendered text,
+            'token_count': total token estimate,
+            'files': [{'path', 'blob_sha', 'bytes', 'tokens', 'cached'}],
+            'skipped': [{'path', 'reason'}]
+        }
+    """
+    entries = list(entries)
+    rules = ignore_rules.copy() if ignore_rules is not None else render_ignore_rules()
+    if ignore_rules is None:
+        # Apply the submission's own .gitignore files, shallowest first
+        gitignores = sorted(
+            (entry[0] for entry in entries if entry[0].rsplit('/', 1)[-1] == '.gitignore'),
+            key=lambda p: p.count('/')
+        )
+        by_path = {entry[0]: entry[1] for entry in entries}
+        for path in gitignores:
+            rules.add_gitignore(by_path[path], base=path.rsplit('/', 1)[0] if '/' in path else '')
+
+    files = []
+    skipped = []
+    sections = []
+    for entry in sorted(entries, key=lambda entry: entry[0]):
+        path, data = entry[0], entry[1]
+        if rules.is_ignored(path):
+            skipped.append({'path': path, 'reason': 'ignored'})
+            continue
+        if len(data) > MAX_RENDER_FILE_BYTES:
+            skipped.append({'path': path, 'reason': 'too_large'})
+            continue
+        if is_binary(data):
+            skipped.append({'path': path, 'reason': 'binary'})
+            continue
+
+        blob_sha = git_blob_sha(data)
+        body, body_tokens, cached = _render_blob(blob_sha, data)
+        section = f"`{path}`:\n\n```{_code_fence_language(path)}\n{body}\n```\n"
+        tokens = body_tokens + estimate_tokens(path) + 4
+        sections.append(section)
+        files.append({
+            'path': path,
+            'blob_sha': blob_sha,
+            'bytes': len(data),
+            'tokens': tokens,
+            'cached': cached
+        })
+
+    tree = _render_tree([f['path'] for f in files])
+    header = f"Project Path: {root_label}\n\nSource Tree:\n\n```\n{tree}\n```\n\n"
+    prompt = header + '\n'.join(sections)
+    token_count = estimate_tokens(header) + sum(f['tokens'] for f in files)
+
+    cache_hits = sum(1 for f in files if f['cached'])
+    logger.info(
+        f"Rendered {len(files)} files ({cache_hits} cached, {len(skipped)} skipped), ~{token_count} tokens"
+    )
+    return {
+        'prompt': prompt,
+        'token_count': token_count,
+        'files': files,
+        'skipped': skipped
+    }
+
+
+def iter_directory_entries(root, ignore_rules=None):
+    """
+    Walk a directory and yield (relative_path, data_bytes, mode) for each file that is not ignored.
+
+    mode is the git file mode (0o100755 for executables, 0o100644 otherwise).
+
+    Ignored directories are pruned without being descended into, and nested .gitignore
+    files are applied to the directory they live in.
+    """
+    root = Path(root)
+    rules = ignore_rules.copy() if ignore_rules is not None else submission_ignore_rules()
+    for dirpath, dirnames, filenames in os.walk(root):
+        relative_dir = Path(dirpath).relative_to(root).as_posix()
+        relative_dir = '' if relative_dir == '.' else relative_dir
+        if '.gitignore' in filenames:
+            try:
+                with open(Path(dirpath) / '.gitignore', 'rb') as f:
+                    rules.add_gitignore(f.read(), base=relative_dir)
+            except OSError as e:
+                logger.warning(f"Could not read .gitignore in {dirpath}: {e}")
+
+        kept_dirs = []
+        for dirname in sorted(dirnames):
+            relative = f"{relative_dir}/{dirname}" if relative_dir else dirname
+            if not rules.matches(relative, is_dir=True) and not os.path.islink(Path(dirpath) / dirname):
+                kept_dirs.append(dirname)
+        dirnames[:] = kept_dirs
+
+        for filename in sorted(filenames):
+            relative = f"{relative_dir}/{filename}" if relative_dir else filename
+            full_path = Path(dirpath) / filename
+            if rules.matches(relative) or full_path.is_symlink():
+                continue
+            mode = 0o100755 if os.access(full_path, os.X_OK) else 0o100644
+            with open(full_path, 'rb') as f:
+                yield relative, f.read(), mode
+
+
+def _safe_zip_path(name):
+    """Normalize a zip member name, rejecting absolute paths and parent-directory escapes."""
+    name = name.replace('\\', '/')
+    if name.startswith('/') or re.match(r'^[A-Za-z]:', name):
+        raise ValueError(f"Archive entry has an absolute path: {name}")
+    parts = [part for part in name.split('/') if part not in ('', '.')]
+    if '..' in parts:
+        raise ValueError(f"Archive entry escapes the project directory: {name}")
+    return '/'.join(parts)
+
+
+def _read_zip_member(archive, info, budget):
+    """Read one member, enforcing the per-file limit and the remaining total budget on actual bytes."""
+    limit = min(SUBMISSION_MAX_FILE_BYTES, budget)
+    chunks = []
+    size = 0
+    with archive.open(info) as member:
+        while True:
+            chunk = member.read(ZIP_READ_CHUNK_BYTES)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > limit:
+                if limit == budget:
+                    raise ValueError(
+                        f"Archive exceeds the {SUBMISSION_MAX_TOTAL_BYTES} byte limit for uncompressed content"
+                    )
+                raise ValueError(
+                    f"Archive entry {info.filename} exceeds the {SUBMISSION_MAX_FILE_BYTES} byte file limit"
+                )
+            chunks.append(chunk)
+    return b''.join(chunks)
+
+
+def iter_zip_entries(fileobj, ignore_rules=None):
+    """
+    Read a submission archive and yield (relative_path, data_bytes, mode) for each kept file.
+
+    Members are read straight from the archive, one at a time, without extracting to disk.
+    Ignored paths (default rules plus the archive's own .gitignore files) are skipped
+    without being decompressed, and symlinks are dropped.
+
+    Raises:
+        ValueError: If the file is not a zip archive, has too many entries, exceeds the
+                    size limits, or contains absolute or parent-escaping paths.
+    """
+    if not fileobj.seekable():
+        spooled = tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024)
+        shutil.copyfileobj(fileobj, spooled)
+        spooled.seek(0)
+        fileobj = spooled
+
+    try:
+        archive = zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile as e:
+        raise ValueError(f"Uploaded file is not a valid zip archive: {e}")
+
+    with archive:
+        infos = archive.infolist()
+        if len(infos) > SUBMISSION_MAX_ENTRIES:
+            raise ValueError(f"Archive has {len(infos)} entries; the limit is {SUBMISSION_MAX_ENTRIES}")
+
+        members = []
+        for info in infos:
+            path = _safe_zip_path(info.filename)
+            if not path or info.is_dir():
+                continue
+            unix_mode = info.external_attr >> 16
+            if stat.S_ISLNK(unix_mode):
+                continue
+            if info.flag_bits & 0x1:
+                raise ValueError(f"Archive entry {info.filename} is encrypted")
+            members.append((path, info, unix_mode))
+
+        budget = SUBMISSION_MAX_TOTAL_BYTES
+        rules = ignore_rules.copy() if ignore_rules is not None else submission_ignore_rules()
+
+        # Read .gitignore files first (shallowest first) so their rules apply to every member
+        gitignores = sorted(
+            (m for m in members if m[0].rsplit('/', 1)[-1] == '.gitignore'),
+            key=lambda m: m[0].count('/')
+        )
+        gitignore_data = {}
+        for path, info, _ in gitignores:
+            if rules.is_ignored(path):
+                continue
+            data = _read_zip_member(archive, info, budget)
+            budget -= len(data)
+            gitignore_data[path] = data
+            rules.add_gitignore(data, base=path.rsplit('/', 1)[0] if '/' in path else '')
+
+        for path, info, unix_mode in members:
+            if rules.is_ignored(path):
+                continue
+            data = gitignore_data.get(path)
+            if data is None:
+                data = _read_zip_member(archive, info, budget)
+                budget -= len(data)
+            mode = 0o100755 if unix_mode & 0o111 else 0o100644
+            yield path, data, mode
+
+
+def render_codebase_directory(root, root_label=None):
+    """Render every non-ignored file under a directory. See render_codebase_entries."""
+    root = Path(root)
+    return render_codebase_entries(iter_directory_entries(root), root_label=root_label or root.name)
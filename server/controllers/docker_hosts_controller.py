@@ -0,0 +1,232 @@
+"""
+Registry of the Docker hosts that run instance containers, and placement of new instances.
+
+DOCKER_HOSTS lists the hosts as JSON:
+
+    [{"name": "vm1", "url": "tcp://10.0.0.5:2376", "proxy_address": "10.0.0.5:80"},
+     {"name": "vm2", "url": "tcp://10.0.0.6:2376", "proxy_address": "10.0.0.6:80", "memory_mb": 32768}]
+
+Each entry may set tls (default true for tcp://, using the shared DOCKER_CA_CERT / DOCKER_CLIENT_CERT /
+DOCKER_CLIENT_KEY), and capacity overrides memory_mb, cpus and max_containers (see
+capacity_controller). proxy_address is where the host's nginx proxy is reachable from the others;
+the nginx map generated by instance_routing_map() sends each instance subdomain to the host of its
+container. Without DOCKER_HOSTS there is a single host, 'default', reached through DOCKER_HOST with
+a fallback to the local socket, as before.
+
+New instances are placed by PLACEMENT_POLICY: 'least_loaded' (most free memory, spreads load) or
+'bin_packing' (least free memory that still fits, keeps hosts free for scale-down). The chosen
+host is stored in test_instances.docker_host; later operations on the container go to that host.
+"""
+import atexit
+import json
+import logging
+import os
+import tempfile
+import threading
+
+import docker
+
+from controllers.capacity_controller import CapacityError, get_capacity, has_room
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DOCKER_HOST_NAME = 'default'
+
+PLACEMENT_POLICY = os.getenv('PLACEMENT_POLICY', 'least_loaded')
+PLACEMENT_POLICIES = ('least_loaded', 'bin_packing')
+
+DOCKER_CLIENT_TIMEOUT = 120
+
+_clients = {}  # host name -> DockerClient
+_clients_lock = threading.Lock()
+_tls_files = {}
+
+
+def _load_docker_hosts():
+    raw = os.getenv('DOCKER_HOSTS', '').strip()
+    if not raw:
+        return [{
+            'name': DEFAULT_DOCKER_HOST_NAME,
+            'url': os.getenv('DOCKER_HOST', 'tcp://167.99.52.130:2376'),
+            'tls': True,
+            'local_fallback': True
+        }]
+    hosts = json.loads(raw)
+    names = set()
+    for host in hosts:
+        if not host.get('name') or not host.get('url'):
+            raise ValueError('Every DOCKER_HOSTS entry needs a name and a url')
+        if host['name'] in names:
+            raise ValueError(f"Duplicate Docker host name {host['name']}")
+        names.add(host['name'])
+        host.setdefault('tls', host['url'].startswith('tcp://'))
+    return hosts
+
+DOCKER_HOSTS = _load_docker_hosts()
+
+if PLACEMENT_POLICY not in PLACEMENT_POLICIES:
+    raise ValueError(f"PLACEMENT_POLICY must be one of {', '.join(PLACEMENT_POLICIES)}")
+
+
+def get_docker_host(name=None):
+    """Registry entry of a host; None (instances created before the registry) is the first host"""
+    if not name:
+        return DOCKER_HOSTS[0]
+    for host in DOCKER_HOSTS:
+        if host['name'] == name:
+            return host
+    raise ValueError(f'Unknown Docker host {name}')
+
+def _tls_config():
+    """TLS config from the certificates in the environment (written to temp files once per process)"""
+    ca_cert = os.getenv('DOCKER_CA_CERT')
+    client_cert = os.getenv('DOCKER_CLIENT_CERT')
+    client_key = os.getenv('DOCKER_CLIENT_KEY')
+    if not all([ca_cert, client_cert, client_key]):
+        logger.error("Missing Docker TLS certificates in environment variables")
+        raise Exception("Docker TLS certificates not configured")
+
+    if not _tls_files:
+        def write_temp_cert(content, suffix):
+            temp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+            temp.write(content.encode('utf-8'))
+            temp.close()
+            return temp.name
+
+        _tls_files['ca'] = write_temp_cert(ca_cert, '.ca.pem')
+        _tls_files['cert'] = write_temp_cert(client_cert, '.cert.pem')
+        _tls_files['key'] = write_temp_cert(client_key, '.key.pem')
+        atexit.register(_cleanup_tls_files)
+
+    return docker.tls.TLSConfig(
+        ca_cert=_tls_files['ca'],
+        client_cert=(_tls_files['cert'], _tls_files['key']),
+        verify=True
+    )
+
+def _cleanup_tls_files():
+    for path in _tls_files.values():
+        try:
+            os.remove(path)
+        except Exception as e:
+            logger.warning(f"Failed to clean up {path}: {str(e)}")
+
+def _connect(host):
+    try:
+        client = docker.DockerClient(
+            base_url=host['url'],
+            tls=_tls_config() if host.get('tls') else False,
+            timeout=DOCKER_CLIENT_TIMEOUT
+        )
+        client.ping()
+        return client
+    except Exception as e:
+        logger.warning(f"Failed to connect to Docker host {host['name']} ({host['url']}): {str(e)}")
+        if not host.get('local_fallback'):
+            raise
+        try:
+            # Try to connect to the local Docker socket instead
+            client = docker.DockerClient(base_url='unix://var/run/docker.sock', timeout=DOCKER_CLIENT_TIMEOUT)
+            client.ping()
+            logger.info("Connected to local Docker socket")
+            return client
+        except Exception as local_e:
+            logger.error(f"Failed to connect to local Docker: {str(local_e)}")
+            raise
+
+def get_docker_client(host_name=None):
+    """
+    Docker client for a host (the first one by default). Clients are reused across calls and
+    checked with a ping; a host that stopped answering is reconnected.
+    """
+    host = get_docker_host(host_name)
+    client = _clients.get(host['name'])
+    if client is not None:
+        try:
+            client.ping()
+            return client
+        except Exception:
+            pass
+    client = _connect(host)
+    with _clients_lock:
+        _clients[host['name']] = client
+    return client
+
+def get_instance_docker_client(instance):
+    """Docker client of the host an instance's container was placed on"""
+    return get_docker_client(instance.get('docker_host'))
+
+def get_hosts_capacity():
+    """Capacity snapshot of every host (an unreachable host is reported with its error)"""
+    snapshots = []
+    for host in DOCKER_HOSTS:
+        try:
+            snapshot = get_capacity(get_docker_client(host['name']), include_queue=False, host=host)
+        except Exception as e:
+            snapshot = {'error': str(e), 'saturated': True}
+        snapshot['name'] = host['name']
+        snapshots.append(snapshot)
+    return snapshots
+
+def choose_docker_host(profile):
+    """
+    Pick the host for a container with this profile by PLACEMENT_POLICY. Returns the host's
+    name; raises CapacityError when no host has room.
+    """
+    candidates = []
+    best_effort = None
+    for snapshot in get_hosts_capacity():
+        if 'error' in snapshot:
+            continue
+        if best_effort is None or snapshot['memory_mb']['headroom'] > best_effort['memory_mb']['headroom']:
+            best_effort = snapshot
+        if has_room(snapshot, profile, get_docker_host(snapshot['name'])):
+            candidates.append(snapshot)
+    if not candidates:
+        if best_effort is None:
+            raise Exception('No Docker host is reachable')
+        raise CapacityError(best_effort, profile)
+
+    if PLACEMENT_POLICY == 'bin_packing':
+        chosen = min(candidates, key=lambda s: s['memory_mb']['headroom'])
+    else:
+        chosen = max(candidates, key=lambda s: s['memory_mb']['headroom'] / max(s['memory_mb']['capacity'], 1))
+    return chosen['name']
+
+def instance_routing_map(cursor, local_host_name):
+    """
+    nginx map entries (`instance-<id> <proxy address>;`) for the proxy of one host: instances
+    whose container runs on another host are sent to that host's proxy. Instances on the local
+    host need no entry (the map's default proxies to the container by name).
+    """
+    local = get_docker_host(local_host_name)
+    addresses = {host['name']: host.get('proxy_address') for host in DOCKER_HOSTS}
+    cursor.execute('''
+        SELECT id, COALESCE(docker_host, %s) AS docker_host
+        FROM test_instances
+        WHERE docker_instance_id IS NOT NULL
+        ORDER BY id
+    ''', (DOCKER_HOSTS[0]['name'],))
+    lines = [f"# Generated for Docker host {local['name']}; do not edit"]
+    for row in cursor.fetchall():
+        if row['docker_host'] == local['name']:
+            continue
+        address = addresses.get(row['docker_host'])
+        if address:
+            lines.append(f"instance-{row['id']} {address};")
+    return '\n'.join(lines) + '\n'
+
+def host_name(name):
+    """Registry name of the host stored on an instance (None: the first host)"""
+    return get_docker_host(name)['name']
+
+def connect_hosts(names):
+    """Clients for the hosts of several instances, {host name: client or None if unreachable}"""
+    clients = {}
+    for name in set(host_name(name) for name in names):
+        try:
+            clients[name] = get_docker_client(name)
+        except Exception as e:
+            logger.warning(f"Docker host {name} is unreachable: {str(e)}")
+            clients[name] = None
+    return clients
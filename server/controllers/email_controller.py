@@ -8,6 +8,7 @@ import hashlib
 from database.db_postgresql import get_connection
 from controllers.instances_controller import create_instance
 from controllers.access_controller import generate_instance_access_token, get_instance_url
+from controllers.jobs_controller import register_job
 from typing import List
 
 """
@@ -86,6 +87,61 @@ def send_test_invitations(test_id: int, candidate_ids: List[int], deadline: str
     finally:
         conn.close()
 
+@register_job('email.deadline_update', max_attempts=3, retry_delay=60)
+def send_deadline_update_email(payload):
+    """Job: email a candidate their updated deadline, reusing their existing access link."""
+    test_id = payload['test_id']
+    candidate_id = payload['candidate_id']
+    deadline = payload.get('deadline')
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('SELECT name FROM tests WHERE id = %s', (test_id,))
+        test = cursor.fetchone()
+        cursor.execute('SELECT name, email FROM candidates WHERE id = %s', (candidate_id,))
+        candidate = cursor.fetchone()
+        if not test or not candidate:
+            return {'sent': False, 'reason': 'test_or_candidate_deleted'}
+
+        # Get the existing access token for this candidate's test instance
+        cursor.execute('''
+            SELECT at.token
+            FROM access_tokens at
+            JOIN test_instances ti ON at.instance_id = ti.id
+            WHERE ti.test_id = %s AND ti.candidate_id = %s
+            ORDER BY at.created_at DESC
+            LIMIT 1
+        ''', (test_id, candidate_id))
+        token_result = cursor.fetchone()
+    finally:
+        conn.close()
+
+    if not token_result:
+        print(f"Warning: No access token found for candidate {candidate_id} in test {test_id}")
+        return {'sent': False, 'reason': 'no_access_token'}
+
+    if not os.environ.get('SMTP_USERNAME') or not os.environ.get('SMTP_PASSWORD'):
+        # Retrying cannot help until SMTP is configured
+        return {'sent': False, 'reason': 'smtp_not_configured'}
+
+    # Generate the access URL using the existing token
+    access_url = f"http://localhost:3000/instances/access/{token_result['token']}"
+    email_sent = send_email(
+        to_email=candidate['email'],
+        candidate_name=candidate['name'],
+        test_name=test['name'],
+        access_url=access_url,
+        deadline=deadline,
+        is_deadline_update=True
+    )
+    if not email_sent:
+        raise RuntimeError(f"Failed to send deadline update email to {candidate['email']}")
+
+    print(f"Successfully sent deadline update email to {candidate['name']} ({candidate['email']})")
+    return {'sent': True}
+
+
 def generate_access_token(instance_id, candidate_id, deadline=None):
     """Generate a secure access token for the test instance"""
     # Create a unique token using instance_id, candidate_id, and a random secret
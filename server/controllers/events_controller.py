@@ -0,0 +1,163 @@
+"""
+Per-instance change notifications (timer and phase updates) over Postgres LISTEN/NOTIFY.
+
+publish_event() sends a NOTIFY on EVENTS_CHANNEL; pass the cursor of an open transaction to
+deliver it only if (and when) that transaction commits. Every server process runs one listener
+thread, started on first use, that LISTENs on a dedicated connection and hands each event to the
+local subscribers of its instance (the /timer/stream and /timer/poll requests waiting on it).
+
+Events only tell subscribers to look again: the timer file and chat_history remain the source of
+truth, so a subscriber that misses an event (listener reconnecting) is sent a 'resync' and
+re-reads the state.
+"""
+import json
+import logging
+import os
+import queue
+import select
+import threading
+import time
+from contextlib import contextmanager
+
+from database.db_postgresql import get_connection
+
+logger = logging.getLogger(__name__)
+
+EVENTS_CHANNEL = 'instance_events'
+
+# subscription(ALL_INSTANCES) receives the events of every instance, with their 'instance_id'
+ALL_INSTANCES = '*'
+
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+MAX_EVENT_PAYLOAD_BYTES = 7900
+
+LISTENER_RECONNECT_SECONDS = 5
+
+_subscribers = {}  # instance_id (str) -> set of queue.Queue
+_subscribers_lock = threading.Lock()
+_event_hooks = []  # functions called with each event's instance_id (None: resync everything)
+_listener_lock = threading.Lock()
+_listener_pid = None
+
+def publish_event(instance_id, event_type, data=None, cursor=None):
+    """
+    Notify every server process of a change to an instance.
+
+    With cursor, the notification is part of that transaction (sent on commit, dropped on
+    rollback); otherwise it is sent immediately on a short-lived connection.
+    """
+    payload = json.dumps({'instance_id': str(instance_id), 'type': event_type, 'data': data}, default=str)
+    if len(payload.encode('utf-8')) > MAX_EVENT_PAYLOAD_BYTES:
+        # Subscribers re-read the state anyway; the data is only a convenience
+        payload = json.dumps({'instance_id': str(instance_id), 'type': event_type, 'data': None})
+
+    if cursor is not None:
+        cursor.execute('SELECT pg_notify(%s, %s)', (EVENTS_CHANNEL, payload))
+        return
+
+    conn = get_connection()
+    try:
+        conn.cursor().execute('SELECT pg_notify(%s, %s)', (EVENTS_CHANNEL, payload))
+        conn.commit()
+    finally:
+        conn.close()
+
+def _dispatch(instance_id, event):
+    with _subscribers_lock:
+        targets = list(_subscribers.get(instance_id, ())) + list(_subscribers.get(ALL_INSTANCES, ()))
+    for target in targets:
+        target.put(event)
+    for hook in _event_hooks:
+        hook(instance_id)
+
+def _resync_all():
+    with _subscribers_lock:
+        targets = [target for targets in _subscribers.values() for target in targets]
+    for target in targets:
+        target.put({'type': 'resync', 'data': None})
+    for hook in _event_hooks:
+        hook(None)
+
+def _listen_forever():
+    while True:
+        conn = None
+        try:
+            conn = get_connection()
+            conn.autocommit = True
+            conn.cursor().execute(f'LISTEN {EVENTS_CHANNEL}')
+            logger.info(f"Events listener subscribed to '{EVENTS_CHANNEL}' (pid {os.getpid()})")
+            # Anything published while we were disconnected was missed
+            _resync_all()
+
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    try:
+                        event = json.loads(notify.payload)
+                    except ValueError:
+                        continue
+                    _dispatch(event.get('instance_id'), {
+                        'instance_id': event.get('instance_id'),
+                        'type': event.get('type'),
+                        'data': event.get('data')
+                    })
+        except Exception as e:
+            logger.error(f"Events listener error: {str(e)}; reconnecting in {LISTENER_RECONNECT_SECONDS}s")
+        finally:
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+        time.sleep(LISTENER_RECONNECT_SECONDS)
+
+def _ensure_listener():
+    """Start this process's listener thread (again after a fork: threads do not survive it)"""
+    global _listener_pid
+    if _listener_pid == os.getpid():
+        return
+    with _listener_lock:
+        if _listener_pid == os.getpid():
+            return
+        threading.Thread(target=_listen_forever, name='events-listener', daemon=True).start()
+        _listener_pid = os.getpid()
+
+def add_event_hook(hook):
+    """
+    Call hook(instance_id) from the listener thread for every event of this process, and
+    hook(None) when events may have been missed. For cache invalidation: keep hooks fast.
+    """
+    _event_hooks.append(hook)
+    _ensure_listener()
+
+@contextmanager
+def subscription(instance_id):
+    """
+    Receive the events of an instance (or of all, with ALL_INSTANCES) while the block runs, as
+    a queue.Queue of {'instance_id', 'type', 'data'} dicts. Subscribe before reading the current
+    state, so no change between the read and the wait is missed.
+    """
+    _ensure_listener()
+    instance_id = str(instance_id)
+    events = queue.Queue()
+    with _subscribers_lock:
+        _subscribers.setdefault(instance_id, set()).add(events)
+    try:
+        yield events
+    finally:
+        with _subscribers_lock:
+            targets = _subscribers.get(instance_id)
+            if targets is not None:
+                targets.discard(events)
+                if not targets:
+                    del _subscribers[instance_id]
+
+def wait_for_event(events, timeout):
+    """Next event from a subscription queue, or None after timeout seconds"""
+    try:
+        return events.get(timeout=max(0, timeout))
+    except queue.Empty:
+        return None
@@ -0,0 +1,572 @@
+"""
+Git plumbing for pushing candidate submissions to a test's target repository.
+
+Each target repository has a persistent bare mirror on local disk, so an upload
+only fetches what changed since the last one instead of cloning. Submission files
+are written straight into the mirror's object store with `git fast-import`, spliced
+into the branch tip with `mktree`/`commit-tree`, and pushed by commit id. Nothing
+is checked out and the process working directory is never changed, so concurrent
+uploads in the same process do not interfere with each other.
+
+The same mirrors back the template cache (controllers/templates_controller.py), which
+archives pinned template commits for new containers.
+
+All commands are run with argument lists (no shell). Access tokens are only ever
+passed on the command line for a single fetch/push and are redacted from errors.
+"""
+import fcntl
+import logging
+import os
+import random
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+GIT_MIRRORS_DIR = Path(os.getenv(
+    'GIT_MIRRORS_DIR',
+    str(Path(__file__).resolve().parent.parent / 'data' / 'git-mirrors')
+))
+
+# Timeout (seconds) for commands that talk to the remote
+GIT_NETWORK_TIMEOUT = int(os.getenv('GIT_NETWORK_TIMEOUT', '120'))
+
+# Timeout (seconds) for local plumbing commands
+GIT_LOCAL_TIMEOUT = int(os.getenv('GIT_LOCAL_TIMEOUT', '60'))
+
+DEFAULT_BRANCH = 'main'
+STAGING_REF_PREFIX = 'refs/ai-oa/staging'
+EMPTY_TREE_SHA = '4b825dc642cb6eb9a060e54bf8d69288fbee4904'
+
+UPLOADER_NAME = 'Automated Uploader'
+UPLOADER_EMAIL = 'uploader@example.com'  # Placeholder because git requires an uploader email
+
+# How long the first submission to a repository waits for others to join its push
+SUBMISSION_BATCH_WINDOW_SECONDS = float(os.getenv('SUBMISSION_BATCH_WINDOW_SECONDS', '0.5'))
+
+# Attempts (and base backoff in seconds) for pushes rejected as non-fast-forward
+GIT_PUSH_MAX_ATTEMPTS = int(os.getenv('GIT_PUSH_MAX_ATTEMPTS', '4'))
+GIT_PUSH_RETRY_BASE_SECONDS = float(os.getenv('GIT_PUSH_RETRY_BASE_SECONDS', '0.5'))
+
+# How long commit_submission waits for the queue to commit and push its submission (a fetch
+# and a push, plus room for the batch queued ahead of it)
+GIT_SUBMISSION_WAIT_SECONDS = float(os.getenv('GIT_SUBMISSION_WAIT_SECONDS', str(GIT_NETWORK_TIMEOUT * 3)))
+
+MODE_FILE = 0o100644
+MODE_EXECUTABLE = 0o100755
+
+_repo_locks = {}
+_repo_locks_guard = threading.Lock()
+
+_queues = {}  # mirror path -> {'pending': [_PendingSubmission], 'draining': bool}
+_queues_guard = threading.Lock()
+
+
+class GitCommandError(Exception):
+    """Raised when a git command exits with a non-zero status."""
+
+    def __init__(self, args, returncode, stderr):
+        self.git_args = args
+        self.returncode = returncode
+        self.stderr = stderr
+        super().__init__(f"git {' '.join(args[:1])} failed ({returncode}): {stderr.strip()}")
+
+
+def authenticated_url(repo_url, token):
+    """Return an https URL carrying the token as x-access-token credentials."""
+    if not token:
+        return repo_url
+    if repo_url.startswith('https://'):
+        return f"https://x-access-token:{token}@{repo_url[8:]}"
+    # Fallback or handle other protocols if necessary, for now assume https
+    return f"https://x-access-token:{token}@{repo_url}"
+
+
+def _redact(text, secrets):
+    for secret in secrets:
+        if secret:
+            text = text.replace(secret, '***')
+    return text
+
+
+def _git_env():
+    env = dict(os.environ)
+    env['GIT_TERMINAL_PROMPT'] = '0'
+    env['GIT_AUTHOR_NAME'] = UPLOADER_NAME
+    env['GIT_AUTHOR_EMAIL'] = UPLOADER_EMAIL
+    env['GIT_COMMITTER_NAME'] = UPLOADER_NAME
+    env['GIT_COMMITTER_EMAIL'] = UPLOADER_EMAIL
+    return env
+
+
+def run_git(git_dir, args, input=None, timeout=GIT_LOCAL_TIMEOUT, secrets=(), check=True):
+    """
+    Run a git command against a bare repository and return its stdout as bytes.
+
+    Args:
+        git_dir (Path): Bare repository to operate on (None for commands that need no repository).
+        args (list): Arguments after `git`.
+        input (bytes, optional): Data written to stdin.
+        timeout (int): Seconds before the command is killed.
+        secrets (tuple): Strings to redact from error messages.
+        check (bool): Raise GitCommandError on a non-zero exit status.
+    """
+    command = ['git']
+    if git_dir is not None:
+        command.append(f'--git-dir={git_dir}')
+    command.extend(args)
+    result = subprocess.run(
+        command,
+        input=input,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=_git_env(),
+        timeout=timeout
+    )
+    if check and result.returncode != 0:
+        stderr = result.stderr.decode('utf-8', errors='replace')
+        safe_args = [_redact(arg, secrets) for arg in args]
+        raise GitCommandError(safe_args, result.returncode, _redact(stderr, secrets))
+    return result.stdout
+
+
+def mirror_path(repo_url):
+    """Local path of the bare mirror for a repository URL."""
+    cleaned = re.sub(r'^[a-z]+://', '', repo_url.strip())
+    cleaned = re.sub(r'^[^@/]*@', '', cleaned)  # Drop any embedded credentials
+    cleaned = re.sub(r'\.git$', '', cleaned.rstrip('/'))
+    key = re.sub(r'[^A-Za-z0-9._-]+', '_', cleaned).strip('_') or 'repo'
+    return GIT_MIRRORS_DIR / f'{key}.git'
+
+
+@contextmanager
+def repo_lock(git_dir):
+    """Serialize work on one mirror across threads (in-process lock) and processes (flock)."""
+    git_dir = Path(git_dir)
+    with _repo_locks_guard:
+        lock = _repo_locks.setdefault(str(git_dir), threading.Lock())
+    with lock:
+        git_dir.parent.mkdir(parents=True, exist_ok=True)
+        with open(f'{git_dir}.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _remote_default_branch(repo_url, token):
+    """Ask the remote which branch HEAD points to. Returns None for an empty repository."""
+    output = run_git(
+        None,
+        ['ls-remote', '--symref', authenticated_url(repo_url, token), 'HEAD'],
+        timeout=GIT_NETWORK_TIMEOUT,
+        secrets=(token,)
+    ).decode('utf-8', errors='replace')
+    for line in output.splitlines():
+        if line.startswith('ref: refs/heads/') and line.endswith('\tHEAD'):
+            return line[len('ref: refs/heads/'):-len('\tHEAD')]
+    return None
+
+
+def ensure_mirror(repo_url, token):
+    """Create the bare mirror for a repository if it does not exist yet. Returns its path."""
+    git_dir = mirror_path(repo_url)
+    if (git_dir / 'HEAD').exists():
+        return git_dir
+
+    with repo_lock(git_dir):
+        if (git_dir / 'HEAD').exists():
+            return git_dir
+        tmp_dir = git_dir.with_name(f'{git_dir.name}.init-{uuid.uuid4().hex[:8]}')
+        try:
+            run_git(None, ['init', '--quiet', '--bare', str(tmp_dir)])
+            branch = _remote_default_branch(repo_url, token) or DEFAULT_BRANCH
+            run_git(tmp_dir, ['symbolic-ref', 'HEAD', f'refs/heads/{branch}'])
+            os.replace(tmp_dir, git_dir)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        logger.info(f"Created git mirror for {repo_url} at {git_dir} (default branch {branch})")
+    return git_dir
+
+
+def remote_head(repo_url, token):
+    """Return the commit the remote's default branch points to (None for an empty repository)."""
+    output = run_git(
+        None,
+        ['ls-remote', authenticated_url(repo_url, token), 'HEAD'],
+        timeout=GIT_NETWORK_TIMEOUT,
+        secrets=(token,)
+    ).decode('utf-8', errors='replace')
+    for line in output.splitlines():
+        sha, _, ref = line.partition('\t')
+        if ref == 'HEAD':
+            return sha
+    return None
+
+
+def fetch_mirror(git_dir, repo_url, token):
+    """Bring the mirror's branches up to date with the remote. Must be called under repo_lock."""
+    run_git(
+        git_dir,
+        ['fetch', '--quiet', '--prune', '--no-tags', '--update-head-ok',
+         authenticated_url(repo_url, token), '+refs/heads/*:refs/heads/*'],
+        timeout=GIT_NETWORK_TIMEOUT,
+        secrets=(token,)
+    )
+
+
+def default_branch(git_dir):
+    return run_git(git_dir, ['symbolic-ref', '--short', 'HEAD']).decode().strip()
+
+
+def resolve_ref(git_dir, ref):
+    """Return the object id a ref points to, or None if the ref does not exist."""
+    output = run_git(git_dir, ['rev-parse', '--verify', '--quiet', f'{ref}^{{commit}}'], check=False)
+    sha = output.decode().strip()
+    return sha or None
+
+
+def path_exists(git_dir, ref, path):
+    """Whether a path exists in the tree of a ref."""
+    output = run_git(git_dir, ['rev-parse', '--verify', '--quiet', f'{ref}:{path}'], check=False)
+    return bool(output.strip())
+
+
+def archive_commit(git_dir, commit, output_path, prefix=''):
+    """Write the tree of a commit as a tar file (entries under prefix/ if given)."""
+    args = ['archive', '--format=tar', f'--output={output_path}']
+    if prefix:
+        args.append(f'--prefix={prefix}/')
+    args.append(commit)
+    run_git(git_dir, args)
+
+
+def _quote_path(path):
+    """Quote a path for a fast-import filemodify command."""
+    if not re.search(r'["\\\n]', path) and not path.startswith('"'):
+        return path
+    escaped = path.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return f'"{escaped}"'
+
+
+def _entry_mode(entry):
+    if len(entry) > 2 and entry[2]:
+        return entry[2]
+    return MODE_FILE
+
+
+def stage_tree(git_dir, entries):
+    """
+    Write files into the mirror's object store and return the resulting tree id.
+
+    Files are streamed to `git fast-import` one at a time, so the caller can produce
+    entries lazily. The commit that carries the tree is kept under a private staging
+    ref until the caller drops it with release_staging_ref().
+
+    Args:
+        git_dir (Path): Bare mirror.
+        entries: Iterable of (relative_path, data_bytes[, mode]) tuples.
+
+    Returns:
+        tuple: (tree_sha, staging_ref)
+    """
+    staging_ref = f'{STAGING_REF_PREFIX}/{uuid.uuid4().hex}'
+    message = b'staged submission'
+    with tempfile.TemporaryFile() as stderr_file:
+        process = subprocess.Popen(
+            ['git', f'--git-dir={git_dir}', 'fast-import', '--quiet', '--force'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=stderr_file,
+            env=_git_env()
+        )
+        try:
+            stream = process.stdin
+            stream.write(
+                f'commit {staging_ref}\n'
+                f'committer {UPLOADER_NAME} <{UPLOADER_EMAIL}> {int(time.time())} +0000\n'
+                f'data {len(message)}\n'.encode() + message + b'\n'
+            )
+            for entry in entries:
+                path, data = entry[0], entry[1]
+                stream.write(f'M {_entry_mode(entry):o} inline {_quote_path(path)}\n'.encode('utf-8'))
+                stream.write(b'data %d\n' % len(data))
+                stream.write(data)
+                stream.write(b'\n')
+            stream.write(b'\n')
+            stream.close()
+            returncode = process.wait(timeout=GIT_LOCAL_TIMEOUT)
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+        if returncode != 0:
+            stderr_file.seek(0)
+            stderr = stderr_file.read().decode('utf-8', errors='replace')
+            raise GitCommandError(['fast-import'], returncode, stderr)
+
+    tree_sha = run_git(git_dir, ['rev-parse', f'{staging_ref}^{{tree}}']).decode().strip()
+    return tree_sha, staging_ref
+
+
+def release_staging_ref(git_dir, staging_ref):
+    run_git(git_dir, ['update-ref', '-d', staging_ref], check=False)
+
+
+def splice_tree(git_dir, base_commit, prefix, subtree_sha):
+    """
+    Return a root tree equal to base_commit's tree with `prefix` replaced by subtree_sha.
+
+    An empty subtree removes the prefix entirely. Returns (tree_sha, changed).
+    """
+    entries = []
+    existing_sha = None
+    if base_commit:
+        listing = run_git(git_dir, ['ls-tree', '-z', base_commit])
+        for record in listing.split(b'\0'):
+            if not record:
+                continue
+            meta, name = record.split(b'\t', 1)
+            if name.decode('utf-8', errors='surrogateescape') == prefix:
+                existing_sha = meta.split(b' ')[2].decode()
+                continue
+            entries.append(record)
+
+    if subtree_sha != EMPTY_TREE_SHA:
+        entries.append(f'040000 tree {subtree_sha}\t'.encode() + prefix.encode('utf-8'))
+    changed = existing_sha != (subtree_sha if subtree_sha != EMPTY_TREE_SHA else None)
+
+    tree_input = b''.join(record + b'\0' for record in entries)
+    tree_sha = run_git(git_dir, ['mktree', '-z'], input=tree_input).decode().strip()
+    return tree_sha, changed
+
+
+def commit_tree(git_dir, tree_sha, parent, message):
+    args = ['commit-tree', tree_sha, '-m', message]
+    if parent:
+        args.extend(['-p', parent])
+    return run_git(git_dir, args).decode().strip()
+
+
+def diff_commits(git_dir, parent, commit, prefix=None):
+    """Return the patch introduced by a commit (optionally limited to one directory)."""
+    args = ['diff-tree', '-p', '--no-color', '--no-ext-diff']
+    args.extend([parent, commit] if parent else ['--root', commit])
+    if prefix:
+        args.extend(['--', f'{prefix}/'])
+    return run_git(git_dir, args).decode('utf-8', errors='replace')
+
+
+def push_commit(git_dir, repo_url, token, commit, branch):
+    """Push a commit to a remote branch and advance the mirror's ref once it was accepted."""
+    run_git(
+        git_dir,
+        ['push', '--quiet', authenticated_url(repo_url, token), f'{commit}:refs/heads/{branch}'],
+        timeout=GIT_NETWORK_TIMEOUT,
+        secrets=(token,)
+    )
+    run_git(git_dir, ['update-ref', f'refs/heads/{branch}', commit])
+
+
+def _is_non_fast_forward(error):
+    stderr = error.stderr if isinstance(error, GitCommandError) else str(error)
+    return any(marker in stderr for marker in ('non-fast-forward', 'fetch first', 'stale info'))
+
+
+class _PendingSubmission:
+    """One candidate submission waiting in a repository's commit queue."""
+
+    def __init__(self, token, prefix, subtree_sha, message, only_if_absent=False):
+        self.token = token
+        self.prefix = prefix
+        self.subtree_sha = subtree_sha
+        self.message = message
+        self.only_if_absent = only_if_absent
+        self.result = None
+        self.error = None
+        self.abandoned = False
+        self.done = threading.Event()
+
+
+def _commit_chain(git_dir, parent, batch):
+    """Commit each submission on top of the previous one. Returns the new tip."""
+    tip = parent
+    branch = default_branch(git_dir)
+    for submission in batch:
+        if submission.abandoned:
+            # Its caller stopped waiting and reported a failure
+            submission.error = TimeoutError('abandoned')
+            continue
+        try:
+            if submission.only_if_absent and tip and path_exists(git_dir, tip, submission.prefix):
+                # Checked against the tip being pushed, so nothing committed since is overwritten
+                submission.result = {'changed': False, 'skipped': True, 'commit': tip, 'branch': branch, 'diff': ''}
+                continue
+            tree_sha, changed = splice_tree(git_dir, tip, submission.prefix, submission.subtree_sha)
+            if not changed:
+                submission.result = {'changed': False, 'commit': tip, 'branch': branch, 'diff': ''}
+                continue
+            commit = commit_tree(git_dir, tree_sha, tip, submission.message)
+            submission.result = {
+                'changed': True,
+                'commit': commit,
+                'branch': branch,
+                'diff': diff_commits(git_dir, tip, commit, submission.prefix)
+            }
+            tip = commit
+        except Exception as e:
+            # A broken submission is left out of the chain instead of failing the whole batch
+            submission.result = None
+            submission.error = e
+    return tip
+
+
+def _push_batch(git_dir, repo_url, token, batch):
+    """
+    Commit a batch of submissions as one chain and push it with a single push.
+
+    On a non-fast-forward rejection the mirror is re-fetched and the chain is rebuilt
+    on top of the new tip (each submission only owns its own directory, so this is a
+    conflict-free rebase), with exponential backoff between attempts.
+    """
+    for attempt in range(1, GIT_PUSH_MAX_ATTEMPTS + 1):
+        for submission in batch:
+            submission.result = None
+            submission.error = None
+
+        fetch_mirror(git_dir, repo_url, token)
+        branch = default_branch(git_dir)
+        parent = resolve_ref(git_dir, f'refs/heads/{branch}')
+        tip = _commit_chain(git_dir, parent, batch)
+        if tip == parent:
+            return
+
+        try:
+            push_commit(git_dir, repo_url, token, tip, branch)
+            committed = sum(1 for s in batch if s.result and s.result['changed'])
+            logger.info(f"Pushed {committed} submission commit(s) to {repo_url} on branch {branch} at {tip[:12]}")
+            return
+        except GitCommandError as e:
+            if not _is_non_fast_forward(e) or attempt == GIT_PUSH_MAX_ATTEMPTS:
+                raise
+            delay = GIT_PUSH_RETRY_BASE_SECONDS * (2 ** (attempt - 1)) * (1 + random.random())
+            logger.warning(f"Push to {repo_url} was rejected as non-fast-forward; retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def _process_batch(git_dir, repo_url, batch):
+    """Push a batch, falling back to one push per submission so one bad push does not fail the others."""
+    groups = {}
+    for submission in batch:
+        groups.setdefault(submission.token, []).append(submission)
+
+    with repo_lock(git_dir):
+        for token, group in groups.items():
+            try:
+                _push_batch(git_dir, repo_url, token, group)
+            except Exception as e:
+                if len(group) == 1:
+                    group[0].result = None
+                    group[0].error = e
+                    continue
+                logger.warning(f"Batched push of {len(group)} submissions to {repo_url} failed ({e}); pushing individually")
+                for submission in group:
+                    try:
+                        _push_batch(git_dir, repo_url, token, [submission])
+                    except Exception as single_error:
+                        submission.result = None
+                        submission.error = single_error
+
+
+def _drain_queue(git_dir, repo_url):
+    """Queue worker: collect submissions for the batch window, push them, repeat until idle."""
+    key = str(git_dir)
+    while True:
+        if SUBMISSION_BATCH_WINDOW_SECONDS > 0:
+            time.sleep(SUBMISSION_BATCH_WINDOW_SECONDS)
+        with _queues_guard:
+            queue = _queues[key]
+            batch = queue['pending']
+            queue['pending'] = []
+            if not batch:
+                queue['draining'] = False
+                return
+        try:
+            _process_batch(git_dir, repo_url, batch)
+        except Exception as e:
+            for submission in batch:
+                if submission.result is None and submission.error is None:
+                    submission.error = e
+        finally:
+            for submission in batch:
+                submission.done.set()
+
+
+def commit_submission(repo_url, token, prefix, entries, message, only_if_absent=False):
+    """
+    Replace `prefix/` in the target repository's default branch with the given files and push.
+
+    Submissions to the same repository go through a per-repository queue. A worker thread
+    collects whatever arrives within SUBMISSION_BATCH_WINDOW_SECONDS, commits the batch as
+    a chain (one commit per submission) and pushes it with one fetch and one push.
+
+    Args:
+        repo_url (str): Target repository URL.
+        token (str): Access token (may be empty for repositories that need none).
+        prefix (str): Top-level directory that holds the submission.
+        entries: Iterable of (relative_path, data_bytes[, mode]) tuples, relative to prefix.
+        message (str): Commit message.
+        only_if_absent (bool): Commit nothing if `prefix/` already exists on the branch
+            (checked on the fetched tip while the commit is made; the result has 'skipped').
+
+    Returns:
+        dict: {'changed', 'commit', 'branch', 'diff'}
+
+    Raises:
+        TimeoutError: the queue did not get to the submission within GIT_SUBMISSION_WAIT_SECONDS
+            (it is then left out of later batches, unless one was already being pushed).
+    """
+    git_dir = ensure_mirror(repo_url, token)
+
+    # Writing objects is safe to do concurrently; only the ref updates go through the queue
+    subtree_sha, staging_ref = stage_tree(git_dir, entries)
+    try:
+        submission = _PendingSubmission(token, prefix, subtree_sha, message, only_if_absent)
+        with _queues_guard:
+            queue = _queues.setdefault(str(git_dir), {'pending': [], 'draining': False})
+            queue['pending'].append(submission)
+            start_worker = not queue['draining']
+            queue['draining'] = True
+
+        if start_worker:
+            threading.Thread(
+                target=_drain_queue,
+                args=(git_dir, repo_url),
+                name=f'git-queue-{git_dir.name}',
+                daemon=True
+            ).start()
+        if not submission.done.wait(GIT_SUBMISSION_WAIT_SECONDS):
+            submission.abandoned = True
+            raise TimeoutError(
+                f"Timed out after {GIT_SUBMISSION_WAIT_SECONDS:.0f}s waiting to commit {prefix}/ to "
+                f"{repo_url}; the repository's commit queue is stuck or slow"
+            )
+    finally:
+        release_staging_ref(git_dir, staging_ref)
+
+    if submission.error is not None:
+        raise submission.error
+    if submission.result.get('skipped'):
+        logger.info(f"{prefix}/ already exists in {repo_url}; not committed")
+    elif not submission.result['changed']:
+        logger.info(f"No changes under {prefix}/ in {repo_url}; skipping commit and push")
+    return submission.result
@@ -0,0 +1,279 @@
+"""
+Hibernation of idle instance containers.
+
+The 'instances.hibernate_idle' job looks for instances with no recent activity: the latest of
+their telemetry events, chat messages, creation and last resume. How long an instance may stay
+idle depends on its timer state:
+
+- IDLE_HIBERNATE_FINISHED_AFTER_MINUTES once the assessment is over (a report exists or the
+  project timer expired),
+- IDLE_HIBERNATE_DURING_TIMER_AFTER_MINUTES while a timer is running (the candidate may be
+  reading or working outside the editor),
+- IDLE_HIBERNATE_AFTER_MINUTES otherwise (not started yet, or between phases).
+
+Before a container is hibernated, the mtime of code-server's heartbeat file is checked:
+code-server touches it about once a minute while a browser tab has the editor open, so a
+candidate coding without using the chat is not counted as idle.
+
+Idle containers are paused (IDLE_HIBERNATE_MODE=pause: frees CPU, keeps memory) or stopped
+(stop, the default: frees memory and CPU; the container and its files are kept). Either way the
+instance is marked hibernated and resume_instance() brings it back on the candidate's next visit
+through /instances/access/<token>. get_hibernation_metrics() reports the capacity reclaimed.
+"""
+import logging
+import os
+import time
+
+import docker
+
+from database.db_postgresql import get_connection
+from controllers.capacity_controller import (
+    CONTAINER_DEFAULT_MEM_LIMIT_MB, CONTAINER_DEFAULT_NANO_CPUS, reserve_capacity, resource_profile
+)
+from controllers.docker_hosts_controller import connect_hosts, get_docker_host, get_instance_docker_client, host_name
+from controllers.jobs_controller import enqueue_job, register_job, register_recurring_job
+from controllers.timer_controller import get_timer_status
+
+logger = logging.getLogger(__name__)
+
+IDLE_HIBERNATION_ENABLED = os.getenv('IDLE_HIBERNATION_ENABLED', 'true').lower() == 'true'
+IDLE_HIBERNATE_MODE = os.getenv('IDLE_HIBERNATE_MODE', 'stop')
+IDLE_HIBERNATE_MODES = ('pause', 'stop')
+
+IDLE_HIBERNATE_AFTER_MINUTES = int(os.getenv('IDLE_HIBERNATE_AFTER_MINUTES', '30'))
+IDLE_HIBERNATE_DURING_TIMER_AFTER_MINUTES = int(os.getenv('IDLE_HIBERNATE_DURING_TIMER_AFTER_MINUTES', '120'))
+IDLE_HIBERNATE_FINISHED_AFTER_MINUTES = int(os.getenv('IDLE_HIBERNATE_FINISHED_AFTER_MINUTES', '10'))
+IDLE_CHECK_INTERVAL_SECONDS = int(os.getenv('IDLE_CHECK_INTERVAL_SECONDS', '300'))
+
+# code-server's heartbeat file (in its user data dir), touched while the editor is open
+IDLE_EDITOR_HEARTBEAT_PATH = os.getenv(
+    'IDLE_EDITOR_HEARTBEAT_PATH', '/home/coder/.local/share/code-server/heartbeat'
+)
+
+# How long an access request waits for a resumed container to report healthy
+IDLE_RESUME_WAIT_SECONDS = int(os.getenv('IDLE_RESUME_WAIT_SECONDS', '30'))
+
+if IDLE_HIBERNATE_MODE not in IDLE_HIBERNATE_MODES:
+    raise ValueError(f"IDLE_HIBERNATE_MODE must be one of {', '.join(IDLE_HIBERNATE_MODES)}")
+
+# Values of test_instances.hibernation_mode
+HIBERNATION_MODE_COLUMN = {'pause': 'paused', 'stop': 'stopped'}
+
+
+def _idle_threshold_minutes(instance):
+    """Idle time after which an instance is hibernated, from its timer state"""
+    timer = get_timer_status(instance['id'])
+    finished = instance['has_report'] or (
+        timer and timer['timerType'] == 'project' and timer['isExpired']
+    )
+    if finished:
+        return IDLE_HIBERNATE_FINISHED_AFTER_MINUTES
+    if timer and timer['active'] and not timer['isExpired']:
+        return IDLE_HIBERNATE_DURING_TIMER_AFTER_MINUTES
+    return IDLE_HIBERNATE_AFTER_MINUTES
+
+def find_idle_instances():
+    """Running instances idle for longer than their threshold, with their idle time in minutes"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        # The shortest threshold narrows the scan; the per-instance one is applied below
+        cursor.execute('''
+            SELECT ti.id, ti.docker_instance_id, ti.docker_host,
+                   EXTRACT(EPOCH FROM NOW() - GREATEST(
+                       ti.created_at, ti.resumed_at, telemetry.last_at, chat.last_at
+                   )) / 60 AS idle_minutes,
+                   EXISTS (SELECT 1 FROM reports r WHERE r.instance_id = ti.id) AS has_report
+            FROM test_instances ti
+            LEFT JOIN LATERAL (
+                SELECT MAX(created_at) AS last_at FROM telemetry_events WHERE instance_id = ti.id
+            ) telemetry ON TRUE
+            LEFT JOIN LATERAL (
+                SELECT MAX(created_at) AS last_at FROM chat_history WHERE instance_id = ti.id
+            ) chat ON TRUE
+            WHERE ti.docker_instance_id IS NOT NULL AND ti.docker_instance_id <> 'pending'
+              AND ti.hibernated_at IS NULL
+              AND GREATEST(ti.created_at, ti.resumed_at, telemetry.last_at, chat.last_at)
+                  < NOW() - make_interval(mins => %s)
+            ORDER BY ti.id
+        ''', (min(
+            IDLE_HIBERNATE_AFTER_MINUTES,
+            IDLE_HIBERNATE_DURING_TIMER_AFTER_MINUTES,
+            IDLE_HIBERNATE_FINISHED_AFTER_MINUTES
+        ),))
+        candidates = cursor.fetchall()
+    finally:
+        conn.close()
+    idle = []
+    for instance in candidates:
+        threshold = _idle_threshold_minutes(instance)
+        if instance['idle_minutes'] >= threshold:
+            idle.append(dict(instance, idle_threshold_minutes=threshold))
+    return idle
+
+def _editor_idle_minutes(container):
+    """Minutes since code-server's last heartbeat in a running container (None if unknown)"""
+    try:
+        result = container.exec_run(['stat', '-c', '%Y', IDLE_EDITOR_HEARTBEAT_PATH])
+        if result.exit_code != 0:
+            return None
+        return (time.time() - int(result.output.decode().strip())) / 60
+    except Exception as e:
+        logger.debug(f"Could not read the editor heartbeat of {container.name}: {str(e)}")
+        return None
+
+@register_job('instances.hibernate_idle', max_attempts=1)
+def hibernate_idle_instances(payload=None):
+    """Job: pause or stop the containers of idle instances (see the module docstring)."""
+    idle = find_idle_instances()
+    clients = connect_hosts(instance['docker_host'] for instance in idle)
+    mode = HIBERNATION_MODE_COLUMN[IDLE_HIBERNATE_MODE]
+    hibernated, failed = [], []
+    for instance in idle:
+        client = clients.get(host_name(instance['docker_host']))
+        if client is None:
+            continue
+        try:
+            container = client.containers.get(instance['docker_instance_id'])
+            if container.status != 'running':
+                continue
+            editor_idle = _editor_idle_minutes(container)
+            if editor_idle is not None and editor_idle < instance['idle_threshold_minutes']:
+                # The editor is still open
+                continue
+            if IDLE_HIBERNATE_MODE == 'pause':
+                container.pause()
+            else:
+                container.stop()
+        except docker.errors.NotFound:
+            continue
+        except Exception as e:
+            logger.warning(f"Could not hibernate instance {instance['id']}: {str(e)}")
+            failed.append(instance['id'])
+            continue
+
+        conn = get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                '''UPDATE test_instances
+                   SET hibernated_at = NOW(), hibernation_mode = %s, hibernation_count = hibernation_count + 1
+                   WHERE id = %s''',
+                (mode, instance['id'])
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        hibernated.append(instance['id'])
+        logger.info(f"Hibernated instance {instance['id']} ({mode}) after {int(instance['idle_minutes'])} idle minutes")
+
+    if hibernated and IDLE_HIBERNATE_MODE == 'stop':
+        # Stopped containers free memory, which may let a queued instance start
+        enqueue_job('instances.provision_queued', unique_key='instances.provision_queued:kick')
+    return {'hibernated': hibernated, 'failed': failed, 'mode': mode}
+
+if IDLE_HIBERNATION_ENABLED:
+    register_recurring_job('instances.hibernate_idle', interval_seconds=IDLE_CHECK_INTERVAL_SECONDS)
+
+def _wait_until_healthy(container):
+    """Wait up to IDLE_RESUME_WAIT_SECONDS for a started container's healthcheck to pass"""
+    deadline = time.monotonic() + IDLE_RESUME_WAIT_SECONDS
+    while time.monotonic() < deadline:
+        container.reload()
+        health = container.attrs.get('State', {}).get('Health', {}).get('Status')
+        if container.status == 'running' and health in (None, 'healthy'):
+            return True
+        if container.status in ('exited', 'dead'):
+            raise Exception(f"Container failed to resume. Status: {container.status}")
+        time.sleep(1)
+    return False
+
+def resume_instance(instance_id):
+    """
+    Wake a hibernated instance's container: unpause it, or start it again if the host has room
+    (CapacityError otherwise). Returns True if the instance was hibernated.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        # The row lock makes concurrent visits resume the container once
+        cursor.execute('''
+            SELECT ti.id, ti.docker_instance_id, ti.docker_host, ti.hibernated_at,
+                   t.mem_limit_mb, t.nano_cpus, t.pids_limit
+            FROM test_instances ti
+            JOIN tests t ON t.id = ti.test_id
+            WHERE ti.id = %s
+            FOR UPDATE OF ti
+        ''', (instance_id,))
+        instance = cursor.fetchone()
+        if not instance or not instance['hibernated_at']:
+            return False
+
+        client = get_instance_docker_client(instance)
+        container = client.containers.get(instance['docker_instance_id'])
+        if container.status == 'paused':
+            container.unpause()
+        elif container.status != 'running':
+            # Stopped containers no longer count against the host, so they need room again
+            with reserve_capacity(client, resource_profile(instance), get_docker_host(instance['docker_host'])):
+                container.start()
+
+        cursor.execute(
+            '''UPDATE test_instances
+               SET hibernated_at = NULL, hibernation_mode = NULL, resumed_at = NOW(),
+                   resume_count = resume_count + 1
+               WHERE id = %s''',
+            (instance_id,)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+    if not _wait_until_healthy(container):
+        logger.warning(f"Instance {instance_id} resumed but is not healthy yet")
+    logger.info(f"Resumed instance {instance_id}")
+    return True
+
+def get_hibernation_metrics():
+    """Hibernated instances, the capacity they free and lifetime hibernate/resume counts"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''
+            SELECT ti.hibernation_mode, COUNT(*) AS instances,
+                   SUM(COALESCE(t.mem_limit_mb, %s)) AS memory_mb,
+                   SUM(COALESCE(t.nano_cpus, %s)) AS nano_cpus
+            FROM test_instances ti
+            JOIN tests t ON t.id = ti.test_id
+            WHERE ti.hibernated_at IS NOT NULL
+            GROUP BY ti.hibernation_mode
+        ''', (CONTAINER_DEFAULT_MEM_LIMIT_MB, CONTAINER_DEFAULT_NANO_CPUS))
+        by_mode = {row['hibernation_mode']: row for row in cursor.fetchall()}
+        cursor.execute('''
+            SELECT COALESCE(SUM(hibernation_count), 0) AS hibernations,
+                   COALESCE(SUM(resume_count), 0) AS resumes
+            FROM test_instances
+        ''')
+        totals = cursor.fetchone()
+    finally:
+        conn.close()
+
+    paused = by_mode.get('paused') or {'instances': 0, 'memory_mb': 0, 'nano_cpus': 0}
+    stopped = by_mode.get('stopped') or {'instances': 0, 'memory_mb': 0, 'nano_cpus': 0}
+    return {
+        'hibernated': {'paused': paused['instances'], 'stopped': stopped['instances']},
+        # Paused containers keep their memory; both give back their CPU share
+        'reclaimed': {
+            'memory_mb': int(stopped['memory_mb'] or 0),
+            'cpus': round(int((paused['nano_cpus'] or 0) + (stopped['nano_cpus'] or 0)) / 1e9, 2)
+        },
+        'hibernations_total': int(totals['hibernations']),
+        'resumes_total': int(totals['resumes']),
+        'settings': {
+            'enabled': IDLE_HIBERNATION_ENABLED,
+            'mode': IDLE_HIBERNATE_MODE,
+            'idle_minutes': IDLE_HIBERNATE_AFTER_MINUTES,
+            'idle_minutes_during_timer': IDLE_HIBERNATE_DURING_TIMER_AFTER_MINUTES,
+            'idle_minutes_finished': IDLE_HIBERNATE_FINISHED_AFTER_MINUTES
+        }
+    }
@@ -0,0 +1,184 @@
+"""
+Optional per-test container images (TEST_IMAGES_ENABLED).
+
+A derived image bakes a test's pinned template commit (see templates_controller) on top of
+INSTANCE_BASE_IMAGE, at the path docker/startup.sh picks a seeded template up from, and runs the
+template's optional `.ai-oa/build.sh` at build time to install its dependencies. Images are
+tagged ai-oa-test-<test id>:<commit[:12]> and built on each Docker host by the 'images.build' job,
+queued when a test's pin moves (for every host) or when a container is created on a host before
+its image exists there (that container uses the base image meanwhile). 'images.gc' removes tags
+that are no longer pinned.
+"""
+import io
+import logging
+import os
+import tarfile
+import tempfile
+
+from database.db_postgresql import get_connection
+from controllers.docker_hosts_controller import DOCKER_HOSTS, get_docker_client
+from controllers.jobs_controller import enqueue_job, register_job, register_recurring_job
+from controllers.templates_controller import TEMPLATE_ARCHIVE_PREFIX, TEMPLATE_CONTAINER_DIR, template_archive
+
+logger = logging.getLogger(__name__)
+
+TEST_IMAGES_ENABLED = os.getenv('TEST_IMAGES_ENABLED', 'false').lower() == 'true'
+
+INSTANCE_BASE_IMAGE = os.getenv('INSTANCE_BASE_IMAGE', 'ectan/ai-oa-public:latest')
+
+TEST_IMAGE_REPOSITORY_PREFIX = 'ai-oa-test-'
+TEST_IMAGES_GC_INTERVAL_SECONDS = int(os.getenv('TEST_IMAGES_GC_INTERVAL_SECONDS', str(6 * 3600)))
+
+# Labels identifying derived images (and what they were built from)
+LABEL_TEST_ID = 'ai-oa.test_id'
+LABEL_TEMPLATE_COMMIT = 'ai-oa.template_commit'
+LABEL_BASE_IMAGE_ID = 'ai-oa.base_image_id'
+
+DOCKERFILE = '''FROM {base_image}
+COPY --chown=coder:coder {prefix} {template_dir}
+RUN if [ -x {template_dir}/.ai-oa/build.sh ]; then cd {template_dir} && ./.ai-oa/build.sh; fi
+'''
+
+def test_image_tag(test_id, commit):
+    return f'{TEST_IMAGE_REPOSITORY_PREFIX}{test_id}:{commit[:12]}'
+
+def _build_context(archive_path, base_image):
+    """Docker build context: the Dockerfile plus the template tarball's entries, as a temp file"""
+    context = tempfile.TemporaryFile()
+    dockerfile = DOCKERFILE.format(
+        base_image=base_image, prefix=TEMPLATE_ARCHIVE_PREFIX, template_dir=TEMPLATE_CONTAINER_DIR
+    ).encode('utf-8')
+    with tarfile.open(fileobj=context, mode='w') as output:
+        info = tarfile.TarInfo('Dockerfile')
+        info.size = len(dockerfile)
+        output.addfile(info, io.BytesIO(dockerfile))
+        with tarfile.open(archive_path) as template:
+            for member in template:
+                output.addfile(member, template.extractfile(member) if member.isfile() else None)
+    context.seek(0)
+    return context
+
+def select_instance_image(client, test, docker_host=None):
+    """
+    Image to create a test's container from: (image_name, template_commit).
+
+    template_commit is set when the derived image of the pinned commit is present (the template
+    is then already in the image); otherwise the base image is returned and, if builds are
+    enabled, a build is queued for the next container.
+    """
+    commit = test.get('template_commit')
+    if not TEST_IMAGES_ENABLED or not test.get('github_repo') or not commit:
+        return INSTANCE_BASE_IMAGE, None
+
+    tag = test_image_tag(test['id'], commit)
+    try:
+        image = client.images.get(tag)
+        # A derived image of an older base image is stale (the base tag moved)
+        if image.labels.get(LABEL_BASE_IMAGE_ID) == client.images.get(INSTANCE_BASE_IMAGE).id:
+            return tag, commit
+    except Exception:
+        pass
+    enqueue_test_image_build(test['id'], commit, company_id=test.get('company_id'), docker_host=docker_host)
+    return INSTANCE_BASE_IMAGE, None
+
+def enqueue_test_image_build(test_id, commit, company_id=None, cursor=None, docker_host=None):
+    """Queue the build of a test's image on one Docker host, or on every host"""
+    if not TEST_IMAGES_ENABLED:
+        return None
+    hosts = [docker_host] if docker_host else [host['name'] for host in DOCKER_HOSTS]
+    return [
+        enqueue_job(
+            'images.build',
+            {'test_id': test_id, 'commit': commit, 'docker_host': name},
+            unique_key=f'images.build:{name}:{test_id}:{commit}',
+            company_id=company_id,
+            cursor=cursor
+        )
+        for name in hosts
+    ]
+
+@register_job('images.build', max_attempts=2, retry_delay=300)
+def build_test_image(payload):
+    """Job: build (or confirm) the derived image of a test's template commit on a Docker host."""
+    test_id, commit = payload['test_id'], payload['commit']
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('SELECT github_repo, github_token, template_commit FROM tests WHERE id = %s', (test_id,))
+        test = cursor.fetchone()
+    finally:
+        conn.close()
+    if not test or test['template_commit'] != commit:
+        return {'skipped': True, 'reason': 'commit is no longer pinned'}
+
+    # Jobs queued before hosts were recorded build on the first host
+    client = get_docker_client(payload.get('docker_host'))
+    base_image = client.images.get(INSTANCE_BASE_IMAGE)
+    tag = test_image_tag(test_id, commit)
+    try:
+        if client.images.get(tag).labels.get(LABEL_BASE_IMAGE_ID) == base_image.id:
+            return {'tag': tag, 'built': False}
+    except Exception:
+        pass
+
+    archive_path = template_archive(test['github_repo'], test['github_token'], commit)
+    with _build_context(archive_path, INSTANCE_BASE_IMAGE) as context:
+        image, _ = client.images.build(
+            fileobj=context,
+            custom_context=True,
+            tag=tag,
+            rm=True,
+            forcerm=True,
+            labels={
+                LABEL_TEST_ID: str(test_id),
+                LABEL_TEMPLATE_COMMIT: commit,
+                LABEL_BASE_IMAGE_ID: base_image.id
+            }
+        )
+    logger.info(f"Built {tag} ({image.short_id}) for test {test_id}")
+    return {'tag': tag, 'built': True, 'image_id': image.id}
+
+@register_job('images.gc', max_attempts=1)
+def collect_test_images(payload=None):
+    """
+    Job: remove derived images whose commit is no longer pinned by their test (or whose test is
+    gone) and untagged leftovers of rebuilds, on every Docker host. Images still used by a
+    container are kept.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('SELECT id, template_commit FROM tests WHERE template_commit IS NOT NULL')
+        pinned = {str(row['id']): row['template_commit'] for row in cursor.fetchall()}
+    finally:
+        conn.close()
+
+    removed, kept = [], 0
+    for host in DOCKER_HOSTS:
+        try:
+            client = get_docker_client(host['name'])
+        except Exception as e:
+            logger.warning(f"Skipping image collection on {host['name']}: {str(e)}")
+            continue
+        for image in client.images.list(filters={'label': LABEL_TEST_ID}):
+            labels = image.labels
+            current = (
+                image.tags
+                and pinned.get(labels.get(LABEL_TEST_ID)) == labels.get(LABEL_TEMPLATE_COMMIT)
+            )
+            if current:
+                kept += 1
+                continue
+            try:
+                client.images.remove(image.id)
+                removed.append(f"{host['name']}/{image.tags[0] if image.tags else image.short_id}")
+            except Exception as e:
+                # In use by a container (removed on a later run) or already gone
+                logger.info(f"Keeping image {image.short_id} on {host['name']}: {str(e)}")
+                kept += 1
+    if removed:
+        logger.info(f"Removed {len(removed)} stale test image(s): {', '.join(removed)}")
+    return {'removed': removed, 'kept': kept}
+
+if TEST_IMAGES_ENABLED:
+    register_recurring_job('images.gc', interval_seconds=TEST_IMAGES_GC_INTERVAL_SECONDS)
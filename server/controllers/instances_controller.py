@@ -2,96 +2,39 @@ import os
 import time
 import docker
 import subprocess
-import shutil
-import tempfile # For temporary directories and files
-import zipfile # For handling zip files
 import json
+import logging
 from pathlib import Path
 from database.db_postgresql import get_connection
-from controllers.timer_controller import delete_timer, start_instance_timer
+from controllers.timer_controller import delete_timer, get_timer_status, start_instance_timer
 from controllers.chat_controller import get_chat_history, create_report_completion
+from controllers.codebase_controller import iter_zip_entries, render_codebase_entries
+from controllers.git_controller import commit_submission
+from controllers.jobs_controller import enqueue_job, register_job, register_recurring_job
+from controllers.capacity_controller import (
+    CAPACITY_QUEUE_POLL_SECONDS, CapacityError, container_labels, container_resource_options,
+    count_queued_instances, reserve_capacity, resource_profile
+)
+from controllers.docker_hosts_controller import (
+    choose_docker_host, connect_hosts, get_docker_client, get_docker_host, get_hosts_capacity,
+    get_instance_docker_client, host_name, instance_routing_map
+)
+from controllers.images_controller import select_instance_image
+from controllers.templates_controller import seed_container_template
+from database.instance_repository import forget_instance, load_instance_aggregate
+from database.pagination import fetch_list, iso_datetime, list_response, parse_list_params, project_fields
+from observability.logs import summarize
 from pydantic import Field, BaseModel, create_model, validator
-from code2prompt_rs import Code2Prompt
 
-# Base directory for project repositories
-BASE_PROJECTS_DIR = Path(__file__).parent.parent / 'projects'
-
-# Ensure projects directory exists
-os.makedirs(BASE_PROJECTS_DIR, exist_ok=True)
-print(f"Project directory set up at: {BASE_PROJECTS_DIR}")
-
-def get_docker_client():
-    """Get Docker client - try remote host first, fallback to local"""
-    try:
-        # Get certificate paths from environment variables
-        ca_cert = os.getenv('DOCKER_CA_CERT')
-        client_cert = os.getenv('DOCKER_CLIENT_CERT')
-        client_key = os.getenv('DOCKER_CLIENT_KEY')
-        docker_host = os.getenv('DOCKER_HOST', 'tcp://167.99.52.130:2376')
-
-        if not all([ca_cert, client_cert, client_key]):
-            print("Missing Docker TLS certificates in environment variables")
-            raise Exception("Docker TLS certificates not configured")
-
-        # Create temporary files for the certificates
-        import tempfile
-        import atexit
-
-        cert_files = []
-        def cleanup_cert_files():
-            for f in cert_files:
-                try:
-                    os.remove(f)
-                except Exception as e:
-                    print(f"Failed to clean up {f}: {str(e)}")
-
-        atexit.register(cleanup_cert_files)
-
-        def write_temp_cert(content, suffix):
-            try:
-                temp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
-                temp.write(content.encode('utf-8'))
-                temp.flush()
-                cert_files.append(temp.name)
-                return temp.name
-            except Exception as e:
-                print(f"Error creating temporary {suffix} file: {str(e)}")
-                raise
-
-        ca_cert_path = write_temp_cert(ca_cert, '.ca.pem')
-        client_cert_path = write_temp_cert(client_cert, '.cert.pem')
-        client_key_path = write_temp_cert(client_key, '.key.pem')
+logger = logging.getLogger(__name__)
 
+# Base directory for project repositories (created on demand by clone_repo)
+BASE_PROJECTS_DIR = Path(__file__).parent.parent / 'projects'
 
-
-        # Try to connect to remote Docker host with increased timeouts
-        client = docker.DockerClient(
-            base_url=docker_host,
-            tls=docker.tls.TLSConfig(
-                ca_cert=ca_cert_path,
-                client_cert=(client_cert_path, client_key_path),
-                verify=True
-            ),
-            timeout=120  # Increase timeout to 120 seconds
-        )
-        
-        # Test the connection with timeout
-        client.ping()
-        return client
-    except Exception as e:
-        print(f"\nFailed to connect to remote Docker host: {str(e)}")
-        try:
-            # Try to connect to the local Docker socket instead
-            client = docker.DockerClient(
-                base_url='unix://var/run/docker.sock',
-                timeout=120  # Same timeout for local connection
-            )
-            client.ping()
-            print("Connected to local Docker socket")
-            return client
-        except Exception as local_e:
-            print(f"Failed to connect to local Docker: {str(local_e)}")
-            raise  # Raise the exception instead of returning None
+# Admin "try test" candidates are removed this long after creation
+ADMIN_TEST_CANDIDATE_TTL_MINUTES = int(os.getenv('ADMIN_TEST_CANDIDATE_TTL_MINUTES', '60'))
+ADMIN_TEST_CLEANUP_INTERVAL_SECONDS = int(os.getenv('ADMIN_TEST_CLEANUP_INTERVAL_SECONDS', '900'))
+ADMIN_TEST_CLEANUP_BATCH_SIZE = int(os.getenv('ADMIN_TEST_CLEANUP_BATCH_SIZE', '200'))
 
 def sanitize_name(name):
     """Sanitize a name for Docker container use"""
@@ -107,8 +50,8 @@ def exec_command(command):
 
 def _mark_test_assignment_completed(cursor, test_id, candidate_id):
     """
-    Mark a test_candidate assignment as completed and refresh the parent test's aggregate counts.
-    Returns True if an assignment row was updated.
+    Mark a test_candidate assignment as completed (test_stats and the test's counts are
+    refreshed by database triggers). Returns True if an assignment row was updated.
     """
     if not test_id or not candidate_id:
         return False
@@ -122,20 +65,7 @@ def _mark_test_assignment_completed(cursor, test_id, candidate_id):
         (test_id, candidate_id)
     )
 
-    if cursor.rowcount <= 0:
-        return False
-
-    cursor.execute(
-        '''
-        UPDATE tests
-        SET candidates_completed = (
-            SELECT COUNT(*) FROM test_candidates WHERE test_id = %s AND completed = TRUE
-        )
-        WHERE id = %s
-        ''',
-        (test_id, test_id)
-    )
-    return True
+    return cursor.rowcount > 0
 
 async def clone_repo(repo_url, target_folder, token=None, exec_fn=None):
     """Clone a GitHub repository to the target folder"""
@@ -159,106 +89,160 @@ async def clone_repo(repo_url, target_folder, token=None, exec_fn=None):
     else:
         return exec_command(command)
 
-def get_all_instances():
-    """Get all instances from the database and format them for the frontend"""
+# Output keys that need a Docker lookup; the rest come straight from the database
+INSTANCE_DOCKER_FIELDS = ('Id', 'Names', 'Image', 'ImageID', 'Command', 'Created', 'Ports', 'Status', 'State')
+
+INSTANCE_LIST_SPEC = {
+    # Fixed projection (only what the formatter uses); fields= filters the formatted output
+    'select': '''
+        ti.id, ti.test_id, ti.candidate_id, ti.docker_instance_id, ti.docker_host, ti.created_at,
+        t.name AS test_name, c.name AS candidate_name, c.email AS candidate_email
+    ''',
+    'fields': {name: None for name in INSTANCE_DOCKER_FIELDS + ('id', 'test_id', 'candidate_id', 'test_name', 'candidate_name')},
+    'sorts': {
+        'created_at': 'ti.created_at',
+        'id': 'ti.id'
+    },
+    'default_sort': 'id',
+    'filters': {
+        'test_id': ('ti.test_id = %s', int),
+        'candidate_id': ('ti.candidate_id = %s', int),
+        'created_after': ('ti.created_at >= %s', iso_datetime),
+        'created_before': ('ti.created_at < %s', iso_datetime)
+    },
+    'id': 'ti.id'
+}
+
+def _format_db_instance(db_instance):
+    """Format a database instance row for the frontend without Docker details"""
+    return {
+        'Id': db_instance['docker_instance_id'] or 'unknown',
+        'Names': [f"/test-instance-{db_instance['id']}"],
+        'Image': 'unknown',
+        'ImageID': 'unknown',
+        'Command': '',
+        'Created': str(db_instance['created_at']) if db_instance['created_at'] else '',
+        'Ports': [],
+        'Status': 'unknown',
+        'State': {},
+        # Add the DB fields as well
+        'test_id': db_instance['test_id'],
+        'candidate_id': db_instance['candidate_id'],
+        'test_name': db_instance['test_name'],
+        'candidate_name': db_instance['candidate_name'],
+        'id': db_instance['id']
+    }
+
+def _instance_list_needs_docker(list_params):
+    return not list_params['fields'] or any(name in INSTANCE_DOCKER_FIELDS for name in list_params['fields'])
+
+def instance_list_needs_docker(params=None):
+    """True if get_all_instances(params) inspects containers (its output then is not versioned)"""
+    return _instance_list_needs_docker(parse_list_params(params or {}, INSTANCE_LIST_SPEC))
+
+def get_all_instances(params=None):
+    """
+    Get all instances from the database and format them for the frontend
+
+    params (dict, optional): List query parameters (fields, sort, test_id, candidate_id,
+    created_after, created_before, limit, cursor); see INSTANCE_LIST_SPEC. Containers are only
+    inspected for the returned page, and not at all when fields= names no Docker fields.
+    Returns a list, or {"items", "next_cursor"} when limit/cursor is given.
+    """
+    list_params = parse_list_params(params or {}, INSTANCE_LIST_SPEC)
+    needs_docker = _instance_list_needs_docker(list_params)
+
     # Connect to the database
     conn = get_connection()
     cursor = conn.cursor()
     
     try:
-        # Get all instances from the database
-        cursor.execute('''
-            SELECT ti.*, t.name as test_name, c.name as candidate_name, c.email as candidate_email
-            FROM test_instances ti
+        # Get instances from the database (one page when paginated)
+        db_instances, next_cursor = fetch_list(
+            cursor, INSTANCE_LIST_SPEC,
+            '''test_instances ti
             LEFT JOIN tests t ON ti.test_id = t.id
-            LEFT JOIN candidates c ON ti.candidate_id = c.id
-            WHERE ti.docker_instance_id != 'pending'
-        ''')
-        
-        db_instances = [dict(row) for row in cursor.fetchall()]
+            LEFT JOIN candidates c ON ti.candidate_id = c.id''',
+            ["ti.docker_instance_id != 'pending'"], [], list_params
+        )
         
         # Try to connect to Docker, but handle gracefully if not available
         running_instances = []
-        
-        try:
-            client = get_docker_client()
+        if needs_docker:
+            try:
+                clients = connect_hosts(i['docker_host'] for i in db_instances)
+                if db_instances and not any(clients.values()):
+                    raise Exception('No Docker host is reachable')
             
-            for db_instance in db_instances:
-                try:
-                    # Try to get the container info
-                    container = client.containers.get(db_instance['docker_instance_id'])
+                for db_instance in db_instances:
+                    client = clients[host_name(db_instance['docker_host'])]
+                    if client is None:
+                        # Its host is down: show what the database knows
+                        running_instances.append(_format_db_instance(db_instance))
+                        continue
+                    try:
+                        # Try to get the container info
+                        container = client.containers.get(db_instance['docker_instance_id'])
                     
-                    # If the container exists, format it for the frontend
-                    if container:
-                        container_info = client.api.inspect_container(container.id)
+                        # If the container exists, format it for the frontend
+                        if container:
+                            container_info = client.api.inspect_container(container.id)
                         
-                        # Get container ports (similar to what Docker CLI would show)
-                        ports = []
-                        if 'NetworkSettings' in container_info and 'Ports' in container_info['NetworkSettings']:
-                            for port_key, bindings in container_info['NetworkSettings']['Ports'].items():
-                                if bindings:
-                                    for binding in bindings:
-                                        ports.append({
-                                            'PrivatePort': int(port_key.split('/')[0]),
-                                            'PublicPort': int(binding['HostPort']),
-                                            'Type': port_key.split('/')[1]
-                                        })
+                            # Get container ports (similar to what Docker CLI would show)
+                            ports = []
+                            if 'NetworkSettings' in container_info and 'Ports' in container_info['NetworkSettings']:
+                                for port_key, bindings in container_info['NetworkSettings']['Ports'].items():
+                                    if bindings:
+                                        for binding in bindings:
+                                            ports.append({
+                                                'PrivatePort': int(port_key.split('/')[0]),
+                                                'PublicPort': int(binding['HostPort']),
+                                                'Type': port_key.split('/')[1]
+                                            })
                         
-                        # Format the instance for the frontend
-                        instance = {
-                            'Id': container.id,
-                            'Names': [f"/{container.name}"],  # Frontend expects an array of names with leading slash
-                            'Image': container.image.tags[0] if container.image.tags else 'unknown',
-                            'ImageID': container.image.id,
-                            'Command': container_info.get('Config', {}).get('Cmd', [''])[0] if container_info.get('Config', {}).get('Cmd') else '',
-                            'Created': container_info.get('Created', ''),
-                            'Ports': ports,
-                            'Status': container.status,
-                            'State': container_info.get('State', {}),
-                            # Add the DB fields as well
-                            'test_id': db_instance['test_id'],
-                            'candidate_id': db_instance['candidate_id'],
-                            'test_name': db_instance['test_name'],
-                            'candidate_name': db_instance['candidate_name'],
-                            'id': db_instance['id']  # Include the database ID
-                        }
+                            # Format the instance for the frontend
+                            instance = {
+                                'Id': container.id,
+                                'Names': [f"/{container.name}"],  # Frontend expects an array of names with leading slash
+                                'Image': container.image.tags[0] if container.image.tags else 'unknown',
+                                'ImageID': container.image.id,
+                                'Command': container_info.get('Config', {}).get('Cmd', [''])[0] if container_info.get('Config', {}).get('Cmd') else '',
+                                'Created': container_info.get('Created', ''),
+                                'Ports': ports,
+                                'Status': container.status,
+                                'State': container_info.get('State', {}),
+                                # Add the DB fields as well
+                                'test_id': db_instance['test_id'],
+                                'candidate_id': db_instance['candidate_id'],
+                                'test_name': db_instance['test_name'],
+                                'candidate_name': db_instance['candidate_name'],
+                                'id': db_instance['id']  # Include the database ID
+                            }
                         
-                        running_instances.append(instance)
-                except docker.errors.NotFound:
-                    # Container not found in Docker, skip it
-                    continue
-                except Exception as e:
-                    print(f"Error getting container info for instance {db_instance['id']}: {str(e)}")
-                    continue
+                            running_instances.append(instance)
+                    except docker.errors.NotFound:
+                        # The container is gone (the reconcile job marks the row): list it as missing
+                        missing = _format_db_instance(db_instance)
+                        missing['Status'] = 'missing'
+                        running_instances.append(missing)
+                    except Exception as e:
+                        print(f"Error getting container info for instance {db_instance['id']}: {str(e)}")
+                        continue
                     
-        except Exception as e:
-            print(f"Docker not available or connection failed: {str(e)}")
-            # If Docker is not available, return database instances with basic info
-            for db_instance in db_instances:
-                instance = {
-                    'Id': db_instance['docker_instance_id'] or 'unknown',
-                    'Names': [f"/test-instance-{db_instance['id']}"],
-                    'Image': 'unknown',
-                    'ImageID': 'unknown',
-                    'Command': '',
-                    'Created': str(db_instance['created_at']) if db_instance['created_at'] else '',
-                    'Ports': [],
-                    'Status': 'unknown',
-                    'State': {},
-                    # Add the DB fields as well
-                    'test_id': db_instance['test_id'],
-                    'candidate_id': db_instance['candidate_id'],
-                    'test_name': db_instance['test_name'],
-                    'candidate_name': db_instance['candidate_name'],
-                    'id': db_instance['id']
-                }
-                running_instances.append(instance)
+            except Exception as e:
+                print(f"Docker not available or connection failed: {str(e)}")
+                # If Docker is not available, return database instances with basic info
+                running_instances = [_format_db_instance(db_instance) for db_instance in db_instances]
+        else:
+            # Only database fields requested: skip the container lookups
+            running_instances = [_format_db_instance(db_instance) for db_instance in db_instances]
         
-        return running_instances
+        running_instances = [project_fields(instance, list_params['fields']) for instance in running_instances]
+        return list_response(running_instances, next_cursor, list_params)
     
     except Exception as e:
         print(f"Error getting instances: {str(e)}")
-        return []
+        return list_response([], None, list_params)
     
     finally:
         conn.close()
@@ -292,12 +276,12 @@ def get_instance(instance_id, company_id=None):
         conn.close()
 
 def resolve_instance_id_by_test_and_candidate(test_id: int, candidate_id: int):
-    """Resolve latest test_instances.id by test_id and candidate_id."""
+    """Resolve test_instances.id by test_id and candidate_id (unique together)."""
     conn = get_connection()
     cursor = conn.cursor()
     try:
         cursor.execute(
-            'SELECT id FROM test_instances WHERE test_id = %s AND candidate_id = %s ORDER BY id DESC LIMIT 1',
+            'SELECT id FROM test_instances WHERE test_id = %s AND candidate_id = %s',
             (test_id, candidate_id)
         )
         row = cursor.fetchone()
@@ -305,41 +289,198 @@ def resolve_instance_id_by_test_and_candidate(test_id: int, candidate_id: int):
     finally:
         conn.close()
 
-def cleanup_admin_test_candidates():
-    """Clean up temporary admin test candidates and their instances"""
+@register_job('instances.cleanup_admin_test_candidates', max_attempts=3)
+def cleanup_admin_test_candidates(payload=None):
+    """
+    Job: delete temporary admin test candidates with their instances, assignments,
+    containers and timers.
+
+    Candidates are removed in batches of ADMIN_TEST_CLEANUP_BATCH_SIZE, with one
+    set-based DELETE per table per batch.
+    """
+    removed_candidates = 0
+    removed_instances = []
+    while True:
+        conn = get_connection()
+        cursor = conn.cursor()
+        try:
+            # Find admin test candidates older than the TTL (skip rows another cleanup is handling)
+            cursor.execute('''
+                SELECT id FROM candidates
+                WHERE email LIKE 'admin-test-%%@example.com'
+                AND created_at < NOW() - make_interval(mins => %s)
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            ''', (ADMIN_TEST_CANDIDATE_TTL_MINUTES, ADMIN_TEST_CLEANUP_BATCH_SIZE))
+            candidate_ids = [row['id'] for row in cursor.fetchall()]
+            if not candidate_ids:
+                conn.commit()
+                break
+
+            # Delete associated instances first (tokens, chat history and reports cascade)
+            cursor.execute(
+                'DELETE FROM test_instances WHERE candidate_id = ANY(%s) RETURNING id, docker_instance_id, docker_host',
+                (candidate_ids,)
+            )
+            batch_instances = [dict(row) for row in cursor.fetchall()]
+
+            # Per-test counts are refreshed by the test_stats triggers
+            cursor.execute('DELETE FROM test_candidates WHERE candidate_id = ANY(%s)', (candidate_ids,))
+
+            # Then delete the candidates
+            cursor.execute('DELETE FROM candidates WHERE id = ANY(%s)', (candidate_ids,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        removed_candidates += len(candidate_ids)
+        removed_instances.extend(batch_instances)
+        if len(candidate_ids) < ADMIN_TEST_CLEANUP_BATCH_SIZE:
+            break
+
+    # Containers and timers live outside the database; failures here are logged, not retried
+    clients = connect_hosts(
+        i['docker_host'] for i in removed_instances
+        if i['docker_instance_id'] and i['docker_instance_id'] != 'pending'
+    )
+
+    removed_containers = 0
+    for instance in removed_instances:
+        docker_id = instance['docker_instance_id']
+        docker_client = clients.get(host_name(instance['docker_host']))
+        if docker_client and docker_id and docker_id != 'pending':
+            try:
+                container = docker_client.containers.get(docker_id)
+                container.remove(force=True)
+                removed_containers += 1
+            except docker.errors.NotFound:
+                pass
+            except Exception as e:
+                print(f"Error removing container {docker_id} for instance {instance['id']}: {str(e)}")
+        try:
+            delete_timer(instance['id'])
+        except Exception as e:
+            print(f"Warning: could not delete timer for instance {instance['id']}: {str(e)}")
+
+    if removed_candidates:
+        print(
+            f"Cleaned up {removed_candidates} old admin test candidates "
+            f"({len(removed_instances)} instances, {removed_containers} containers)"
+        )
+    return {
+        'candidates': removed_candidates,
+        'instances': len(removed_instances),
+        'containers': removed_containers
+    }
+
+
+register_recurring_job(
+    'instances.cleanup_admin_test_candidates',
+    interval_seconds=ADMIN_TEST_CLEANUP_INTERVAL_SECONDS
+)
+
+def _has_queued_instances(cursor):
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM test_instances WHERE provisioning_status = 'queued') AS queued")
+    return cursor.fetchone()['queued']
+
+def _queue_instance(cursor, instance):
+    """Put an instance in the provisioning queue (commits) and note its position on the dict"""
+    cursor.execute(
+        "UPDATE test_instances SET provisioning_status = 'queued', updated_at = NOW() WHERE id = %s",
+        (instance['id'],)
+    )
+    cursor.connection.commit()
+    cursor.execute(
+        "SELECT COUNT(*) AS position FROM test_instances WHERE provisioning_status = 'queued' AND id <= %s",
+        (instance['id'],)
+    )
+    instance['provisioning_status'] = 'queued'
+    instance['queue_position'] = cursor.fetchone()['position']
+
+@register_job('instances.provision_queued', max_attempts=1)
+def provision_queued_instances(payload=None):
+    """
+    Job: create containers for queued instances, oldest first, until the queue is empty or the
+    host is full (the oldest instance then keeps its place for the next run).
+    """
+    provisioned, failed = [], []
+    while True:
+        conn = get_connection()
+        cursor = conn.cursor()
+        try:
+            # The row lock keeps concurrent runs from provisioning the same instance
+            cursor.execute('''
+                SELECT id, test_id, candidate_id, company_id FROM test_instances
+                WHERE provisioning_status = 'queued'
+                ORDER BY id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            ''')
+            queued = cursor.fetchone()
+            if not queued:
+                break
+            instance_id = queued['id']
+            try:
+                docker_info = create_docker_container(
+                    instance_id, queued['test_id'], queued['candidate_id'], queued['company_id']
+                )
+            except CapacityError:
+                break
+            if docker_info:
+                cursor.execute(
+                    '''UPDATE test_instances
+                       SET docker_instance_id = %s, port = %s, docker_host = %s, provisioning_status = NULL,
+                           updated_at = NOW()
+                       WHERE id = %s''',
+                    (docker_info.get('container_id'), docker_info.get('port'), docker_info.get('docker_host'), instance_id)
+                )
+                provisioned.append(instance_id)
+            else:
+                # Same outcome as a failed synchronous creation: the instance stays without a container
+                cursor.execute(
+                    "UPDATE test_instances SET provisioning_status = 'failed', updated_at = NOW() WHERE id = %s",
+                    (instance_id,)
+                )
+                failed.append(instance_id)
+            conn.commit()
+        finally:
+            conn.close()
+    return {'provisioned': provisioned, 'failed': failed}
+
+register_recurring_job('instances.provision_queued', interval_seconds=CAPACITY_QUEUE_POLL_SECONDS)
+
+def get_instance_capacity():
+    """Density and headroom of each Docker host, with totals and the length of the provisioning queue"""
+    hosts = get_hosts_capacity()
+    reachable = [h for h in hosts if 'error' not in h]
+    return {
+        'hosts': hosts,
+        'containers': sum(h['containers'] for h in reachable),
+        'memory_mb': {
+            key: sum(h['memory_mb'][key] for h in reachable) for key in ('capacity', 'reserved', 'headroom')
+        },
+        'cpus': {
+            key: round(sum(h['cpus'][key] for h in reachable), 2) for key in ('capacity', 'reserved', 'headroom')
+        },
+        'queued': count_queued_instances(),
+        'saturated': all(h['saturated'] for h in hosts)
+    }
+
+def get_instance_routing_map(host_name=None):
+    """nginx map of the instances the proxy of a Docker host has to forward to other hosts"""
     conn = get_connection()
     cursor = conn.cursor()
     try:
-        # Find admin test candidates older than 1 hour
-        cursor.execute('''
-            SELECT id FROM candidates 
-            WHERE email LIKE 'admin-test-%@example.com'
-            AND created_at < NOW() - INTERVAL '1 hour'
-        ''')
-        old_candidates = cursor.fetchall()
-        
-        for candidate in old_candidates:
-            candidate_id = candidate['id']
-            print(f"Cleaning up old admin test candidate {candidate_id}")
-            
-            # Delete associated instances first
-            cursor.execute('DELETE FROM test_instances WHERE candidate_id = %s', (candidate_id,))
-            # Then delete the candidate
-            cursor.execute('DELETE FROM candidates WHERE id = %s', (candidate_id,))
-        
-        conn.commit()
-        print(f"Cleaned up {len(old_candidates)} old admin test candidates")
-    except Exception as e:
-        print(f"Error cleaning up admin test candidates: {str(e)}")
-        conn.rollback()
+        return instance_routing_map(cursor, host_name)
     finally:
         conn.close()
 
 def create_instance(test_id, candidate_id, company_id):
     """Create a new test instance"""
-    # Clean up old admin test candidates first
-    cleanup_admin_test_candidates()
-    
     conn = get_connection()
     cursor = conn.cursor()
     try:
@@ -351,7 +492,7 @@ def create_instance(test_id, candidate_id, company_id):
         if not test:
             print(f"Test not found for test_id: {test_id} and company_id: {company_id}")
             raise ValueError('Test not found')
-        print(f"Found test: {dict(test)}")
+        logger.debug("Found test %s", test_id, extra={'fields': {'test': summarize(dict(test))}})
         
         # Check if candidate exists and belongs to company
         cursor.execute('SELECT * FROM candidates WHERE id = %s AND company_id = %s', (candidate_id, company_id))
@@ -359,34 +500,30 @@ def create_instance(test_id, candidate_id, company_id):
         if not candidate:
             print(f"Candidate not found for candidate_id: {candidate_id} and company_id: {company_id}")
             raise ValueError('Candidate not found')
-        print(f"Found candidate: {dict(candidate)}")
-        
-        # Check if instance already exists
-        cursor.execute('''
-            SELECT id, test_id, candidate_id, docker_instance_id, port, created_at 
-            FROM test_instances 
-            WHERE test_id = %s AND candidate_id = %s''',
-            (test_id, candidate_id))
-        existing = cursor.fetchone()
-        if existing:
-            print(f"Found existing instance: {dict(existing)}")
-            raise ValueError('Test instance already exists for this candidate')
+        logger.debug("Found candidate %s", candidate_id, extra={'fields': {'candidate': summarize(dict(candidate))}})
         
-        # Create instance
+        # Create instance; the unique (test_id, candidate_id) index makes concurrent requests for
+        # the same candidate create one row (and so one container), the others get no row back
         print("Creating new instance...")
         cursor.execute(
             '''INSERT INTO test_instances (test_id, candidate_id, company_id, created_at, updated_at)
-               VALUES (%s, %s, %s, NOW(), NOW()) RETURNING id''',
+               VALUES (%s, %s, %s, NOW(), NOW())
+               ON CONFLICT (test_id, candidate_id) DO NOTHING
+               RETURNING id''',
             (test_id, candidate_id, company_id)
         )
-        instance_id = cursor.fetchone()['id']
+        created = cursor.fetchone()
         conn.commit()
+        if not created:
+            print(f"Instance already exists for test_id: {test_id}, candidate_id: {candidate_id}")
+            raise ValueError('Test instance already exists for this candidate')
+        instance_id = created['id']
         print(f"Created instance with ID: {instance_id}")
         
         # Get the created instance
         cursor.execute('SELECT * FROM test_instances WHERE id = %s', (instance_id,))
         instance = dict(cursor.fetchone())
-        print(f"Retrieved instance details: {instance}")
+        logger.debug("Retrieved instance details", extra={'fields': {'instance': summarize(instance)}})
         
         # Reset any stale timer state for this instance id
         try:
@@ -395,21 +532,28 @@ def create_instance(test_id, candidate_id, company_id):
         except Exception as e:
             print(f"Warning: could not delete stale timer for instance {instance_id}: {str(e)}")
 
-        # Create the Docker container
+        # Create the Docker container, unless the host is full or earlier instances are still
+        # waiting for room: the instance is then queued for the instances.provision_queued job
         try:
-            docker_info = create_docker_container(instance_id, test_id, candidate_id, company_id)
-            if docker_info:
-                instance.update(docker_info)
-                # Update instance with Docker info
-                cursor.execute(
-                    'UPDATE test_instances SET docker_instance_id = %s, port = %s WHERE id = %s',
-                    (docker_info.get('container_id'), docker_info.get('port'), instance_id)
-                )
-                conn.commit()
-                print(f"Updated instance with Docker info: {docker_info}")
-                # Do not start initial timer here; start after extension loads/consent screen redirect
+            if _has_queued_instances(cursor):
+                _queue_instance(cursor, instance)
             else:
-                print("No Docker info returned from create_docker_container")
+                docker_info = create_docker_container(instance_id, test_id, candidate_id, company_id)
+                if docker_info:
+                    instance.update(docker_info)
+                    # Update instance with Docker info
+                    cursor.execute(
+                        'UPDATE test_instances SET docker_instance_id = %s, port = %s, docker_host = %s WHERE id = %s',
+                        (docker_info.get('container_id'), docker_info.get('port'), docker_info.get('docker_host'), instance_id)
+                    )
+                    conn.commit()
+                    print(f"Updated instance with Docker info: {docker_info}")
+                    # Do not start initial timer here; start after extension loads/consent screen redirect
+                else:
+                    print("No Docker info returned from create_docker_container")
+        except CapacityError as e:
+            print(f"Queueing instance {instance_id}: {str(e)}")
+            _queue_instance(cursor, instance)
         except Exception as e:
             print(f"Failed to create Docker container: {str(e)}")
             # Continue without Docker container - instance still created in DB
@@ -457,6 +601,7 @@ def update_instance(instance_id, data, company_id=None):
                    WHERE id = %s'''
         cursor.execute(query, update_values)
         conn.commit()
+        forget_instance(instance_id)
         
         # Get updated instance
         cursor.execute('SELECT * FROM test_instances WHERE id = %s', (instance_id,))
@@ -483,6 +628,7 @@ def delete_instance(instance_id, company_id=None):
         # Delete instance
         cursor.execute('DELETE FROM test_instances WHERE id = %s', (instance_id,))
         conn.commit()
+        forget_instance(instance_id)
         return True
     except Exception as e:
         conn.rollback()
@@ -492,36 +638,18 @@ def delete_instance(instance_id, company_id=None):
 
 def get_instance_with_details(instance_id, company_id=None):
     """Get a test instance with test and candidate details"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        # Check if instance exists and belongs to company
-        if company_id:
-            cursor.execute('SELECT * FROM test_instances WHERE id = %s AND company_id = %s', (instance_id, company_id))
-        else:
-            cursor.execute('SELECT * FROM test_instances WHERE id = %s', (instance_id,))
-        
-        instance = cursor.fetchone()
-        if not instance:
-            return None
-        
-        instance_dict = dict(instance)
-    
-        # Get test details
-        cursor.execute('SELECT * FROM tests WHERE id = %s', (instance['test_id'],))
-        test = cursor.fetchone()
-        if test:
-            instance_dict['test'] = dict(test)
-        
-        # Get candidate details
-        cursor.execute('SELECT * FROM candidates WHERE id = %s', (instance['candidate_id'],))
-        candidate = cursor.fetchone()
-        if candidate:
-            instance_dict['candidate'] = dict(candidate)
-        
-        return instance_dict
-    finally:
-        conn.close()
+    aggregate = load_instance_aggregate(instance_id)
+    # Check if instance exists and belongs to company
+    if not aggregate:
+        return None
+    instance_dict = aggregate['instance']
+    if company_id and str(instance_dict['company_id']) != str(company_id):
+        return None
+    if aggregate['test']:
+        instance_dict['test'] = aggregate['test']
+    if aggregate['candidate']:
+        instance_dict['candidate'] = aggregate['candidate']
+    return instance_dict
 
 def stop_instance(instance_id):
     """Stop a Docker instance and update its status"""
@@ -540,8 +668,8 @@ def stop_instance(instance_id):
         docker_id = instance['docker_instance_id']
         
         if docker_id and docker_id != 'pending':
-            # Connect to Docker
-            client = get_docker_client()
+            # Connect to the Docker host the container runs on
+            client = get_instance_docker_client(instance)
             
             try:
                 container = client.containers.get(docker_id)
@@ -549,6 +677,11 @@ def stop_instance(instance_id):
                 container.remove()
                 
                 conn.commit()
+                # Its resources may let a queued instance start
+                try:
+                    enqueue_job('instances.provision_queued', unique_key='instances.provision_queued:kick')
+                except Exception as e:
+                    print(f"Warning: could not queue provisioning after stopping instance {instance_id}: {str(e)}")
                 
                 print(f"Instance {instance_id} (Docker ID: {docker_id}) stopped and removed successfully")
                 return {"success": True, "message": f"Instance {instance_id} stopped successfully"}
@@ -573,22 +706,20 @@ def stop_instance(instance_id):
     finally:
         conn.close()
 
-def _git_clone_sparse(repo_url: str, target_dir: Path, token: str):
-    """Clones a project repository to a target directory."""
-    repo_url_for_clone = repo_url
-    if token:
-        if repo_url_for_clone.startswith('https://'):
-            repo_url_for_clone = f"https://x-access-token:{token}@{repo_url_for_clone[8:]}"
-        else:
-            # Fallback or handle other protocols if necessary, for now assume https
-            repo_url_for_clone = f"https://x-access-token:{token}@{repo_url_for_clone}"
-    
-    try:
-        exec_command(f"git clone --sparse --depth 1 {repo_url_for_clone} {str(target_dir)}")
-        print(f"Cloned target repo {repo_url} to {target_dir}")
-    except Exception as e:
-        raise Exception(f"Failed to clone target repository {repo_url}: {str(e)}")
-
+@register_job('instances.stop_expired', max_attempts=3)
+def stop_expired_instance(payload):
+    """
+    Job: stop the container of an instance whose project timer expired (queued by the timer
+    scheduler when TIMER_EXPIRY_STOP_AFTER_SECONDS is set). Skipped if the timer was reset since.
+    """
+    instance_id = payload['instance_id']
+    status = get_timer_status(instance_id)
+    if status and status['version'] != payload.get('timer_version', status['version']):
+        return {'skipped': True, 'reason': 'timer changed since expiry'}
+    result = stop_instance(instance_id)
+    if not result.get('success'):
+        raise RuntimeError(result.get('message'))
+    return result
 
 def upload_project_to_github(instance_id, file_storage):
     """Uploads the candidate's project files to the specified target GitHub repository."""
@@ -640,118 +771,40 @@ def upload_project_to_github(instance_id, file_storage):
         conn.close()
         conn = None
 
-        # Proceed with file handling and Git operations
-        # Create a temporary directory to store the uploaded zip and its extracted contents
-        with tempfile.TemporaryDirectory() as temp_dir_base_path:
-            temp_dir_path = Path(temp_dir_base_path)
-            zip_file_path = temp_dir_path / file_storage.filename
-            file_storage.save(str(zip_file_path))
-
-            extracted_files_path = temp_dir_path / 'extracted_project'
-            os.makedirs(extracted_files_path, exist_ok=True)
-            with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
-                zip_ref.extractall(extracted_files_path)
-            
-            print(f"Files extracted to: {extracted_files_path}")
+        # Read the archive straight from the upload stream: members are decompressed once,
+        # ignored paths are skipped, and nothing is written to disk
+        entries = list(iter_zip_entries(file_storage.stream))
+        print(f"Read {len(entries)} files from {file_storage.filename}")
 
-            # Create another temporary directory for cloning the target repository
-            with tempfile.TemporaryDirectory() as clone_dir_base_path:
-                clone_dir_path = Path(clone_dir_base_path)
-                
-                # Clone the target repository
-                _git_clone_sparse(target_repo_url, clone_dir_path, target_repo_token)
-
-                # Define the subdirectory for the candidate's submission
-                submission_dir_name = f"submission_candidate_{candidate_id}_instance_{instance_id}"
-                submission_path = clone_dir_path / submission_dir_name
-
-                # If directory exists, remove it to ensure a clean state (or decide on update strategy)
-                if submission_path.exists():
-                    shutil.rmtree(submission_path)
-                os.makedirs(submission_path, exist_ok=True)
-
-                # Copy extracted files into the submission subdirectory
-                for item in extracted_files_path.iterdir():
-                    if item.is_dir():
-                        shutil.copytree(item, submission_path / item.name)
-                    else:
-                        shutil.copy2(item, submission_path / item.name)
-                
-                print(f"Copied project files to {submission_path}")
-
-                # Code2Prompt codebase
-                config = {
-                    "path": f"{submission_path}",
-                    "include_patterns": ["*"],
-                    "exclude_patterns": [], # TODO: ignore common non-source files
-                    # "include_patterns": ["*.rs"],
-                    # "exclude_patterns": ["tests/*"],
-                }
-                c2p = Code2Prompt(**config)
-                codebase_rendered = c2p.generate()
-                codebase_text = codebase_rendered.prompt
-                # Git operations: add, commit, push
-                original_cwd = os.getcwd()
-                os.chdir(clone_dir_path)
-                diff_text = ""
-                commit_created = False
-                parent_commit_available = False
-                try:
-                    exec_command("git config user.name \"Automated Uploader\"")
-                    exec_command("git config user.email \"uploader@example.com\"") # Placeholder because git requires an uploader email
-                    exec_command("git add . --sparse")
-                    status_output = exec_command("git status --short")
-                    has_changes = bool(status_output.strip())
-
-                    if not has_changes:
-                        print("No git changes detected; skipping commit and push.")
-                        diff_text = "No diff – workspace matches template state."
-                    else:
-                        commit_message = f"Upload project submission for candidate {candidate_name} (ID: {candidate_id}), Instance: {instance_id}"
-                        exec_command(f'git commit -m "{commit_message}"' )
-                        commit_created = True
-
-                        try:
-                            exec_command("git rev-parse --verify HEAD^")
-                            parent_commit_available = True
-                        except Exception:
-                            parent_commit_available = False
-
-                        diff_command = "git diff HEAD^ HEAD" if parent_commit_available else "git show HEAD"
-                        diff_output = exec_command(diff_command)
-                        diff_text = diff_output if isinstance(diff_output, str) else str(diff_output)
-
-                        # Determine current branch
-                        current_branch = exec_command("git rev-parse --abbrev-ref HEAD").strip()
-                        
-                        # Use x-access-token URL for pushes when token is available
-                        if target_repo_token:
-                            push_url = target_repo_url
-                            if push_url.startswith('https://'):
-                                push_url = f"https://x-access-token:{target_repo_token}@{push_url[8:]}"
-                            else:
-                                push_url = f"https://x-access-token:{target_repo_token}@{push_url}"
-                            exec_command(f"git push {push_url} {current_branch}")
-                        else:
-                            exec_command(f"git push origin {current_branch}")
-                        print(f"Successfully pushed changes to {target_repo_url} on branch {current_branch}")
-
-                    if not diff_text:
-                        # Create an explicit empty diff so downstream consumers know there were no changes
-                        diff_text = "No diff – workspace matches template state."
-                except Exception as e:
-                    # Attempt to reset if commit/push fails to avoid leaving repo in bad state
-                    if commit_created and parent_commit_available:
-                        try:
-                            exec_command("git reset --hard HEAD^") # Revert last commit if push failed and parent exists
-                            print("Git state reset to HEAD^ after push failure.")
-                        except Exception as reset_e:
-                            print(f"Could not reset git state after push failure: {reset_e}")
-                    else:
-                        print("Skipping git reset because no commit was created or no parent commit is available.")
-                    raise Exception(f"Git operations failed: {str(e)}")
-                finally:
-                    os.chdir(original_cwd) # Important to change back CWD
+        # Define the subdirectory for the candidate's submission
+        submission_dir_name = f"submission_candidate_{candidate_id}_instance_{instance_id}"
+
+        # Render the codebase (ignores binaries, lockfiles and vendored deps; cached per blob)
+        codebase_rendered = render_codebase_entries(entries, root_label=submission_dir_name)
+        codebase_text = codebase_rendered['prompt']
+
+        # Replace the submission directory on the target branch and push (no checkout needed)
+        commit_message = f"Upload project submission for candidate {candidate_name} (ID: {candidate_id}), Instance: {instance_id}"
+        try:
+            commit_result = commit_submission(
+                target_repo_url,
+                target_repo_token,
+                submission_dir_name,
+                entries,
+                commit_message
+            )
+        except Exception as e:
+            raise Exception(f"Git operations failed: {str(e)}")
+
+        if commit_result['changed']:
+            print(f"Successfully pushed changes to {target_repo_url} on branch {commit_result['branch']}")
+        else:
+            print("No git changes detected; skipping commit and push.")
+
+        diff_text = commit_result['diff']
+        if not diff_text:
+            # Create an explicit empty diff so downstream consumers know there were no changes
+            diff_text = "No diff – workspace matches template state."
 
         combined_workspace = f"<codebase>\n{codebase_text}\n</codebase>\n<codebase_diff>\n{diff_text}\n</codebase_diff>"
 
@@ -759,6 +812,8 @@ def upload_project_to_github(instance_id, file_storage):
             "success": True,
             "message": f"Project for candidate {candidate_id} uploaded successfully to {target_repo_url}/{submission_dir_name}",
             "codebase": codebase_text,
+            "codebaseTokens": codebase_rendered['token_count'],
+            "codebaseFiles": [{"path": f['path'], "tokens": f['tokens']} for f in codebase_rendered['files']],
             "diff": diff_text,
             "workspaceContent": combined_workspace
         }
@@ -783,91 +838,76 @@ def create_docker_container(instance_id, test_id, candidate_id, company_id):
     """Create a Docker container for a test instance"""
     conn = None
     try:
-        # Get Docker client
+        # Get test details
+        conn = get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT * FROM tests WHERE id = %s', (test_id,))
+        test = cursor.fetchone()
+        if not test:
+            raise ValueError('Test not found')
+        
+        test = dict(test)
+        test['project_helper_enabled'] = bool(test.get('project_helper_enabled'))
+        # The test row carries prompts and tokens: only a redacted, truncated summary at debug level
+        logger.debug("Retrieved test %s", test_id, extra={'fields': {'test': summarize(test)}})
+        
+        # Place the container on a host with room for the test's resource profile
+        profile = resource_profile(test)
+        docker_host = choose_docker_host(profile)
         try:
-            print("\nAttempting to connect to Docker daemon...")
-            client = get_docker_client()
+            logger.info(f"Attempting to connect to Docker host {docker_host}...")
+            client = get_docker_client(docker_host)
             if not client:
                 raise Exception("Could not connect to Docker daemon")
-            print("Successfully got Docker client")
+            logger.debug("Successfully got Docker client")
             
             # Test Docker connection
             try:
                 info = client.info()
-                print(f"Docker version: {info.get('ServerVersion')}")
-                print(f"Total containers: {info.get('Containers')}")
-                print(f"Running containers: {info.get('ContainersRunning')}")
+                logger.debug(
+                    f"Docker version: {info.get('ServerVersion')}, containers: {info.get('Containers')} "
+                    f"({info.get('ContainersRunning')} running)"
+                )
             except Exception as e:
-                print(f"Warning: Could not get Docker info: {str(e)}")
+                logger.warning(f"Could not get Docker info: {str(e)}")
             
         except Exception as e:
-            print(f"Error connecting to Docker: {str(e)}")
+            logger.error(f"Error connecting to Docker: {str(e)}")
             if hasattr(e, 'stderr'):
-                print(f"Docker stderr: {e.stderr}")
+                logger.error(f"Docker stderr: {e.stderr}")
             return None
         
-        # Get test details
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM tests WHERE id = %s', (test_id,))
-        test = cursor.fetchone()
-        if not test:
-            raise ValueError('Test not found')
-        
-        test = dict(test)
-        test['project_helper_enabled'] = bool(test.get('project_helper_enabled'))
-        print(f"Retrieved test details: {test}")
-        
         # Generate a unique container name that matches nginx routing pattern
         container_name = f"instance-{instance_id}"
-        print(f"Generated container name: {container_name}")
+        logger.debug("Generated container name: %s", container_name)
         
-        # Use the existing simple Docker image for instances
+        # Use the test's derived image when it is built, else the public base image
         try:
-            print(f"Using existing image for instance {instance_id}...")
+            logger.debug("Using existing image for instance %s...", instance_id)
             
-            # Force usage of the public image (simple image deprecated)
-            image_name = 'ectan/ai-oa-public:latest'
+            image_name, template_commit = select_instance_image(client, test, docker_host)
             image = client.images.get(image_name)
-            print(f"Using image for instance {instance_id}: {image_name}")
+            logger.info(f"Using image for instance {instance_id}: {image_name}")
                     
         except Exception as e:
-            print(f"Error with Docker image: {str(e)}")
+            logger.error(f"Error with Docker image: {str(e)}")
             return None
         
         # Ensure the ai-oa-network exists
         try:
             network = client.networks.get('ai-oa-network')
-            print(f"Using existing Docker network: ai-oa-network")
+            logger.debug("Using existing Docker network: ai-oa-network")
         except docker.errors.NotFound:
-            print("Creating Docker network: ai-oa-network")
+            logger.info("Creating Docker network: ai-oa-network")
             network = client.networks.create('ai-oa-network', driver='bridge')
         except Exception as e:
-            print(f"Error with Docker network: {str(e)}")
+            logger.error(f"Error with Docker network: {str(e)}")
             return None
 
         # Create the container
         try:
-            print(f"\nCreating container for Docker network communication")
-            print("Container configuration:")
-            print(f"- Image: {image_name}")
-            print(f"- Name: {container_name}")
-            print(f"- Network: ai-oa-network (internal communication)")
-            print(f"- Environment variables:")
-            print(f"  - TEST_ID: {test_id}")
-            print(f"  - CANDIDATE_ID: {candidate_id}")
-            print(f"  - INSTANCE_ID: {instance_id}")
-            print(f"  - INITIAL_PROMPT: {'SET' if test.get('initial_prompt') else 'NOT SET'}")
-            print(f"  - FINAL_PROMPT: {'SET' if test.get('final_prompt') else 'NOT SET'}")
-            print(f"  - ASSESSMENT_PROMPT: {'SET' if test.get('qualitative_assessment_prompt') else 'NOT SET'}")
-            print(f"  - ENABLE_INITIAL_TIMER: {test.get('enable_timer', 1)}")
-            print(f"  - INITIAL_DURATION_MINUTES: {test.get('timer_duration', 10)}")
-            print(f"  - ENABLE_PROJECT_TIMER: {test.get('enable_project_timer', 1)}")
-            print(f"  - PROJECT_DURATION_MINUTES: {test.get('project_timer_duration', 60)}")
-            print(f"  - PROJECT_HELPER_ENABLED: {test.get('project_helper_enabled')}")
-            print(f"  - INITIAL_QUESTION_BUDGET: {test.get('initial_question_budget', 'DEFAULT')}")
-            print(f"  - FINAL_QUESTION_BUDGET: {test.get('final_question_budget', 'DEFAULT')}")
+            logger.info(f"Creating container {container_name} from {image_name} on network ai-oa-network")
             
             # Prepare environment variables including GitHub repo info
             env_vars = {
@@ -911,25 +951,52 @@ def create_docker_container(instance_id, test_id, candidate_id, company_id):
             if test.get('final_question_budget') is not None:
                 env_vars['FINAL_QUESTION_BUDGET'] = str(test.get('final_question_budget'))
 
-            # Create the container without port mapping (network communication only)
-            container = client.containers.create(
-                image_name,
-                name=container_name,
-                environment=env_vars,
-                detach=True,
-                network='ai-oa-network',
-                healthcheck={
-                    "test": ["CMD", "sh", "-c", "curl -f http://localhost:80 || exit 1"],
-                    "interval": 1000000000,  # 1 second
-                    "timeout": 5000000000,   # 5 seconds
-                    "retries": 30,
-                    "start_period": 3000000000  # 3 seconds
-                }
-            )
+            logger.debug("Container environment", extra={'fields': {'environment': summarize(env_vars)}})
+
+            # Create the container without port mapping (network communication only), within the
+            # test's resource profile and only if the host has room for it (else CapacityError)
+            logger.info(f"Resources for {container_name}: {profile['mem_limit_mb']} MB, {profile['nano_cpus'] / 1e9:g} CPUs, {profile['pids_limit']} PIDs")
+            with reserve_capacity(client, profile, get_docker_host(docker_host)):
+                container = client.containers.create(
+                    image_name,
+                    name=container_name,
+                    environment=env_vars,
+                    detach=True,
+                    network='ai-oa-network',
+                    labels=container_labels(instance_id, test_id, profile),
+                    healthcheck={
+                        "test": ["CMD", "sh", "-c", "curl -f http://localhost:80 || exit 1"],
+                        "interval": 1000000000,  # 1 second
+                        "timeout": 5000000000,   # 5 seconds
+                        "retries": 30,
+                        "start_period": 3000000000  # 3 seconds
+                    },
+                    **container_resource_options(profile)
+                )
             
+            # Derived images carry the template; otherwise copy it from the local cache
+            # (without either, the container clones GITHUB_REPO itself)
+            if not template_commit:
+                template_commit = seed_container_template(container, test)
+            if template_commit:
+                logger.info(f"Container for instance {instance_id} starts from template {template_commit[:12]}")
+                # The container skips the target repository when seeded, so the baseline commit is ours
+                if test.get('target_github_repo'):
+                    enqueue_job(
+                        'templates.commit_baseline',
+                        {
+                            'test_id': test_id,
+                            'instance_id': instance_id,
+                            'submission_dir': env_vars['SUBMISSION_DIR'],
+                            'commit': template_commit
+                        },
+                        unique_key=f'templates.commit_baseline:{instance_id}',
+                        company_id=company_id
+                    )
+
             # Start the container
             container.start()
-            print(f"\nCreated and started Docker container {container.id} for instance {instance_id}")
+            logger.info(f"Created and started Docker container {container.id} for instance {instance_id}")
             
             # Wait for container to be healthy (up to 30 seconds)
             max_wait = 30
@@ -939,65 +1006,71 @@ def create_docker_container(instance_id, test_id, candidate_id, company_id):
                     container.reload()
                     status = container.status
                     health = container.attrs.get('State', {}).get('Health', {}).get('Status', 'unknown')
-                    print(f"Container status: {status}, health: {health}")
+                    logger.debug("Container status: %s, health: %s", status, health)
                     
                     if status == 'running' and health == 'healthy':
                         break
                     elif status in ['exited', 'dead']:
-                        print("\nContainer logs before failure:")
-                        print(container.logs().decode('utf-8'))
+                        logger.error(
+                            "Container logs before failure",
+                            extra={'fields': {'logs': summarize(container.logs(tail=200).decode('utf-8', errors='replace'), max_chars=4000)}}
+                        )
                         raise Exception(f"Container failed to start. Status: {status}")
                         
                     time.sleep(wait_interval)
                 except docker.errors.NotFound:
-                    print("Container was removed unexpectedly")
+                    logger.warning("Container was removed unexpectedly")
                     raise Exception("Container was removed unexpectedly")
                 except Exception as e:
-                    print(f"Error checking container status: {str(e)}")
+                    logger.error(f"Error checking container status: {str(e)}")
                     if i == max_wait - 1:  # Last iteration
                         raise Exception("Container failed to become healthy")
                     continue
             
-            # Get container logs
-            print("\nContainer logs:")
-            print(container.logs().decode('utf-8'))
-            
-            # Get detailed container info
-            inspect_info = client.api.inspect_container(container.id)
-            print("\nContainer network settings:")
-            networks = inspect_info.get('NetworkSettings', {}).get('Networks', {})
-            if 'ai-oa-network' in networks:
-                network_info = networks['ai-oa-network']
-                print(f"Network IP: {network_info.get('IPAddress', 'N/A')}")
-                print(f"Gateway: {network_info.get('Gateway', 'N/A')}")
+            # Container logs and network details cost extra Docker API calls: debug only
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "Container logs",
+                    extra={'fields': {'logs': summarize(container.logs(tail=200).decode('utf-8', errors='replace'), max_chars=4000)}}
+                )
+                inspect_info = client.api.inspect_container(container.id)
+                networks = inspect_info.get('NetworkSettings', {}).get('Networks', {})
+                if 'ai-oa-network' in networks:
+                    network_info = networks['ai-oa-network']
+                    logger.debug("Network IP: %s, gateway: %s", network_info.get('IPAddress', 'N/A'), network_info.get('Gateway', 'N/A'))
             
             # Generate subdomain URL (nginx proxy routes to this container)
             access_url = f"https://instance-{instance_id}.verihire.me"
-            print(f"\nGenerated access URL: {access_url}")
-            print(f"Nginx will route this subdomain to container '{container_name}' on the ai-oa-network")
+            logger.info(f"Instance {instance_id} is reachable at {access_url} (container {container_name})")
             
             return {
                 'container_id': container.id,
                 'port': 80,  # Always port 80 for internal network communication
-                'access_url': access_url
+                'access_url': access_url,
+                'docker_host': docker_host
             }
+        except CapacityError:
+            raise
         except docker.errors.APIError as e:
-            print(f"\nDocker API error creating container: {str(e)}")
+            logger.error(f"Docker API error creating container: {str(e)}")
             if hasattr(e, 'explanation'):
-                print(f"API error explanation: {e.explanation}")
+                logger.error(f"API error explanation: {e.explanation}")
             if hasattr(e, 'stderr'):
-                print(f"API error stderr: {e.stderr}")
+                logger.error(f"API error stderr: {e.stderr}")
             raise
         except Exception as e:
-            print(f"\nError creating Docker container: {str(e)}")
+            logger.error(f"Error creating Docker container: {str(e)}")
             if hasattr(e, 'stderr'):
-                print(f"Error stderr: {e.stderr}")
+                logger.error(f"Error stderr: {e.stderr}")
             raise
             
+    except CapacityError:
+        # The caller queues the instance instead
+        raise
     except Exception as e:
-        print(f"\nError in create_docker_container: {str(e)}")
+        logger.error(f"Error in create_docker_container: {str(e)}")
         if hasattr(e, 'stderr'):
-            print(f"Error stderr: {e.stderr}")
+            logger.error(f"Error stderr: {e.stderr}")
         return None
     finally:
         if conn:
@@ -1013,162 +1086,130 @@ def get_report(instance_id):
     Returns:
         dict: The report data or a message if no report exists
     """
-    conn = get_connection()
-    cursor = conn.cursor()
+    # Instance, test and latest report in one query (shared with the rest of the request)
+    aggregate = load_instance_aggregate(instance_id)
+    if not aggregate or not aggregate['test']:
+        print(f"instance with ID {instance_id} not found")
+        return {"message": f"Instance with ID {instance_id} not found"}
+    test_data = dict(aggregate['test'], candidate_id=aggregate['instance']['candidate_id'])
+    project_helper_enabled = bool(test_data.get('project_helper_enabled'))
     
-    try:
-        # Check if instance exists
-        cursor.execute('''
-            SELECT 
-                ti.candidate_id,
-                ti.test_id,
-                ti.created_at AS instance_created_at,
-                ti.company_id,
-                t.initial_prompt,
-                t.final_prompt,
-                t.qualitative_assessment_prompt,
-                t.quantitative_assessment_prompt,
-                t.target_github_repo,
-                t.project_helper_enabled
-            FROM test_instances ti
-            JOIN tests t ON ti.test_id = t.id
-            WHERE ti.id = %s
-        ''', (instance_id,))
-        test_record = cursor.fetchone()
-        if not test_record:
-            print(f"instance with ID {instance_id} not found")
-            return {"message": f"Instance with ID {instance_id} not found"}
-        test_data = dict(test_record)
-        project_helper_enabled = bool(test_data.get('project_helper_enabled'))
-        
-        # Check if a report already exists
-        cursor.execute(
-            'SELECT * FROM reports WHERE instance_id = %s',
-            (instance_id,)
-        )
-        report_row = cursor.fetchone()
-        if not report_row:
-            return {"message": f"No report exists for instance {instance_id}"}
-        
-        def _serialize_timestamp(value):
-            if not value:
-                return None
-            if hasattr(value, 'isoformat'):
-                try:
-                    return value.isoformat()
-                except Exception:
-                    pass
-            if isinstance(value, str):
-                return value
-            return str(value)
-
-        report_payload = report_row['content']
-        if isinstance(report_payload, str):
-            try:
-                report_payload = json.loads(report_payload)
-            except Exception:
-                report_payload = {"content": report_payload}
-        elif not isinstance(report_payload, dict):
-            report_payload = {"content": report_payload}
-
-        created_at = report_row.get('created_at')
-        if created_at and not report_payload.get('created_at'):
-            serialized_ts = _serialize_timestamp(created_at)
-            if serialized_ts:
-                report_payload['created_at'] = serialized_ts
-
-        # Attach configured qualitative/quantitative criteria templates
-        qualitative_template = []
-        raw_qualitative = test_data.get('qualitative_assessment_prompt')
-        if raw_qualitative and raw_qualitative != "[]":
+    # Check if a report already exists
+    report_row = aggregate['report']
+    if not report_row:
+        return {"message": f"No report exists for instance {instance_id}"}
+    
+    def _serialize_timestamp(value):
+        if not value:
+            return None
+        if hasattr(value, 'isoformat'):
             try:
-                qualitative_template = json.loads(raw_qualitative)
+                return value.isoformat()
             except Exception:
-                qualitative_template = []
-        if qualitative_template:
-            report_payload['qualitative_criteria_template'] = qualitative_template
+                pass
+        if isinstance(value, str):
+            return value
+        return str(value)
 
-        quantitative_template = []
-        raw_quantitative = test_data.get('quantitative_assessment_prompt')
-        if raw_quantitative and raw_quantitative != "[]":
-            try:
-                quantitative_template = json.loads(raw_quantitative)
-            except Exception:
-                quantitative_template = []
-        if quantitative_template:
-            report_payload['quantitative_criteria_template'] = quantitative_template
+    report_payload = report_row['content']
+    if isinstance(report_payload, str):
+        try:
+            report_payload = json.loads(report_payload)
+        except Exception:
+            report_payload = {"content": report_payload}
+    elif not isinstance(report_payload, dict):
+        report_payload = {"content": report_payload}
+
+    created_at = report_row.get('created_at')
+    if created_at and not report_payload.get('created_at'):
+        serialized_ts = _serialize_timestamp(created_at)
+        if serialized_ts:
+            report_payload['created_at'] = serialized_ts
+
+    # Attach configured qualitative/quantitative criteria templates
+    qualitative_template = []
+    raw_qualitative = test_data.get('qualitative_assessment_prompt')
+    if raw_qualitative and raw_qualitative != "[]":
+        try:
+            qualitative_template = json.loads(raw_qualitative)
+        except Exception:
+            qualitative_template = []
+    if qualitative_template:
+        report_payload['qualitative_criteria_template'] = qualitative_template
 
-        # Build initial and final interview logs from chat history
+    quantitative_template = []
+    raw_quantitative = test_data.get('quantitative_assessment_prompt')
+    if raw_quantitative and raw_quantitative != "[]":
         try:
-            chat_history_list = get_chat_history(instance_id) or []
+            quantitative_template = json.loads(raw_quantitative)
         except Exception:
-            chat_history_list = []
-
-        initial_log = []
-        project_log = []
-        final_log = []
-        current_phase = 'initial'
-
-        for message in chat_history_list:
-            content = message.get('content', '')
-            role = message.get('role')
-
-            if isinstance(content, str) and role == 'system' and content.startswith('PHASE_MARKER:'):
-                marker = content.split(':', 1)[1].strip().lower()
-                if marker.startswith('initial'):
-                    current_phase = 'initial'
-                elif marker.startswith('project'):
-                    current_phase = 'project'
-                elif marker.startswith('final'):
-                    if 'completed' in marker:
-                        current_phase = 'post_final'
-                    else:
-                        current_phase = 'final'
-                continue
-
-            if role in ('user', 'assistant'):
-                sanitized = {
-                    'role': role,
-                    'content': content,
-                    'created_at': _serialize_timestamp(message.get('created_at')),
-                    'user_name': message.get('user_name')
-                }
+            quantitative_template = []
+    if quantitative_template:
+        report_payload['quantitative_criteria_template'] = quantitative_template
 
-                if current_phase == 'initial':
-                    initial_log.append(sanitized)
-                elif current_phase == 'project':
-                    project_log.append(sanitized)
-                elif current_phase == 'final':
-                    final_log.append(sanitized)
-
-        if initial_log:
-            report_payload['initial_interview_log'] = initial_log
-        report_payload['project_helper_enabled'] = project_helper_enabled
-        if project_helper_enabled and project_log:
-            report_payload['project_helper_log'] = project_log
-        if final_log:
-            report_payload['final_interview_log'] = final_log
-
-        # Provide submission repository link if configured
-        target_repo_url = test_data.get('target_github_repo')
-        candidate_id = test_data.get('candidate_id')
-        if target_repo_url and candidate_id:
-            base_repo_url = target_repo_url[:-4] if target_repo_url.endswith('.git') else target_repo_url
-            submission_dir_name = f"submission_candidate_{candidate_id}_instance_{instance_id}"
-            submission_link = base_repo_url.rstrip('/') + '/' + submission_dir_name
-            report_payload['submission_repo_link'] = submission_link
-            report_payload['submission_repo_folder'] = submission_dir_name
-            report_payload['target_repository'] = base_repo_url.rstrip('/')
-        
-        return report_payload
-        
-    
-    except Exception as e:
-        conn.rollback()
-        raise e
+    # Build initial and final interview logs from chat history
+    try:
+        chat_history_list = get_chat_history(instance_id) or []
+    except Exception:
+        chat_history_list = []
+
+    initial_log = []
+    project_log = []
+    final_log = []
+    current_phase = 'initial'
+
+    for message in chat_history_list:
+        content = message.get('content', '')
+        role = message.get('role')
+
+        if isinstance(content, str) and role == 'system' and content.startswith('PHASE_MARKER:'):
+            marker = content.split(':', 1)[1].strip().lower()
+            if marker.startswith('initial'):
+                current_phase = 'initial'
+            elif marker.startswith('project'):
+                current_phase = 'project'
+            elif marker.startswith('final'):
+                if 'completed' in marker:
+                    current_phase = 'post_final'
+                else:
+                    current_phase = 'final'
+            continue
+
+        if role in ('user', 'assistant'):
+            sanitized = {
+                'role': role,
+                'content': content,
+                'created_at': _serialize_timestamp(message.get('created_at')),
+                'user_name': message.get('user_name')
+            }
+
+            if current_phase == 'initial':
+                initial_log.append(sanitized)
+            elif current_phase == 'project':
+                project_log.append(sanitized)
+            elif current_phase == 'final':
+                final_log.append(sanitized)
+
+    if initial_log:
+        report_payload['initial_interview_log'] = initial_log
+    report_payload['project_helper_enabled'] = project_helper_enabled
+    if project_helper_enabled and project_log:
+        report_payload['project_helper_log'] = project_log
+    if final_log:
+        report_payload['final_interview_log'] = final_log
+
+    # Provide submission repository link if configured
+    target_repo_url = test_data.get('target_github_repo')
+    candidate_id = test_data.get('candidate_id')
+    if target_repo_url and candidate_id:
+        base_repo_url = target_repo_url[:-4] if target_repo_url.endswith('.git') else target_repo_url
+        submission_dir_name = f"submission_candidate_{candidate_id}_instance_{instance_id}"
+        submission_link = base_repo_url.rstrip('/') + '/' + submission_dir_name
+        report_payload['submission_repo_link'] = submission_link
+        report_payload['submission_repo_folder'] = submission_dir_name
+        report_payload['target_repository'] = base_repo_url.rstrip('/')
     
-    finally:
-        conn.close()
+    return report_payload
 
 def create_report(instance_id, workspace_content, workspace_diff=None):
     """
@@ -1229,38 +1270,26 @@ def create_report(instance_id, workspace_content, workspace_diff=None):
     cursor = conn.cursor()
     
     try:
-        # Check if instance exists and get test data
-        cursor.execute('''
-            SELECT 
-                ti.test_id,
-                ti.candidate_id,
-                ti.company_id,
-                t.initial_prompt,
-                t.final_prompt,
-                t.qualitative_assessment_prompt,
-                t.quantitative_assessment_prompt,
-                t.project_helper_enabled
-            FROM test_instances ti
-            JOIN tests t ON ti.test_id = t.id
-            WHERE ti.id = %s
-        ''', (instance_id,))
-        test_record = cursor.fetchone()
-        if not test_record:
+        # Check if instance exists and get test data and any existing report (one query)
+        aggregate = load_instance_aggregate(instance_id)
+        if not aggregate or not aggregate['test']:
             print(f"instance with ID {instance_id} not found")
             return {"message": f"Instance with ID {instance_id} not found"}
         
-        test_data = dict(test_record)
-        print("test data:", test_data)
+        instance = aggregate['instance']
+        test_data = dict(
+            aggregate['test'],
+            test_id=instance['test_id'],
+            candidate_id=instance['candidate_id'],
+            company_id=instance['company_id']
+        )
+        logger.debug("Report test data", extra={'fields': {'test': summarize(test_data)}})
         project_helper_enabled = bool(test_data.get('project_helper_enabled'))
         
-        
-        # Check if a report already exists
-        cursor.execute('SELECT * FROM reports WHERE instance_id = %s', (instance_id,))
-        existing_report = cursor.fetchone()
-        report_exists = existing_report is not None
+        report_exists = aggregate['report'] is not None
         
         # Create new report
-        print("Creating new report")
+        logger.debug("Creating new report for instance %s", instance_id)
         field_definitions = {}
         
         field_definitions['code_summary'] = (
@@ -1360,10 +1389,9 @@ def create_report(instance_id, workspace_content, workspace_diff=None):
             str,
             Field(title="Report Warnings", description="Any critical issues with report generation, such as missing required information, should be explained here.")
         )
-        print("added all fields")
         # Step 3: Create the base model dynamically
         DynamicModel = create_model('DynamicModel', **field_definitions)
-        print("dynamic model created")
+        logger.debug("Report model created for instance %s", instance_id)
         # Step 4: Define the model with validators (conditional)
         class ReportSchema(DynamicModel):
             class Config:
@@ -1375,8 +1403,9 @@ def create_report(instance_id, workspace_content, workspace_diff=None):
                 def validate_qualitative_keys(cls, v):
                     expected_keys_ci = {qc['title'].casefold() for qc in qualitative_criteria_list}
                     v_keys_ci = {qc.title.casefold() for qc in v}
-                    print(v)
-                    print("v_keys (ci):", v_keys_ci)
+                    logger.debug("Validating qualitative criteria", extra={'fields': {
+                        'criteria': summarize([qc.title for qc in v])
+                    }})
                     if v_keys_ci != expected_keys_ci:
                         missing_ci = expected_keys_ci - v_keys_ci
                         extra_ci = v_keys_ci - expected_keys_ci
@@ -1404,7 +1433,6 @@ def create_report(instance_id, workspace_content, workspace_diff=None):
                             )
                     return v
 
-        print("schema created")
         # Prompt
         messages = []
         messages.append({"role": "developer",
@@ -1421,8 +1449,7 @@ def create_report(instance_id, workspace_content, workspace_diff=None):
             # Fallback to vars if it's not a Pydantic model
             report = vars(report_obj)
 
-        print("api returned")
-        print(report)
+        logger.debug("Report generated for instance %s", instance_id, extra={'fields': {'report': summarize(report)}})
         
         if report_exists:
             cursor.execute(
@@ -1445,7 +1472,8 @@ def create_report(instance_id, workspace_content, workspace_diff=None):
             raise completion_error
 
         conn.commit()
-        print("report inserted")
+        forget_instance(instance_id)
+        logger.debug("Report saved for instance %s", instance_id)
 
         return report
     
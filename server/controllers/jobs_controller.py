@@ -0,0 +1,429 @@
+"""
+Postgres-backed background jobs.
+
+Handlers are registered by name with @register_job and enqueued with enqueue_job().
+Workers claim jobs with SELECT ... FOR UPDATE SKIP LOCKED, so any number of worker
+processes (or in-process worker threads) can share the queue without double-running
+a job. Failed jobs are retried with exponential backoff until max_attempts is reached.
+Recurring jobs are kept alive as a single queued row per job type via unique_key.
+"""
+import importlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta, timezone
+
+from psycopg2.extras import Json
+from database.db_postgresql import attribute_queries, get_connection
+
+logger = logging.getLogger(__name__)
+
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv('JOB_POLL_INTERVAL_SECONDS', '1.0'))
+
+# Jobs left 'running' longer than this are assumed to belong to a dead worker
+JOB_LOCK_TIMEOUT_SECONDS = int(os.getenv('JOB_LOCK_TIMEOUT_SECONDS', '900'))
+
+# Finished jobs are deleted after this many days
+JOB_RETENTION_DAYS = int(os.getenv('JOB_RETENTION_DAYS', '7'))
+
+MAX_RETRY_DELAY_SECONDS = 3600
+
+PRIORITY_HIGH = 10
+PRIORITY_NORMAL = 100
+PRIORITY_LOW = 1000
+
+# Modules that register job handlers; imported by workers before they start claiming jobs
+JOB_HANDLER_MODULES = [
+    'controllers.email_controller',
+    'controllers.instances_controller',
+    'controllers.templates_controller',
+    'controllers.images_controller',
+    'controllers.idle_controller',
+    'controllers.reconcile_controller',
+]
+
+JOB_HANDLERS = {}    # job_type -> {'func', 'max_attempts', 'retry_delay'}
+RECURRING_JOBS = {}  # job_type -> {'interval', 'priority', 'payload'}
+
+
+def register_job(job_type, max_attempts=5, retry_delay=30):
+    """
+    Register a function as the handler for a job type.
+
+    The handler is called with the job payload (a dict) and may return a JSON-serializable
+    result. Raising an exception marks the attempt as failed and schedules a retry after
+    retry_delay * 2^(attempt - 1) seconds.
+    """
+    def decorator(func):
+        JOB_HANDLERS[job_type] = {
+            'func': func,
+            'max_attempts': max_attempts,
+            'retry_delay': retry_delay
+        }
+        return func
+    return decorator
+
+
+def register_recurring_job(job_type, interval_seconds, payload=None, priority=PRIORITY_LOW):
+    """Run a registered job type every interval_seconds (at most one pending run at a time)."""
+    RECURRING_JOBS[job_type] = {
+        'interval': interval_seconds,
+        'priority': priority,
+        'payload': payload or {}
+    }
+
+
+def load_job_handlers():
+    """Import every module in JOB_HANDLER_MODULES so their handlers are registered."""
+    for module in JOB_HANDLER_MODULES:
+        importlib.import_module(module)
+
+
+def _recurring_unique_key(job_type):
+    return f'recurring:{job_type}'
+
+
+def enqueue_job(job_type, payload=None, priority=PRIORITY_NORMAL, run_at=None, delay_seconds=0,
+                unique_key=None, max_attempts=None, company_id=None, cursor=None):
+    """
+    Add a job to the queue.
+
+    Args:
+        job_type (str): Name the handler was registered under.
+        payload (dict, optional): JSON-serializable arguments for the handler.
+        priority (int): Lower runs first.
+        run_at (datetime, optional): Earliest time to run. Defaults to now + delay_seconds.
+        unique_key (str, optional): While a job with this key is queued or running,
+                                    further enqueues with the same key are ignored.
+        max_attempts (int, optional): Overrides the handler's default.
+        company_id (int, optional): Owning company, used to scope the status API.
+        cursor (optional): Enqueue inside the caller's transaction instead of committing separately.
+
+    Returns:
+        int: The new job id, or None if an equivalent job was already pending.
+    """
+    if max_attempts is None:
+        max_attempts = JOB_HANDLERS.get(job_type, {}).get('max_attempts', 5)
+    if run_at is None:
+        run_at = datetime.now(timezone.utc) + timedelta(seconds=delay_seconds)
+
+    params = (job_type, Json(payload or {}), priority, run_at, max_attempts, unique_key, company_id)
+    query = '''
+        INSERT INTO jobs (job_type, payload, priority, run_at, max_attempts, unique_key, company_id)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (unique_key) WHERE unique_key IS NOT NULL AND status IN ('queued', 'running')
+        DO NOTHING
+        RETURNING id
+    '''
+
+    if cursor is not None:
+        cursor.execute(query, params)
+        row = cursor.fetchone()
+        return row['id'] if row else None
+
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        row = cursor.fetchone()
+        conn.commit()
+        return row['id'] if row else None
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def _format_job(job):
+    job = dict(job)
+    for field in ('run_at', 'locked_at', 'created_at', 'updated_at', 'finished_at'):
+        if job.get(field) is not None:
+            job[field] = job[field].isoformat()
+    return job
+
+
+def get_job(job_id, company_id):
+    """Get one of a company's jobs by ID."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('SELECT * FROM jobs WHERE id = %s AND company_id = %s', (job_id, company_id))
+        job = cursor.fetchone()
+        if not job:
+            raise ValueError(f"Job with ID {job_id} not found")
+        return _format_job(job)
+    finally:
+        conn.close()
+
+
+def get_system_job(job_type, job_id=None):
+    """
+    A job of the given type that belongs to no company (housekeeping jobs): by ID, or the most
+    recent one. Raises ValueError if there is none.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        if job_id is not None:
+            cursor.execute(
+                'SELECT * FROM jobs WHERE id = %s AND job_type = %s AND company_id IS NULL',
+                (job_id, job_type)
+            )
+        else:
+            cursor.execute(
+                '''SELECT * FROM jobs WHERE job_type = %s AND company_id IS NULL
+                   ORDER BY created_at DESC, id DESC LIMIT 1''',
+                (job_type,)
+            )
+        job = cursor.fetchone()
+        if not job:
+            raise ValueError(f"No {job_type} job found" if job_id is None else f"Job with ID {job_id} not found")
+        return _format_job(job)
+    finally:
+        conn.close()
+
+
+def list_jobs(company_id, status=None, job_type=None, limit=50):
+    """List a company's most recent jobs, optionally filtered by status and type."""
+    conditions = ['company_id = %s']
+    params = [company_id]
+    if status:
+        conditions.append('status = %s')
+        params.append(status)
+    if job_type:
+        conditions.append('job_type = %s')
+        params.append(job_type)
+    where = f"WHERE {' AND '.join(conditions)}"
+    params.append(min(max(int(limit), 1), 500))
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f'SELECT * FROM jobs {where} ORDER BY created_at DESC, id DESC LIMIT %s', params)
+        return [_format_job(job) for job in cursor.fetchall()]
+    finally:
+        conn.close()
+
+
+def claim_job(worker_id):
+    """Atomically claim the next runnable job, or return None if the queue is empty."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''
+            UPDATE jobs
+            SET status = 'running', locked_by = %s, locked_at = NOW(),
+                attempts = attempts + 1, updated_at = NOW()
+            WHERE id = (
+                SELECT id FROM jobs
+                WHERE status = 'queued' AND run_at <= NOW()
+                ORDER BY priority, run_at, id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING *
+        ''', (worker_id,))
+        job = cursor.fetchone()
+        conn.commit()
+        return dict(job) if job else None
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def _schedule_next_run(cursor, job_type):
+    recurring = RECURRING_JOBS.get(job_type)
+    if not recurring:
+        return
+    enqueue_job(
+        job_type,
+        recurring['payload'],
+        priority=recurring['priority'],
+        delay_seconds=recurring['interval'],
+        unique_key=_recurring_unique_key(job_type),
+        cursor=cursor
+    )
+
+
+def complete_job(job, result=None):
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''
+            UPDATE jobs
+            SET status = 'completed', result = %s, last_error = NULL,
+                locked_by = NULL, locked_at = NULL, finished_at = NOW(), updated_at = NOW()
+            WHERE id = %s
+        ''', (Json(result) if result is not None else None, job['id']))
+        _schedule_next_run(cursor, job['job_type'])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def fail_job(job, error):
+    """Record a failed attempt; requeue with backoff or mark the job as failed for good."""
+    handler = JOB_HANDLERS.get(job['job_type'], {})
+    retry_delay = handler.get('retry_delay', 30)
+    final = job['attempts'] >= job['max_attempts']
+    delay = min(retry_delay * (2 ** max(job['attempts'] - 1, 0)), MAX_RETRY_DELAY_SECONDS)
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        if final:
+            cursor.execute('''
+                UPDATE jobs
+                SET status = 'failed', last_error = %s,
+                    locked_by = NULL, locked_at = NULL, finished_at = NOW(), updated_at = NOW()
+                WHERE id = %s
+            ''', (error, job['id']))
+            _schedule_next_run(cursor, job['job_type'])
+        else:
+            cursor.execute('''
+                UPDATE jobs
+                SET status = 'queued', last_error = %s, run_at = NOW() + make_interval(secs => %s),
+                    locked_by = NULL, locked_at = NULL, updated_at = NOW()
+                WHERE id = %s
+            ''', (error, delay, job['id']))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    if final:
+        logger.error(f"Job {job['id']} ({job['job_type']}) failed after {job['attempts']} attempts: {error}")
+    else:
+        logger.warning(
+            f"Job {job['id']} ({job['job_type']}) attempt {job['attempts']} failed; retrying in {delay}s: {error}"
+        )
+
+
+def requeue_stale_jobs():
+    """Put jobs whose worker died mid-run back on the queue."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''
+            UPDATE jobs
+            SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+                last_error = COALESCE(last_error, 'Worker stopped responding'),
+                locked_by = NULL, locked_at = NULL, updated_at = NOW()
+            WHERE status = 'running' AND locked_at < NOW() - make_interval(secs => %s)
+            RETURNING id
+        ''', (JOB_LOCK_TIMEOUT_SECONDS,))
+        requeued = [row['id'] for row in cursor.fetchall()]
+        conn.commit()
+        if requeued:
+            logger.warning(f"Requeued {len(requeued)} stale jobs: {requeued}")
+        return requeued
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def schedule_recurring_jobs():
+    """Make sure every recurring job has a pending run."""
+    for job_type, recurring in RECURRING_JOBS.items():
+        enqueue_job(
+            job_type,
+            recurring['payload'],
+            priority=recurring['priority'],
+            unique_key=_recurring_unique_key(job_type)
+        )
+
+
+def run_job(job):
+    """Run one claimed job and record the outcome."""
+    handler = JOB_HANDLERS.get(job['job_type'])
+    if not handler:
+        fail_job(job, f"No handler registered for job type {job['job_type']}")
+        return
+
+    started = time.monotonic()
+    try:
+        with attribute_queries(f"job:{job['job_type']}"):
+            result = handler['func'](job['payload'] or {})
+        json.dumps(result)  # Results are stored as JSONB
+    except Exception as e:
+        logger.debug(traceback.format_exc())
+        fail_job(job, f"{type(e).__name__}: {str(e)}")
+        return
+
+    complete_job(job, result)
+    logger.info(f"Job {job['id']} ({job['job_type']}) completed in {time.monotonic() - started:.2f}s")
+
+
+def run_worker(stop_event=None, worker_id=None):
+    """
+    Process jobs until stop_event is set.
+
+    Housekeeping (stale job recovery and recurring job scheduling) runs once a minute.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+    stop_event = stop_event or threading.Event()
+    logger.info(f"Job worker {worker_id} started ({len(JOB_HANDLERS)} handlers registered)")
+
+    next_housekeeping = 0
+    while not stop_event.is_set():
+        try:
+            if time.monotonic() >= next_housekeeping:
+                requeue_stale_jobs()
+                schedule_recurring_jobs()
+                next_housekeeping = time.monotonic() + 60
+
+            job = claim_job(worker_id)
+            if job is None:
+                stop_event.wait(JOB_POLL_INTERVAL_SECONDS)
+                continue
+            run_job(job)
+        except Exception as e:
+            logger.error(f"Job worker {worker_id} error: {str(e)}")
+            stop_event.wait(max(JOB_POLL_INTERVAL_SECONDS, 5))
+
+    logger.info(f"Job worker {worker_id} stopped")
+
+
+def start_worker_thread():
+    """Run a job worker in a daemon thread of the current process. Returns its stop event."""
+    stop_event = threading.Event()
+    threading.Thread(target=run_worker, args=(stop_event,), name='job-worker', daemon=True).start()
+    return stop_event
+
+
+@register_job('jobs.prune', max_attempts=1)
+def prune_finished_jobs(payload):
+    """Delete completed and failed jobs older than JOB_RETENTION_DAYS."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''
+            DELETE FROM jobs
+            WHERE status IN ('completed', 'failed')
+              AND finished_at < NOW() - make_interval(days => %s)
+        ''', (JOB_RETENTION_DAYS,))
+        deleted = cursor.rowcount
+        conn.commit()
+        return {'deleted': deleted}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+register_recurring_job('jobs.prune', interval_seconds=6 * 3600)
@@ -0,0 +1,183 @@
+"""
+Reconciliation of instance containers with test_instances.
+
+The 'instances.reconcile' job diffs the instance containers of every Docker host against the
+database:
+
+- orphaned containers (no test_instances row, or the row points at another container) are
+  stopped and removed, so leaked containers stop holding host capacity;
+- rows whose container is gone from a reachable host are marked with container_missing_at (and
+  unmarked if the container shows up again).
+
+Containers younger than RECONCILE_GRACE_SECONDS are left alone: create_docker_container creates
+the container before its id is written to the row. reconcile_instances(dry_run=True) reports
+what a run would do without changing anything.
+"""
+import logging
+import os
+import re
+import time
+
+from database.db_postgresql import get_connection
+from controllers.capacity_controller import LABEL_INSTANCE_ID
+from controllers.docker_hosts_controller import DOCKER_HOSTS, get_docker_client, host_name
+from controllers.jobs_controller import enqueue_job, register_job, register_recurring_job
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_ENABLED = os.getenv('RECONCILE_ENABLED', 'true').lower() == 'true'
+RECONCILE_INTERVAL_SECONDS = int(os.getenv('RECONCILE_INTERVAL_SECONDS', '900'))
+RECONCILE_GRACE_SECONDS = int(os.getenv('RECONCILE_GRACE_SECONDS', '900'))
+
+# Container names create_docker_container gives instances (nginx routes on the same pattern)
+INSTANCE_CONTAINER_NAME = re.compile(r'^/?instance-(\d+)$')
+
+
+def _container_instance_id(attrs):
+    """Instance id of a container from its label, else its name (None: not an instance container)"""
+    label = (attrs.get('Labels') or {}).get(LABEL_INSTANCE_ID)
+    if label and label.isdigit():
+        return int(label)
+    for name in attrs.get('Names') or []:
+        match = INSTANCE_CONTAINER_NAME.match(name)
+        if match:
+            return int(match.group(1))
+    return None
+
+def _row_host(row):
+    """Registry name of a row's host (None if the host is no longer in DOCKER_HOSTS)"""
+    try:
+        return host_name(row['docker_host'])
+    except ValueError:
+        return None
+
+def _load_instances():
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''
+            SELECT id, docker_instance_id, docker_host, container_missing_at
+            FROM test_instances
+        ''')
+        return {row['id']: row for row in cursor.fetchall()}
+    finally:
+        conn.close()
+
+def _diff_host(host, client, instances, now):
+    """Orphaned containers and missing/reappeared instance rows of one Docker host"""
+    containers = client.containers.list(all=True, sparse=True, filters={'name': 'instance-'})
+    present = set()
+    orphans = []
+    for container in containers:
+        attrs = container.attrs
+        instance_id = _container_instance_id(attrs)
+        if instance_id is None:
+            continue
+        present.add(container.id)
+        row = instances.get(instance_id)
+        if row and row['docker_instance_id'] == container.id and _row_host(row) == host:
+            continue
+        if now - int(attrs.get('Created') or 0) < RECONCILE_GRACE_SECONDS:
+            continue
+        orphans.append({
+            'container_id': container.id,
+            'name': (attrs.get('Names') or [''])[0].lstrip('/'),
+            'instance_id': instance_id,
+            'state': attrs.get('State'),
+            'reason': 'instance row points at another container' if row else 'no instance row'
+        })
+
+    missing, reappeared = [], []
+    for row in instances.values():
+        docker_id = row['docker_instance_id']
+        if not docker_id or docker_id == 'pending' or _row_host(row) != host:
+            continue
+        if docker_id not in present and not row['container_missing_at']:
+            missing.append(row['id'])
+        elif docker_id in present and row['container_missing_at']:
+            reappeared.append(row['id'])
+    return orphans, missing, reappeared
+
+def reconcile_instances(dry_run=False):
+    """
+    Diff every reachable Docker host against test_instances and (unless dry_run) remove orphaned
+    containers and mark rows whose container vanished. Returns a per-host report.
+    """
+    instances = _load_instances()
+    now = int(time.time())
+    report = {'dry_run': dry_run, 'hosts': []}
+    removed = 0
+    for host in DOCKER_HOSTS:
+        name = host['name']
+        try:
+            client = get_docker_client(name)
+            orphans, missing, reappeared = _diff_host(name, client, instances, now)
+        except Exception as e:
+            # An unreachable host says nothing about its containers: mark nothing
+            logger.warning(f"Skipping reconciliation of Docker host {name}: {str(e)}")
+            report['hosts'].append({'name': name, 'error': str(e)})
+            continue
+
+        if not dry_run:
+            for orphan in orphans:
+                try:
+                    client.containers.get(orphan['container_id']).remove(force=True)
+                    orphan['removed'] = True
+                    removed += 1
+                    logger.info(f"Removed orphaned container {orphan['name']} on {name}: {orphan['reason']}")
+                except Exception as e:
+                    orphan['removed'] = False
+                    orphan['error'] = str(e)
+                    logger.warning(f"Could not remove orphaned container {orphan['name']} on {name}: {str(e)}")
+            if missing or reappeared:
+                conn = get_connection()
+                cursor = conn.cursor()
+                try:
+                    cursor.execute(
+                        'UPDATE test_instances SET container_missing_at = NOW() WHERE id = ANY(%s)',
+                        (missing,)
+                    )
+                    cursor.execute(
+                        'UPDATE test_instances SET container_missing_at = NULL WHERE id = ANY(%s)',
+                        (reappeared,)
+                    )
+                    conn.commit()
+                finally:
+                    conn.close()
+                if missing:
+                    logger.info(f"Marked {len(missing)} instance(s) on {name} whose container is gone: {missing}")
+
+        report['hosts'].append({
+            'name': name,
+            'orphaned_containers': orphans,
+            'missing_containers': missing,
+            'reappeared_containers': reappeared
+        })
+
+    if removed:
+        # Removed orphans free capacity for queued instances
+        enqueue_job('instances.provision_queued', unique_key='instances.provision_queued:kick')
+    return report
+
+@register_job('instances.reconcile', max_attempts=1)
+def reconcile_instances_job(payload=None):
+    """Job: reconcile containers with test_instances (payload dry_run for a report only)."""
+    report = reconcile_instances(dry_run=bool((payload or {}).get('dry_run')))
+    # The full report is kept for GET /instances/reconcile
+    return {
+        'orphaned_containers': sum(len(h.get('orphaned_containers', [])) for h in report['hosts']),
+        'missing_containers': sum(len(h.get('missing_containers', [])) for h in report['hosts']),
+        'unreachable_hosts': [h['name'] for h in report['hosts'] if 'error' in h],
+        'report': report
+    }
+
+def enqueue_reconcile(dry_run=False):
+    """Queue a reconcile run now. Returns the job id (None if one of the same kind is pending)."""
+    return enqueue_job(
+        'instances.reconcile',
+        {'dry_run': dry_run},
+        unique_key=f"instances.reconcile:{'dry-run' if dry_run else 'run'}"
+    )
+
+if RECONCILE_ENABLED:
+    register_recurring_job('instances.reconcile', interval_seconds=RECONCILE_INTERVAL_SECONDS)
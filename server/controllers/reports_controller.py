@@ -1,10 +1,27 @@
 from database.db_postgresql import get_connection
+from datetime import date, datetime, time as dt_time
+from decimal import Decimal
+import csv
+import io
+import json
+import os
 import time
+import uuid
 
 '''
-Note: Nothing in this file is currently used.
+Note: Apart from the streaming export (export_reports), nothing in this file is currently used.
 '''
 
+# Rows fetched per round trip by the export's server-side cursor (memory use is bounded by this)
+REPORT_EXPORT_BATCH_SIZE = int(os.getenv('REPORT_EXPORT_BATCH_SIZE', '1000'))
+REPORT_EXPORT_FORMATS = ('ndjson', 'csv')
+
+# One row per test instance, in this column order (CSV header)
+REPORT_EXPORT_COLUMNS = [
+    'instance_id', 'test_id', 'test_name', 'candidate_id', 'candidate_name', 'candidate_email',
+    'completed', 'deadline', 'instance_created_at', 'report_created_at', 'report_updated_at', 'report'
+]
+
 def get_report(instance_id):
     """
     Get a report for a test instance
@@ -183,4 +200,131 @@ def get_company_report(company_id):
             'instances': instances
         }
     finally:
-        conn.close() 
\ No newline at end of file
+        conn.close() 
+
+def _parse_export_datetime(value, name, end_of_day=False):
+    """Parse an ISO date or datetime filter; a bare date for 'to' covers that whole day"""
+    if not value:
+        return None
+    try:
+        if len(value) == 10:
+            parsed = date.fromisoformat(value)
+            return datetime.combine(parsed, dt_time.max if end_of_day else dt_time.min)
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f"Invalid '{name}' date: {value} (expected ISO 8601, e.g. 2024-01-31)")
+
+def _export_value(value):
+    """Make a database value JSON/CSV friendly"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+def _format_export_row(row, fmt, writer=None):
+    """Return an NDJSON line, or write a CSV row to writer"""
+    values = {col: _export_value(row[col]) for col in REPORT_EXPORT_COLUMNS}
+    if fmt == 'ndjson':
+        return json.dumps(values, default=str) + '\n'
+    # CSV: nested report content is written as a JSON string
+    if values['report'] is not None:
+        values['report'] = json.dumps(values['report'], default=str)
+    writer.writerow([values[col] for col in REPORT_EXPORT_COLUMNS])
+    return None
+
+def export_reports(company_id, fmt='ndjson', test_id=None, date_from=None, date_to=None):
+    """
+    Stream a company's test instances with their reports, in constant memory.
+
+    Filters are validated up front (ValueError), so callers can reject bad requests before
+    the response starts. Returns a generator of text chunks (one per fetched batch); rows are
+    read through a named (server-side) cursor with fetchmany, so only one batch is in memory.
+
+    Args:
+        company_id (int): The company to export
+        fmt (str): 'ndjson' (one JSON object per line) or 'csv'
+        test_id (int, optional): Only instances of this test
+        date_from (str, optional): ISO date/datetime; instances created at or after
+        date_to (str, optional): ISO date/datetime; instances created at or before
+
+    Returns:
+        generator: str chunks
+    """
+    if not company_id:
+        raise ValueError('Company ID is required for multi-tenant support')
+    if fmt not in REPORT_EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format '{fmt}' (use one of: {', '.join(REPORT_EXPORT_FORMATS)})")
+    start = _parse_export_datetime(date_from, 'from')
+    end = _parse_export_datetime(date_to, 'to', end_of_day=True)
+    if start and end and start > end:
+        raise ValueError("'from' must not be after 'to'")
+
+    conditions = ['ti.company_id = %s']
+    params = [company_id]
+    if test_id is not None:
+        conditions.append('ti.test_id = %s')
+        params.append(test_id)
+    if start:
+        conditions.append('ti.created_at >= %s')
+        params.append(start)
+    if end:
+        conditions.append('ti.created_at <= %s')
+        params.append(end)
+
+    query = f'''
+        SELECT ti.id AS instance_id, ti.test_id, t.name AS test_name,
+               ti.candidate_id, c.name AS candidate_name, c.email AS candidate_email,
+               COALESCE(tc.completed, FALSE) AS completed, tc.deadline,
+               ti.created_at AS instance_created_at,
+               r.created_at AS report_created_at, r.updated_at AS report_updated_at,
+               r.content AS report
+        FROM test_instances ti
+        JOIN tests t ON t.id = ti.test_id
+        JOIN candidates c ON c.id = ti.candidate_id
+        LEFT JOIN test_candidates tc ON tc.test_id = ti.test_id AND tc.candidate_id = ti.candidate_id
+        LEFT JOIN LATERAL (
+            SELECT created_at, updated_at, content
+            FROM reports
+            WHERE reports.instance_id = ti.id
+            ORDER BY updated_at DESC NULLS LAST, id DESC
+            LIMIT 1
+        ) r ON TRUE
+        WHERE {' AND '.join(conditions)}
+        ORDER BY ti.created_at, ti.id
+    '''
+
+    def generate():
+        conn = get_connection()
+        try:
+            conn.set_session(readonly=True)
+            # Named cursor: rows stay on the server until fetched
+            cursor = conn.cursor(name=f'reports_export_{uuid.uuid4().hex}')
+            cursor.itersize = REPORT_EXPORT_BATCH_SIZE
+            cursor.execute(query, params)
+
+            buffer = io.StringIO()
+            writer = csv.writer(buffer) if fmt == 'csv' else None
+            if writer:
+                writer.writerow(REPORT_EXPORT_COLUMNS)
+                yield buffer.getvalue()
+
+            while True:
+                rows = cursor.fetchmany(REPORT_EXPORT_BATCH_SIZE)
+                if not rows:
+                    break
+                if writer:
+                    buffer.seek(0)
+                    buffer.truncate(0)
+                    for row in rows:
+                        _format_export_row(row, fmt, writer)
+                    yield buffer.getvalue()
+                else:
+                    yield ''.join(_format_export_row(row, fmt) for row in rows)
+            cursor.close()
+        finally:
+            # Also runs when the client disconnects mid-stream (GeneratorExit)
+            conn.rollback()
+            conn.close()
+
+    return generate()
@@ -0,0 +1,248 @@
+"""
+Local cache of test template repositories for container bootstrap.
+
+Each test's template repository (tests.github_repo) is pinned to a commit in
+tests.template_commit. The 'templates.refresh' job moves the pin to the tip of the remote's
+default branch every TEMPLATE_REFRESH_INTERVAL_SECONDS (and right away when a test's repository
+changes), so every candidate of a test starts from the same files between refreshes.
+
+A server creating a container keeps a bare mirror of the template (see git_controller) and a
+tarball of each pinned commit under TEMPLATE_CACHE_DIR, and copies the tarball into the new
+container with put_archive: bootstrapping a candidate is a local copy instead of a clone from
+GitHub. The baseline "Upload project template" commit to the target repository is then made by
+the 'templates.commit_baseline' job through git_controller's batched commit queue, instead of by
+every container. When the cache cannot be used, the container clones the template itself as
+before (docker/startup.sh).
+"""
+import logging
+import os
+import tarfile
+import time
+import uuid
+from pathlib import Path
+
+from database.db_postgresql import get_connection
+from controllers.git_controller import (
+    MODE_EXECUTABLE, MODE_FILE, archive_commit, commit_submission, default_branch, ensure_mirror,
+    fetch_mirror, mirror_path, path_exists, remote_head, repo_lock, resolve_ref
+)
+from controllers.jobs_controller import register_job, register_recurring_job
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_CACHE_DIR = Path(os.getenv(
+    'TEMPLATE_CACHE_DIR',
+    str(Path(__file__).resolve().parent.parent / 'data' / 'template-cache')
+))
+
+TEMPLATE_REFRESH_INTERVAL_SECONDS = int(os.getenv('TEMPLATE_REFRESH_INTERVAL_SECONDS', '3600'))
+
+# Tarballs not used for this long are removed when a new one is built
+TEMPLATE_CACHE_MAX_AGE_SECONDS = int(os.getenv('TEMPLATE_CACHE_MAX_AGE_SECONDS', str(7 * 24 * 3600)))
+
+# Archive entries live under this directory, copied into the container's TEMPLATE_CONTAINER_PARENT
+TEMPLATE_ARCHIVE_PREFIX = 'ai-oa-template'
+TEMPLATE_CONTAINER_PARENT = '/tmp'
+TEMPLATE_CONTAINER_DIR = f'{TEMPLATE_CONTAINER_PARENT}/{TEMPLATE_ARCHIVE_PREFIX}'
+
+BASELINE_COMMIT_MESSAGE = 'Upload project template'
+
+MODE_SYMLINK = 0o120000
+
+def _queue_image_builds(tests, commit, cursor):
+    """Queue derived image builds for tests whose pin moved (no-op unless TEST_IMAGES_ENABLED)"""
+    if not commit:
+        return
+    # images_controller builds on this module, so it is imported when needed
+    from controllers.images_controller import enqueue_test_image_build
+    for test in tests:
+        enqueue_test_image_build(test['id'], commit, company_id=test['company_id'], cursor=cursor)
+
+def pin_template_commit(test_id):
+    """Pin a test's template to the current tip of its repository. Returns the commit (or None)."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('SELECT github_repo, github_token FROM tests WHERE id = %s', (test_id,))
+        test = cursor.fetchone()
+        if not test or not test['github_repo']:
+            return None
+        commit = remote_head(test['github_repo'], test['github_token'])
+        # Only write on change: every tests update bumps the test's ETag versions
+        cursor.execute(
+            '''UPDATE tests SET template_commit = %s
+               WHERE id = %s AND template_commit IS DISTINCT FROM %s
+               RETURNING id, company_id''',
+            (commit, test_id, commit)
+        )
+        _queue_image_builds(cursor.fetchall(), commit, cursor)
+        conn.commit()
+        return commit
+    finally:
+        conn.close()
+
+@register_job('templates.refresh', max_attempts=3)
+def refresh_templates(payload=None):
+    """
+    Job: re-pin template commits, for one test (payload test_id) or for all tests.
+
+    Tests sharing a repository and token cost one ls-remote per refresh.
+    """
+    test_id = (payload or {}).get('test_id')
+    if test_id:
+        return {'test_id': test_id, 'commit': pin_template_commit(test_id)}
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''
+            SELECT github_repo, github_token, array_agg(id) AS test_ids
+            FROM tests
+            WHERE github_repo IS NOT NULL AND github_repo <> ''
+            GROUP BY github_repo, github_token
+        ''')
+        groups = cursor.fetchall()
+    finally:
+        conn.close()
+
+    updated, failed = 0, 0
+    for group in groups:
+        try:
+            commit = remote_head(group['github_repo'], group['github_token'])
+        except Exception as e:
+            failed += 1
+            logger.warning(f"Could not resolve template {group['github_repo']}: {str(e)}")
+            continue
+        conn = get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                '''UPDATE tests SET template_commit = %s
+                   WHERE id = ANY(%s) AND template_commit IS DISTINCT FROM %s
+                   RETURNING id, company_id''',
+                (commit, group['test_ids'], commit)
+            )
+            changed = cursor.fetchall()
+            _queue_image_builds(changed, commit, cursor)
+            updated += len(changed)
+            conn.commit()
+        finally:
+            conn.close()
+    return {'repositories': len(groups), 'tests_updated': updated, 'failed': failed}
+
+register_recurring_job('templates.refresh', interval_seconds=TEMPLATE_REFRESH_INTERVAL_SECONDS)
+
+def _prune_cache():
+    cutoff = time.time() - TEMPLATE_CACHE_MAX_AGE_SECONDS
+    for path in TEMPLATE_CACHE_DIR.glob('*.tar'):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+        except OSError:
+            pass
+
+def template_archive(repo_url, token, commit):
+    """
+    Return the path of the cached tarball of a template commit, building it from the local mirror
+    (fetching first if the mirror does not have the commit yet).
+    """
+    archive_path = TEMPLATE_CACHE_DIR / f'{mirror_path(repo_url).stem}-{commit}.tar'
+    if archive_path.exists():
+        # Keep recently used tarballs out of _prune_cache
+        os.utime(archive_path)
+        return archive_path
+
+    git_dir = ensure_mirror(repo_url, token)
+    with repo_lock(git_dir):
+        if archive_path.exists():
+            return archive_path
+        if resolve_ref(git_dir, commit) is None:
+            fetch_mirror(git_dir, repo_url, token)
+            if resolve_ref(git_dir, commit) is None:
+                raise ValueError(f'Commit {commit} not found in {repo_url}')
+        TEMPLATE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_path = archive_path.with_name(f'{archive_path.name}.{uuid.uuid4().hex[:8]}')
+        try:
+            archive_commit(git_dir, commit, tmp_path, prefix=TEMPLATE_ARCHIVE_PREFIX)
+            os.replace(tmp_path, archive_path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+    logger.info(f"Cached template {repo_url} at {commit[:12]} in {archive_path}")
+    _prune_cache()
+    return archive_path
+
+def iter_template_entries(archive_path):
+    """Yield (relative_path, data_bytes, mode) for the files of a template tarball."""
+    prefix = f'{TEMPLATE_ARCHIVE_PREFIX}/'
+    with tarfile.open(archive_path) as archive:
+        for member in archive:
+            if not member.name.startswith(prefix):
+                continue
+            path = member.name[len(prefix):]
+            if member.issym():
+                yield path, member.linkname.encode('utf-8'), MODE_SYMLINK
+            elif member.isfile():
+                mode = MODE_EXECUTABLE if member.mode & 0o111 else MODE_FILE
+                yield path, archive.extractfile(member).read(), mode
+
+def seed_container_template(container, test):
+    """
+    Copy the pinned template of a test into a created (not yet started) container, at
+    TEMPLATE_CONTAINER_DIR. Returns the commit, or None if the container has to clone it itself.
+    """
+    if not test.get('github_repo'):
+        return None
+    try:
+        commit = test.get('template_commit') or pin_template_commit(test['id'])
+        if not commit:
+            return None
+        archive_path = template_archive(test['github_repo'], test.get('github_token'), commit)
+        with open(archive_path, 'rb') as archive:
+            if not container.put_archive(TEMPLATE_CONTAINER_PARENT, archive):
+                return None
+        return commit
+    except Exception as e:
+        logger.warning(f"Template cache unavailable for test {test['id']}, container will clone it: {str(e)}")
+        return None
+
+@register_job('templates.commit_baseline', max_attempts=5, retry_delay=30)
+def commit_template_baseline(payload):
+    """
+    Job: commit a test's template into an instance's submission directory of the target
+    repository (the baseline candidate submissions are diffed against). Skipped if the directory
+    already exists there (checked while the commit is made), so it never overwrites a submission.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            'SELECT github_repo, github_token, target_github_repo, target_github_token FROM tests WHERE id = %s',
+            (payload['test_id'],)
+        )
+        test = cursor.fetchone()
+    finally:
+        conn.close()
+    if not test or not test['github_repo'] or not test['target_github_repo']:
+        return {'skipped': True, 'reason': 'test has no template or target repository'}
+
+    submission_dir = payload['submission_dir']
+    target_dir = ensure_mirror(test['target_github_repo'], test['target_github_token'])
+    # Saves building the archive on retries; only_if_absent below is what guarantees it
+    with repo_lock(target_dir):
+        fetch_mirror(target_dir, test['target_github_repo'], test['target_github_token'])
+        if path_exists(target_dir, f'refs/heads/{default_branch(target_dir)}', submission_dir):
+            return {'skipped': True, 'reason': f'{submission_dir} already exists'}
+
+    archive_path = template_archive(test['github_repo'], test['github_token'], payload['commit'])
+    result = commit_submission(
+        test['target_github_repo'],
+        test['target_github_token'],
+        submission_dir,
+        iter_template_entries(archive_path),
+        BASELINE_COMMIT_MESSAGE,
+        only_if_absent=True
+    )
+    if result.get('skipped'):
+        return {'skipped': True, 'reason': f'{submission_dir} already exists'}
+    return {'changed': result['changed'], 'commit': result['commit']}
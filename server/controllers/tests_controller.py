@@ -1,64 +1,104 @@
 from database.db_postgresql import get_connection
+from controllers.jobs_controller import enqueue_job
+from controllers.capacity_controller import parse_resource_limits
+from database.pagination import contains, fetch_list, iso_datetime, list_response, parse_list_params
+from controllers.candidates_controller import CANDIDATE_FIELDS, CANDIDATE_FILTERS, CANDIDATE_SORTS
 from datetime import datetime, timezone
 import docker
 
-def get_all_tests(company_id=None):
-    """Get all tests from the database, filtered by company"""
+# Admin tests list: selectable fields, sorts and filters (see database/pagination.py)
+TEST_LIST_SPEC = {
+    'fields': {
+        'id': 't.id',
+        'name': 't.name',
+        'github_repo': 't.github_repo',
+        'candidates_assigned': 'COALESCE(s.assigned, 0)',
+        'candidates_completed': 'COALESCE(s.completed, 0)',
+        'candidates_invited': 'COALESCE(s.invited, 0)',
+        'candidates_started': 'COALESCE(s.started, 0)',
+        'candidates_reported': 'COALESCE(s.reported, 0)',
+        'average_score': 's.avg_score',
+        'enable_timer': 't.enable_timer',
+        'timer_duration': 't.timer_duration',
+        'initial_question_budget': 't.initial_question_budget',
+        'final_question_budget': 't.final_question_budget',
+        'project_helper_enabled': 't.project_helper_enabled',
+        'mem_limit_mb': 't.mem_limit_mb',
+        'nano_cpus': 't.nano_cpus',
+        'pids_limit': 't.pids_limit',
+        'created_at': 't.created_at',
+        'updated_at': 't.updated_at',
+        'target_github_repo': 't.target_github_repo',
+        'target_github_token': 't.target_github_token',
+        'total_candidates': 'COALESCE(s.assigned, 0)'
+    },
+    'default': [
+        'id', 'name', 'github_repo',
+        'candidates_assigned', 'candidates_completed', 'candidates_invited',
+        'candidates_started', 'candidates_reported', 'average_score',
+        'enable_timer', 'timer_duration',
+        'initial_question_budget', 'final_question_budget',
+        'project_helper_enabled',
+        'created_at', 'updated_at',
+        'target_github_repo', 'target_github_token',
+        'total_candidates'
+    ],
+    'sorts': {
+        'created_at': 't.created_at',
+        'name': "COALESCE(t.name, '')",
+        'id': 't.id'
+    },
+    'default_sort': '-created_at',
+    'filters': {
+        'q': ('t.name ILIKE %s', contains),
+        'created_after': ('t.created_at >= %s', iso_datetime),
+        'created_before': ('t.created_at < %s', iso_datetime)
+    },
+    'id': 't.id'
+}
+
+def get_all_tests(company_id=None, params=None):
+    """
+    Get all tests from the database, filtered by company
+
+    Args:
+        company_id (int, optional): Company to list tests for
+        params (dict, optional): List query parameters (fields, sort, q, created_after,
+            created_before, limit, cursor); see TEST_LIST_SPEC and database/pagination.py
+
+    Returns:
+        list, or {"items", "next_cursor"} when limit/cursor is given
+    """
+    list_params = parse_list_params(params or {}, TEST_LIST_SPEC)
     conn = get_connection()
     cursor = conn.cursor()
     
     try:
+        conditions, query_params = [], []
         if company_id:
-            cursor.execute(
-                '''
-                SELECT 
-                    t.id, t.name, t.github_repo, 
-                    t.candidates_assigned, t.candidates_completed,
-                    t.enable_timer, t.timer_duration,
-                    t.initial_question_budget, t.final_question_budget,
-                    t.project_helper_enabled,
-                    t.created_at, t.updated_at,
-                    t.target_github_repo, t.target_github_token,
-                    COUNT(DISTINCT tc.candidate_id) as total_candidates
-                FROM tests t
-                LEFT JOIN test_candidates tc ON t.id = tc.test_id
-                WHERE t.company_id = %s
-                GROUP BY t.id
-                ORDER BY t.created_at DESC
-                ''',
-                (company_id,)
-            )
-        else:
-            cursor.execute(
-                '''
-                SELECT 
-                    t.id, t.name, t.github_repo, 
-                    t.candidates_assigned, t.candidates_completed,
-                    t.enable_timer, t.timer_duration,
-                    t.initial_question_budget, t.final_question_budget,
-                    t.project_helper_enabled,
-                    t.created_at, t.updated_at,
-                    t.target_github_repo, t.target_github_token,
-                    COUNT(DISTINCT tc.candidate_id) as total_candidates
-                FROM tests t
-                LEFT JOIN test_candidates tc ON t.id = tc.test_id
-                GROUP BY t.id
-                ORDER BY t.created_at DESC
-                '''
-            )
+            conditions.append('t.company_id = %s')
+            query_params.append(company_id)
+        rows, next_cursor = fetch_list(
+            cursor, TEST_LIST_SPEC,
+            'tests t LEFT JOIN test_stats s ON s.test_id = t.id',
+            conditions, query_params, list_params
+        )
         
         tests = []
-        for row in cursor.fetchall():
-            test_dict = dict(row)
-
+        for test_dict in rows:
             # Convert created_at and updated_at to UTC ISO 8601
-            test_dict["created_at"] = _convert_to_utc(test_dict["created_at"])
-            test_dict["updated_at"] = _convert_to_utc(test_dict["updated_at"])
-            test_dict["project_helper_enabled"] = bool(test_dict.get("project_helper_enabled"))
+            if "created_at" in test_dict:
+                test_dict["created_at"] = _convert_to_utc(test_dict["created_at"])
+            if "updated_at" in test_dict:
+                test_dict["updated_at"] = _convert_to_utc(test_dict["updated_at"])
+            if "project_helper_enabled" in test_dict:
+                test_dict["project_helper_enabled"] = bool(test_dict.get("project_helper_enabled"))
+            if "average_score" in test_dict:
+                test_dict["average_score"] = _score_to_float(test_dict.get("average_score"))
 
             tests.append(test_dict)
         
-        return tests
+        return list_response(tests, next_cursor, list_params)
     finally:
         conn.close()
 
@@ -75,18 +115,23 @@ def get_test(test_id, company_id=None):
                     t.id, t.name, t.github_repo, t.github_token, 
                     t.initial_prompt, t.final_prompt, 
                     t.qualitative_assessment_prompt, t.quantitative_assessment_prompt,
-                    t.candidates_assigned, t.candidates_completed, 
+                    COALESCE(s.assigned, 0) AS candidates_assigned,
+                    COALESCE(s.completed, 0) AS candidates_completed,
+                    COALESCE(s.invited, 0) AS candidates_invited,
+                    COALESCE(s.started, 0) AS candidates_started,
+                    COALESCE(s.reported, 0) AS candidates_reported,
+                    s.avg_score AS average_score,
                     t.enable_timer, t.timer_duration,
                     t.enable_project_timer, t.project_timer_duration,
                     t.initial_question_budget, t.final_question_budget,
                     t.project_helper_enabled,
+                    t.mem_limit_mb, t.nano_cpus, t.pids_limit,
                     t.created_at, t.updated_at,
                     t.target_github_repo, t.target_github_token,
-                    COUNT(DISTINCT tc.candidate_id) as total_candidates
+                    COALESCE(s.assigned, 0) AS total_candidates
                 FROM tests t
-                LEFT JOIN test_candidates tc ON t.id = tc.test_id
+                LEFT JOIN test_stats s ON s.test_id = t.id
                 WHERE t.id = %s AND t.company_id = %s
-                GROUP BY t.id
                 ''',
                 (test_id, company_id)
             )
@@ -97,18 +142,23 @@ def get_test(test_id, company_id=None):
                     t.id, t.name, t.github_repo, t.github_token, 
                     t.initial_prompt, t.final_prompt, 
                     t.qualitative_assessment_prompt, t.quantitative_assessment_prompt,
-                    t.candidates_assigned, t.candidates_completed, 
+                    COALESCE(s.assigned, 0) AS candidates_assigned,
+                    COALESCE(s.completed, 0) AS candidates_completed,
+                    COALESCE(s.invited, 0) AS candidates_invited,
+                    COALESCE(s.started, 0) AS candidates_started,
+                    COALESCE(s.reported, 0) AS candidates_reported,
+                    s.avg_score AS average_score,
                     t.enable_timer, t.timer_duration,
                     t.enable_project_timer, t.project_timer_duration,
                     t.initial_question_budget, t.final_question_budget,
                     t.project_helper_enabled,
+                    t.mem_limit_mb, t.nano_cpus, t.pids_limit,
                     t.created_at, t.updated_at,
                     t.target_github_repo, t.target_github_token,
-                    COUNT(DISTINCT tc.candidate_id) as total_candidates
+                    COALESCE(s.assigned, 0) AS total_candidates
                 FROM tests t
-                LEFT JOIN test_candidates tc ON t.id = tc.test_id
+                LEFT JOIN test_stats s ON s.test_id = t.id
                 WHERE t.id = %s
-                GROUP BY t.id
                 ''',
                 (test_id,)
             )
@@ -125,6 +175,7 @@ def get_test(test_id, company_id=None):
         test_dict["created_at"] = _convert_to_utc(test_dict["created_at"])
         test_dict["updated_at"] = _convert_to_utc(test_dict["updated_at"])
         test_dict["project_helper_enabled"] = bool(test_dict.get("project_helper_enabled"))
+        test_dict["average_score"] = _score_to_float(test_dict.get("average_score"))
         
         # Get candidates assigned to this test (also filter by company if provided)
         completion_expr = """
@@ -232,6 +283,7 @@ def create_test(data):
     project_helper_enabled = parse_bool(
         data.get('enableProjectHelper', data.get('projectHelperEnabled')), False
     )
+    resource_limits = parse_resource_limits(data)
     
     if not name:
         raise ValueError('Test name is required')
@@ -254,8 +306,9 @@ def create_test(data):
                 enable_timer, timer_duration,
                 enable_project_timer, project_timer_duration,
                 initial_question_budget, final_question_budget, project_helper_enabled,
-                target_github_repo, target_github_token, company_id
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING *
+                target_github_repo, target_github_token, company_id,
+                mem_limit_mb, nano_cpus, pids_limit
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING *
             ''',
             (
                 name,
@@ -276,13 +329,25 @@ def create_test(data):
                 project_helper_enabled,
                 data.get('targetGithubRepo', None),
                 data.get('targetGithubToken', None),
-                company_id
+                company_id,
+                resource_limits.get('mem_limit_mb'),
+                resource_limits.get('nano_cpus'),
+                resource_limits.get('pids_limit')
             )
         )
         
         # Get the inserted test directly from the INSERT statement
         new_test = dict(cursor.fetchone())
         new_test['project_helper_enabled'] = bool(new_test.get('project_helper_enabled'))
+        if new_test.get('github_repo'):
+            # Pin the template commit before the first container needs it
+            enqueue_job(
+                'templates.refresh',
+                {'test_id': new_test['id']},
+                unique_key=f"templates.refresh:{new_test['id']}",
+                company_id=company_id,
+                cursor=cursor
+            )
         conn.commit()
         
         # Get the inserted test ID
@@ -330,12 +395,8 @@ def create_test(data):
                     print(f"Error assigning candidate {candidate_id}: {str(e)}")
                     # Continue with other candidates even if one fails
             
-            # Update candidates_assigned count if any were assigned
+            # Commit the assignments (candidates_assigned is kept in sync by the test_stats triggers)
             if assigned_count > 0:
-                cursor.execute(
-                    'UPDATE tests SET candidates_assigned = %s WHERE id = %s',
-                    (assigned_count, test_id)
-                )
                 conn.commit()
         
         return new_test
@@ -387,8 +448,6 @@ def update_test(test_id, data, company_id=None):
             'quantitativeAssessmentPrompt': 'quantitative_assessment_prompt',
             'initialQuestionBudget': 'initial_question_budget',
             'finalQuestionBudget': 'final_question_budget',
-            'candidatesAssigned': 'candidates_assigned',
-            'candidatesCompleted': 'candidates_completed',
             'projectHelperEnabled': 'project_helper_enabled',
             'enableProjectHelper': 'project_helper_enabled'
         }
@@ -400,16 +459,34 @@ def update_test(test_id, data, company_id=None):
                     value = parse_bool(value)
                 update_fields.append(f'{db_field} = %s')
                 update_values.append(value)
+
+        # Resource limits apply to containers created from now on
+        for db_field, value in parse_resource_limits(data).items():
+            update_fields.append(f'{db_field} = %s')
+            update_values.append(value)
         
         if not update_fields:
             # Nothing to update
             return get_test(test_id, company_id)
         
+        # A new template repository invalidates the pinned commit; re-pin it in the background
+        template_changed = 'githubRepo' in data or 'githubToken' in data
+        if template_changed:
+            update_fields.append('template_commit = NULL')
+
         # Update the test
         query = f"UPDATE tests SET {', '.join(update_fields)}, updated_at = CURRENT_TIMESTAMP WHERE id = %s"
         update_values.append(test_id)
         
         cursor.execute(query, update_values)
+        if template_changed:
+            enqueue_job(
+                'templates.refresh',
+                {'test_id': test_id},
+                unique_key=f'templates.refresh:{test_id}',
+                company_id=company_id,
+                cursor=cursor
+            )
         conn.commit()
         
         # Return updated test
@@ -443,23 +520,18 @@ def delete_test(test_id, company_id=None):
             raise ValueError(f"Test with ID {test_id} not found in your organization")
         
         # Get all associated instances
-        cursor.execute('SELECT id, docker_instance_id FROM test_instances WHERE test_id = %s', (test_id,))
+        cursor.execute('SELECT id, docker_instance_id, docker_host FROM test_instances WHERE test_id = %s', (test_id,))
         instances = cursor.fetchall()
         instance_ids = [instance['id'] for instance in instances if instance.get('id')]
         
-        # Connect to Docker if needed
-        docker_client = None
-        if instances:
-            try:
-                from controllers.instances_controller import get_docker_client
-                docker_client = get_docker_client()
-                print(f"Connected to Docker to clean up {len(instances)} instances")
-            except Exception as e:
-                print(f"Warning: Unable to connect to Docker for instance cleanup: {str(e)}")
+        # Connect to the Docker hosts of the instances (unreachable ones are logged and skipped)
+        from controllers.docker_hosts_controller import connect_hosts, host_name
+        docker_clients = connect_hosts(instance['docker_host'] for instance in instances)
         
         # Stop and remove Docker containers for each instance
         for instance in instances:
             docker_id = instance['docker_instance_id']
+            docker_client = docker_clients.get(host_name(instance['docker_host']))
             if docker_client and docker_id and docker_id != 'pending':
                 try:
                     # Get the container and stop it
@@ -506,8 +578,86 @@ def delete_test(test_id, company_id=None):
     finally:
         conn.close()
 
-def get_test_candidates(test_id, company_id=None):
-    """Get all candidates assigned to a test and available candidates, ensuring test belongs to user's company"""
+# Per-test candidate lists (see get_test_candidates); completion matches test_stats
+TEST_CANDIDATE_COMPLETION_EXPR = """
+    (
+        COALESCE(tc.completed, FALSE)
+        OR EXISTS (
+            SELECT 1
+            FROM chat_history ch
+            JOIN test_instances ti2 ON ch.instance_id = ti2.id
+            WHERE ti2.test_id = tc.test_id
+              AND ti2.candidate_id = tc.candidate_id
+              AND ch.message ILIKE 'PHASE_MARKER: final_completed%%'
+        )
+        OR EXISTS (
+            SELECT 1
+            FROM reports r
+            JOIN test_instances ti3 ON r.instance_id = ti3.id
+            WHERE ti3.test_id = tc.test_id
+              AND ti3.candidate_id = tc.candidate_id
+        )
+    )
+"""
+
+TEST_CANDIDATE_INVITED_EXPR = """
+    EXISTS (
+        SELECT 1
+        FROM test_instances ti
+        WHERE ti.test_id = tc.test_id
+          AND ti.candidate_id = tc.candidate_id
+    )
+"""
+
+ASSIGNED_CANDIDATE_LIST_SPEC = {
+    'fields': {
+        **CANDIDATE_FIELDS,
+        'test_completed': TEST_CANDIDATE_COMPLETION_EXPR,
+        'invited': TEST_CANDIDATE_INVITED_EXPR,
+        'deadline': 'tc.deadline'
+    },
+    'default_select': f'c.*, {TEST_CANDIDATE_COMPLETION_EXPR} AS test_completed, '
+                      f'{TEST_CANDIDATE_INVITED_EXPR} AS invited, tc.deadline',
+    'sorts': CANDIDATE_SORTS,
+    'default_sort': 'id',
+    'filters': CANDIDATE_FILTERS,
+    'id': 'c.id'
+}
+
+AVAILABLE_CANDIDATE_LIST_SPEC = {
+    'fields': CANDIDATE_FIELDS,
+    'default_select': 'c.*',
+    'sorts': CANDIDATE_SORTS,
+    'default_sort': 'id',
+    'filters': CANDIDATE_FILTERS,
+    'id': 'c.id'
+}
+
+def get_test_candidates(test_id, company_id=None, params=None):
+    """
+    Get all candidates assigned to a test and available candidates, ensuring test belongs to user's company
+
+    Args:
+        test_id (int): The test ID
+        company_id (int, optional): The user's company
+        params (dict, optional): List query parameters applied to both lists (fields, sort, q,
+            email, created_after, created_before). status=assigned|available returns just that
+            list, which can then be paginated with limit/cursor.
+
+    Returns:
+        {"assigned": [...], "available": [...]}, or one list (or {"items", "next_cursor"}) with status
+    """
+    params = params or {}
+    status = params.get('status')
+    if status not in (None, 'assigned', 'available'):
+        raise ValueError("'status' must be 'assigned' or 'available'")
+    if status is None and (params.get('limit') is not None or params.get('cursor') is not None):
+        raise ValueError("Pagination requires status=assigned or status=available")
+    # Without status, fields= may name assignment-only fields that the available list lacks
+    assigned_params = parse_list_params(params, ASSIGNED_CANDIDATE_LIST_SPEC)
+    available_params = parse_list_params(params, AVAILABLE_CANDIDATE_LIST_SPEC,
+                                         ignore_unknown_fields=status is None)
+
     conn = get_connection()
     cursor = conn.cursor()
     
@@ -523,95 +673,50 @@ def get_test_candidates(test_id, company_id=None):
         if not existing:
             raise ValueError(f"Test with ID {test_id} not found in your organization")
         
-        completion_expr = """
-            (
-                COALESCE(tc.completed, FALSE)
-                OR EXISTS (
-                    SELECT 1
-                    FROM chat_history ch
-                    JOIN test_instances ti2 ON ch.instance_id = ti2.id
-                    WHERE ti2.test_id = tc.test_id
-                      AND ti2.candidate_id = tc.candidate_id
-                      AND ch.message ILIKE 'PHASE_MARKER: final_completed%%'
-                )
-                OR EXISTS (
-                    SELECT 1
-                    FROM reports r
-                    JOIN test_instances ti3 ON r.instance_id = ti3.id
-                    WHERE ti3.test_id = tc.test_id
-                      AND ti3.candidate_id = tc.candidate_id
-                )
-            ) AS test_completed
-        """
-
-        invited_expr = """
-            EXISTS (
-                SELECT 1
-                FROM test_instances ti
-                WHERE ti.test_id = tc.test_id
-                  AND ti.candidate_id = tc.candidate_id
-            ) AS invited
-        """
-        
-        # Get candidates assigned to test (only from the same company)
-        if company_id:
-            cursor.execute(f'''
-                SELECT c.*, {completion_expr}, {invited_expr}, tc.deadline
-                FROM candidates c
-                JOIN test_candidates tc ON c.id = tc.candidate_id
-                WHERE tc.test_id = %s AND c.company_id = %s
-            ''', (test_id, company_id))
-        else:
-            cursor.execute(f'''
-                SELECT c.*, {completion_expr}, {invited_expr}, tc.deadline
-                FROM candidates c
-                JOIN test_candidates tc ON c.id = tc.candidate_id
-                WHERE tc.test_id = %s
-            ''', (test_id,))
-        
-        assigned_candidates = []
-        for row in cursor.fetchall():
-            candidate = dict(row)
-            if 'invited' in candidate:
-                candidate['invited'] = bool(candidate.get('invited'))
-            # Convert deadline to ISO format if it exists
-            if candidate.get('deadline'):
-                normalized_deadline = _deadline_to_iso(candidate['deadline'])
-                if normalized_deadline:
-                    candidate['deadline'] = normalized_deadline
-                else:
-                    print(f"Warning: Could not parse deadline for candidate {candidate['id']}: {candidate['deadline']}")
-                    candidate['deadline'] = None
-            assigned_candidates.append(candidate)
+        result = {}
+        if status in (None, 'assigned'):
+            # Get candidates assigned to test (only from the same company)
+            conditions, query_params = ['tc.test_id = %s'], [test_id]
+            if company_id:
+                conditions.append('c.company_id = %s')
+                query_params.append(company_id)
+            rows, next_cursor = fetch_list(
+                cursor, ASSIGNED_CANDIDATE_LIST_SPEC,
+                'candidates c JOIN test_candidates tc ON c.id = tc.candidate_id',
+                conditions, query_params, assigned_params
+            )
+            
+            assigned_candidates = []
+            for candidate in rows:
+                if 'invited' in candidate:
+                    candidate['invited'] = bool(candidate.get('invited'))
+                # Convert deadline to ISO format if it exists
+                if candidate.get('deadline'):
+                    normalized_deadline = _deadline_to_iso(candidate['deadline'])
+                    if normalized_deadline:
+                        candidate['deadline'] = normalized_deadline
+                    else:
+                        print(f"Warning: Could not parse deadline for candidate {candidate['id']}: {candidate['deadline']}")
+                        candidate['deadline'] = None
+                assigned_candidates.append(candidate)
+            if status:
+                return list_response(assigned_candidates, next_cursor, assigned_params)
+            result['assigned'] = assigned_candidates
         
         # Get all candidates not assigned to this test (only from the same company)
+        conditions = ['NOT EXISTS (SELECT 1 FROM test_candidates tc WHERE tc.candidate_id = c.id AND tc.test_id = %s)']
+        query_params = [test_id]
         if company_id:
-            cursor.execute('''
-                SELECT c.*
-                FROM candidates c
-                WHERE c.company_id = %s AND c.id NOT IN (
-                    SELECT tc.candidate_id 
-                    FROM test_candidates tc 
-                    WHERE tc.test_id = %s
-                )
-            ''', (company_id, test_id))
-        else:
-            cursor.execute('''
-                SELECT c.*
-                FROM candidates c
-                WHERE c.id NOT IN (
-                    SELECT tc.candidate_id 
-                    FROM test_candidates tc 
-                    WHERE tc.test_id = %s
-                )
-            ''', (test_id,))
-        
-        available_candidates = [dict(row) for row in cursor.fetchall()]
+            conditions.append('c.company_id = %s')
+            query_params.append(company_id)
+        available_candidates, next_cursor = fetch_list(
+            cursor, AVAILABLE_CANDIDATE_LIST_SPEC, 'candidates c', conditions, query_params, available_params
+        )
+        if status:
+            return list_response(available_candidates, next_cursor, available_params)
+        result['available'] = available_candidates
         
-        return {
-            "assigned": assigned_candidates,
-            "available": available_candidates
-        }
+        return result
     finally:
         conn.close()
 
@@ -666,12 +771,7 @@ def assign_candidate_to_test(test_id, candidate_id, deadline=None, company_id=No
             (test_id, candidate_id, False, deadline)
         )
         
-        # Update test's candidates_assigned count
-        cursor.execute(
-            'UPDATE tests SET candidates_assigned = candidates_assigned + 1 WHERE id = %s',
-            (test_id,)
-        )
-        
+        # The test's candidates_assigned count is refreshed by the test_stats triggers
         conn.commit()
         
         return {"success": True, "message": f"Candidate {candidate_id} assigned to test {test_id}"}
@@ -750,53 +850,14 @@ def update_candidate_deadline(test_id, candidate_id, deadline, company_id=None):
                 updated_candidate['deadline'] = None
         # If deadline is None, leave it as None
         
-        # Automatically resend email with updated deadline information
-        try:
-            # Get test and candidate details for email
-            cursor.execute('SELECT * FROM tests WHERE id = %s', (test_id,))
-            test = dict(cursor.fetchone())
-            
-            cursor.execute('SELECT * FROM candidates WHERE id = %s', (candidate_id,))
-            candidate = dict(cursor.fetchone())
-            
-            # Get the existing access token for this candidate's test instance
-            cursor.execute('''
-                SELECT at.token
-                FROM access_tokens at
-                JOIN test_instances ti ON at.instance_id = ti.id
-                WHERE ti.test_id = %s AND ti.candidate_id = %s
-                ORDER BY at.created_at DESC
-                LIMIT 1
-            ''', (test_id, candidate_id))
-            
-            token_result = cursor.fetchone()
-            if token_result:
-                # Generate the access URL using the existing token
-                access_url = f"http://localhost:3000/instances/access/{token_result['token']}"
-                
-                # Import here to avoid circular imports
-                from controllers.email_controller import send_email
-                
-                # Send email with updated deadline information
-                email_sent = send_email(
-                    to_email=candidate['email'],
-                    candidate_name=candidate['name'],
-                    test_name=test['name'],
-                    access_url=access_url,
-                    deadline=updated_candidate['deadline'],  # Use the formatted deadline
-                    is_deadline_update=True
-                )
-                
-                if email_sent:
-                    print(f"Successfully sent deadline update email to {candidate['name']} ({candidate['email']})")
-                else:
-                    print(f"Failed to send deadline update email to {candidate['name']} ({candidate['email']})")
-            else:
-                print(f"Warning: No access token found for candidate {candidate_id} in test {test_id}")
-                
-        except Exception as email_error:
-            print(f"Error sending deadline update email: {str(email_error)}")
-            # Don't fail the deadline update if email fails
+        # Resend the invitation email with the new deadline in the background
+        enqueue_job(
+            'email.deadline_update',
+            {'test_id': test_id, 'candidate_id': candidate_id, 'deadline': updated_candidate['deadline']},
+            company_id=company_id,
+            cursor=cursor
+        )
+        conn.commit()
         
         return updated_candidate
     except Exception as e:
@@ -849,12 +910,7 @@ def remove_candidate_from_test(test_id, candidate_id, company_id=None):
             (test_id, candidate_id)
         )
         
-        # Update test's candidates_assigned count
-        cursor.execute(
-            'UPDATE tests SET candidates_assigned = candidates_assigned - 1 WHERE id = %s',
-            (test_id,)
-        )
-        
+        # The test's candidates_assigned count is refreshed by the test_stats triggers
         conn.commit()
         
         return {"success": True, "message": f"Candidate {candidate_id} removed from test {test_id}"}
@@ -864,6 +920,10 @@ def remove_candidate_from_test(test_id, candidate_id, company_id=None):
     finally:
         conn.close()
 
+def _score_to_float(value):
+    """test_stats.avg_score is NUMERIC (Decimal); return a JSON number or None"""
+    return float(value) if value is not None else None
+
 def _convert_to_utc(raw_ts):
     """Convert SQLite string or PostgreSQL datetime to UTC ISO 8601"""
     if raw_ts is None:
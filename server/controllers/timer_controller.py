@@ -1,8 +1,18 @@
+import heapq
+import os
+import socket
+import threading
 import time
-import json
+import zlib
+from functools import wraps
 from pathlib import Path
 from datetime import datetime, timedelta
 from database.db_postgresql import get_connection
+from database.file_store import SharedJsonFile
+from controllers.chat_controller import get_latest_phase_marker
+from controllers.events_controller import ALL_INSTANCES, publish_event, subscription, wait_for_event
+from controllers.jobs_controller import PRIORITY_HIGH, enqueue_job
+from controllers.versions_controller import make_etag
 
 # Path to the timers data file
 TIMERS_DATA_FILE = Path(__file__).parent.parent / 'data' / 'timers.json'
@@ -10,50 +20,83 @@ TIMERS_DATA_FILE = Path(__file__).parent.parent / 'data' / 'timers.json'
 # Initialize timers dictionary
 timers = {}
 
+# Every read and write goes through the shared file, so timers stay consistent across
+# server worker processes (each process reloads only when another one changed the file)
+_timers_file = SharedJsonFile(TIMERS_DATA_FILE)
+
+def _refresh_timers():
+    """Reload timers if another process wrote the file since we last read it. Call under lock."""
+    if _timers_file.changed():
+        timer_data = _timers_file.read()
+        timers.clear()
+        timers.update(timer_data)
+
+def _with_timers_lock(func):
+    """Run a timer operation under the shared lock, on an up-to-date copy of the timers."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with _timers_file.locked():
+            _refresh_timers()
+            return func(*args, **kwargs)
+    return wrapper
+
+# Nesting depth of timer writes in this thread (writers call each other; only the outermost publishes)
+_write_state = threading.local()
+
+def _publishes_timer_event(func):
+    """Publish a 'timer' event with the new status once the write (and its lock) is done."""
+    @wraps(func)
+    def wrapper(instance_id, *args, **kwargs):
+        depth = getattr(_write_state, 'depth', 0)
+        _write_state.depth = depth + 1
+        try:
+            result = func(instance_id, *args, **kwargs)
+        finally:
+            _write_state.depth = depth
+        if depth == 0:
+            try:
+                publish_event(instance_id, 'timer', get_timer_status(instance_id))
+            except Exception as e:
+                # Subscribers still see the change on their next resync or reconnect
+                print(f"[timer] Error publishing timer event for instance {instance_id}: {str(e)}")
+        return result
+    return wrapper
+
+def _next_version(instance_id):
+    """Version for the next write of a timer (callers hold the timers lock)"""
+    return timers.get(instance_id, {}).get('version', 0) + 1
+
 def load_timers():
     """Load timers from persistent storage"""
     try:
-        # Create data directory if it doesn't exist
-        data_dir = TIMERS_DATA_FILE.parent
-        data_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Check if timers data file exists
-        if not TIMERS_DATA_FILE.exists():
-            print(f"Timers data file does not exist. Creating empty file at: {TIMERS_DATA_FILE}")
-            with open(TIMERS_DATA_FILE, 'w') as f:
-                json.dump({}, f)
-            return
-        
-        # Load timers
-        with open(TIMERS_DATA_FILE, 'r') as f:
-            timer_data = json.load(f)
-        
-        # Clear current timers
-        timers.clear()
-        
-        # Restore timers with string keys
-        for instance_id, timer_info in timer_data.items():
-            timers[instance_id] = timer_info
+        with _timers_file.locked():
+            # Check if timers data file exists
+            if not _timers_file.exists():
+                print(f"Timers data file does not exist. Creating empty file at: {TIMERS_DATA_FILE}")
+                timers.clear()
+                _timers_file.write({})
+                return
+            
+            # Clear current timers and restore them with string keys
+            timer_data = _timers_file.read()
+            timers.clear()
+            timers.update(timer_data)
         
         print(f"Loaded timers for {len(timers)} instances")
     except Exception as e:
         print(f"Error loading timers: {str(e)}")
 
 def save_timers():
-    """Save timers to persistent storage"""
+    """Save timers to persistent storage (atomically; callers hold the timers lock)"""
     try:
-        # Convert to JSON-compatible format
-        timer_data = {}
-        for instance_id, timer_info in timers.items():
-            timer_data[instance_id] = timer_info
-        
-        # Save to file
-        with open(TIMERS_DATA_FILE, 'w') as f:
-            json.dump(timer_data, f, indent=2)
+        with _timers_file.locked():
+            _timers_file.write(timers)
         print(f"Saved timers for {len(timers)} instances")
     except Exception as e:
         print(f"Error saving timers: {str(e)}")
 
+@_publishes_timer_event
+@_with_timers_lock
 def start_instance_timer(instance_id, duration=600, timer_type='initial'):
     """
     Start a timer for an instance
@@ -88,7 +131,8 @@ def start_instance_timer(instance_id, duration=600, timer_type='initial'):
         'currentTimeMs': current_time * 1000,  # For frontend
         'endTimeMs': end_time * 1000,  # For frontend
         'timeRemaining': duration,
-        'timeRemainingMs': duration * 1000  # For frontend
+        'timeRemainingMs': duration * 1000,  # For frontend
+        'version': _next_version(instance_id)  # Bumped on every write (timer ETags)
     }
     
     if timer_type == 'project':
@@ -116,6 +160,7 @@ def start_project_timer(instance_id, duration=3600):
     """
     return start_instance_timer(instance_id, duration, timer_type='project')
 
+@_with_timers_lock
 def get_timer_status(instance_id):
     """
     Get status of a timer
@@ -128,8 +173,6 @@ def get_timer_status(instance_id):
     """
     # Convert instance_id to string for dictionary lookup
     instance_id = str(instance_id)
-    print(f"[timer] get_timer_status requested for instance {instance_id}")
-    
     timer = timers.get(instance_id)
     if not timer:
         return None
@@ -172,7 +215,8 @@ def get_timer_status(instance_id):
         'timeRemainingMs': time_remaining_ms,  # For frontend
         'isExpired': is_expired,
         'interviewStarted': timer.get('interviewStarted', False),  # Return the interview started status
-        'timerType': timer.get('timerType', 'initial')  # Return the timer type
+        'timerType': timer.get('timerType', 'initial'),  # Return the timer type
+        'version': timer.get('version', 0)
     }
     
     # Add project-specific fields if this is a project timer
@@ -182,6 +226,8 @@ def get_timer_status(instance_id):
     
     return timer_status
 
+@_publishes_timer_event
+@_with_timers_lock
 def reset_timer(instance_id, duration=3600, timer_type=None):
     """
     Reset a timer for an instance
@@ -226,7 +272,8 @@ def reset_timer(instance_id, duration=3600, timer_type=None):
         'endTimeMs': end_time * 1000,  # For frontend
         'timeRemaining': duration,
         'timeRemainingMs': duration * 1000,  # For frontend
-        'interviewStarted': interview_started  # Preserve the interview started status
+        'interviewStarted': interview_started,  # Preserve the interview started status
+        'version': _next_version(instance_id)
     })
     
     # Add project-specific fields if this is a project timer
@@ -239,6 +286,8 @@ def reset_timer(instance_id, duration=3600, timer_type=None):
     
     return timers[instance_id]
 
+@_publishes_timer_event
+@_with_timers_lock
 def set_interview_started(instance_id, started=True):
     """
     Mark an interview as started for an instance
@@ -259,12 +308,15 @@ def set_interview_started(instance_id, started=True):
     
     # Update the timer
     timers[instance_id]['interviewStarted'] = started
+    timers[instance_id]['version'] = _next_version(instance_id)
     
     # Save to persistent storage
     save_timers()
     
     return get_timer_status(instance_id)
 
+@_publishes_timer_event
+@_with_timers_lock
 def set_final_interview_started(instance_id, started=True):
     """
     Mark the final interview as started for an instance
@@ -288,12 +340,15 @@ def set_final_interview_started(instance_id, started=True):
     # Ensure type remains 'project' when final starts
     if timers[instance_id].get('timerType') != 'project':
         timers[instance_id]['timerType'] = 'project'
+    timers[instance_id]['version'] = _next_version(instance_id)
     
     # Save to persistent storage
     save_timers()
     
     return get_timer_status(instance_id)
 
+@_publishes_timer_event
+@_with_timers_lock
 def delete_timer(instance_id):
     """Delete timer for an instance (cleanup on stop/create)."""
     try:
@@ -309,8 +364,23 @@ def delete_timer(instance_id):
         print(f"[timer] Error deleting timer for instance {instance_id}: {str(e)}")
         return False
 
-# Load timers on module initialization
-load_timers()
+def get_timer_state(instance_id):
+    """
+    Snapshot pushed by /timer/stream and /timer/poll: the timer status (None if there is no
+    timer), the latest phase marker, and a tag that changes with either. The tag ignores the
+    seconds ticking down (clients count down from endTimeMs) but changes when the timer expires.
+    """
+    timer = get_timer_status(instance_id)
+    phase = get_latest_phase_marker(instance_id)
+    if timer:
+        timer_key = [timer['version'], timer['startTime'], timer['active'], timer['isExpired']]
+    else:
+        timer_key = None
+    return {
+        'timer': timer,
+        'phase': phase,
+        'tag': make_etag('timer-state', str(instance_id), timer_key, phase)
+    }
 
 def pg_start_instance_timer(instance_id, duration_seconds):
     """[PostgreSQL variant] Start a timer for a test instance"""
@@ -378,4 +448,175 @@ def pg_stop_instance_timer(instance_id):
         conn.rollback()
         raise e
     finally:
-        conn.close() 
\ No newline at end of file
+        conn.close() 
+# --- Expiry scheduler -------------------------------------------------------------------------
+#
+# One process per host (timers live in a per-host file) holds the scheduler advisory lock and
+# keeps a min-heap of timer deadlines. At endTime it records the expiry in the timer, publishes
+# the expired state to /timer/stream and /timer/poll subscribers (clients run the phase
+# transition), and optionally queues a container stop after a grace period. Heap entries carry
+# the timer version and are checked when they come due, so resets and deletions need no removal.
+
+# pg_try_advisory_lock(class, host) key class; the second key is derived from the hostname
+TIMER_SCHEDULER_LOCK_CLASS = 4173022
+
+# Full rebuild of the heap from the timers file (catches writes whose event was missed)
+TIMER_SCHEDULER_RESYNC_SECONDS = int(os.getenv('TIMER_SCHEDULER_RESYNC_SECONDS', '60'))
+
+# Longest sleep between checks of the leader connection
+TIMER_SCHEDULER_MAX_SLEEP_SECONDS = 5
+
+# Non-leaders retry taking the lock this often
+TIMER_SCHEDULER_STANDBY_SECONDS = 15
+
+# Stop the candidate's container this long after the project timer expires (-1 disables)
+TIMER_EXPIRY_STOP_AFTER_SECONDS = int(os.getenv('TIMER_EXPIRY_STOP_AFTER_SECONDS', '-1'))
+
+# Deadlines missed by more than this (scheduler down, timers older than the scheduler) are
+# marked as handled without notifying anyone or stopping containers
+TIMER_EXPIRY_CATCHUP_SECONDS = 3600
+
+def _scheduler_host_key():
+    """Signed 32-bit key of this host for the two-key advisory lock"""
+    key = zlib.crc32(socket.gethostname().encode('utf-8'))
+    return key - 2 ** 32 if key >= 2 ** 31 else key
+
+def _deadlines(instance_id, timer):
+    """Heap entries (due, kind, instance_id, version) still pending for a timer"""
+    version = timer.get('version', 0)
+    if not timer.get('active'):
+        return []
+    if timer.get('expiryFiredVersion') != version:
+        return [(timer['endTime'], 'expire', instance_id, version)]
+    if (TIMER_EXPIRY_STOP_AFTER_SECONDS >= 0 and timer.get('timerType') == 'project'
+            and timer.get('stopQueuedVersion') != version):
+        return [(timer['endTime'] + TIMER_EXPIRY_STOP_AFTER_SECONDS, 'stop', instance_id, version)]
+    return []
+
+@_with_timers_lock
+def _pending_deadlines():
+    return [entry for instance_id, timer in timers.items() for entry in _deadlines(instance_id, timer)]
+
+@_with_timers_lock
+def _claim_due(entries):
+    """
+    Mark due entries as handled in the timers file (one write for the batch). Returns the entries
+    that were still current (same version, still active, not handled by a previous leader) and
+    the deadlines that follow from them.
+    """
+    now = time.time()
+    claimed, follow_ups = [], []
+    changed = False
+    for entry in entries:
+        due, kind, instance_id, version = entry
+        timer = timers.get(instance_id)
+        if not timer or now < due or entry not in _deadlines(instance_id, timer):
+            continue
+        if kind == 'expire':
+            timer['expiryFiredVersion'] = version
+            timer['expiredAt'] = int(now)
+        else:
+            timer['stopQueuedVersion'] = version
+        changed = True
+        if now - due > TIMER_EXPIRY_CATCHUP_SECONDS:
+            timer['stopQueuedVersion'] = version
+            continue
+        claimed.append(entry)
+        follow_ups.extend(_deadlines(instance_id, timer))
+    if changed:
+        save_timers()
+    return claimed, follow_ups
+
+def _handle_due(entries):
+    """Fire the due entries; returns the follow-up deadlines to schedule"""
+    claimed, follow_ups = _claim_due(entries)
+    for due, kind, instance_id, version in claimed:
+        try:
+            if kind == 'expire':
+                print(f"[timer] Timer for instance {instance_id} expired ({time.time() - due:.2f}s after its deadline)")
+                publish_event(instance_id, 'timer', get_timer_status(instance_id))
+            else:
+                enqueue_job(
+                    'instances.stop_expired',
+                    {'instance_id': int(instance_id), 'timer_version': version},
+                    priority=PRIORITY_HIGH,
+                    unique_key=f'instances.stop_expired:{instance_id}:{version}'
+                )
+                print(f"[timer] Queued container stop for expired instance {instance_id}")
+        except Exception as e:
+            print(f"[timer] Error handling {kind} deadline of instance {instance_id}: {str(e)}")
+    return follow_ups
+
+def _lead_scheduler(stop_event):
+    """Scheduler loop for the leader; yields after every wait so the caller can check its lock"""
+    heap = []
+    next_resync = 0
+    with subscription(ALL_INSTANCES) as events:
+        while not stop_event.is_set():
+            if time.monotonic() >= next_resync:
+                heap = _pending_deadlines()
+                heapq.heapify(heap)
+                next_resync = time.monotonic() + TIMER_SCHEDULER_RESYNC_SECONDS
+
+            due = []
+            now = time.time()
+            while heap and heap[0][0] <= now:
+                due.append(heapq.heappop(heap))
+            if due:
+                for entry in _handle_due(due):
+                    heapq.heappush(heap, entry)
+                continue
+
+            timeout = TIMER_SCHEDULER_MAX_SLEEP_SECONDS
+            if heap:
+                timeout = min(timeout, max(0, heap[0][0] - time.time()))
+            event = wait_for_event(events, timeout)
+            while event is not None:
+                if event['type'] == 'resync':
+                    next_resync = 0
+                elif event['type'] == 'timer' and event.get('data'):
+                    timer = event['data']
+                    for entry in _deadlines(event['instance_id'], timer):
+                        heapq.heappush(heap, entry)
+                event = wait_for_event(events, 0)
+            yield  # lets the caller check the leader connection
+
+def run_timer_scheduler(stop_event=None):
+    """Compete for the scheduler lock of this host and run the scheduler while holding it."""
+    stop_event = stop_event or threading.Event()
+    host_key = _scheduler_host_key()
+    while not stop_event.is_set():
+        conn = None
+        try:
+            conn = get_connection()
+            conn.autocommit = True
+            cursor = conn.cursor()
+            cursor.execute('SELECT pg_try_advisory_lock(%s, %s) AS locked', (TIMER_SCHEDULER_LOCK_CLASS, host_key))
+            if not cursor.fetchone()['locked']:
+                conn.close()
+                conn = None
+                stop_event.wait(TIMER_SCHEDULER_STANDBY_SECONDS)
+                continue
+
+            print(f"[timer] Expiry scheduler leading on {socket.gethostname()} (pid {os.getpid()})")
+            last_check = time.monotonic()
+            for _ in _lead_scheduler(stop_event):
+                # The lock dies with the connection: stop leading as soon as it is gone
+                if time.monotonic() - last_check >= TIMER_SCHEDULER_MAX_SLEEP_SECONDS:
+                    cursor.execute('SELECT 1')
+                    last_check = time.monotonic()
+        except Exception as e:
+            print(f"[timer] Expiry scheduler error: {str(e)}")
+            stop_event.wait(TIMER_SCHEDULER_STANDBY_SECONDS)
+        finally:
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+
+def start_timer_scheduler():
+    """Run the expiry scheduler in a daemon thread of the current process. Returns its stop event."""
+    stop_event = threading.Event()
+    threading.Thread(target=run_timer_scheduler, args=(stop_event,), name='timer-scheduler', daemon=True).start()
+    return stop_event
@@ -0,0 +1,64 @@
+"""
+Conditional GET support for polled endpoints.
+
+Writes bump per-resource counters in resource_versions (database triggers, see the
+create_resource_versions migration). A polled endpoint derives a strong ETag from the counters
+it depends on and answers 304 Not Modified when the client already has that version, so an
+unchanged poll costs one small indexed read instead of the full queries and serialization.
+"""
+import hashlib
+import json
+from flask import jsonify, make_response, request
+from database.db_postgresql import get_connection
+
+def get_resource_versions(keys):
+    """Return the current versions of (resource, scope_id) keys, in order (0 if never written)"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''
+            SELECT COALESCE(rv.version, 0) AS version
+            FROM unnest(%s::varchar[], %s::integer[]) WITH ORDINALITY AS k(resource, scope_id, ord)
+            LEFT JOIN resource_versions rv ON rv.resource = k.resource AND rv.scope_id = k.scope_id
+            ORDER BY k.ord
+        ''', ([resource for resource, _ in keys], [scope_id for _, scope_id in keys]))
+        return [row['version'] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+def make_etag(*parts):
+    """Opaque (unquoted) ETag value identifying a representation by its JSON-serializable parts"""
+    payload = json.dumps(parts, default=str, separators=(',', ':'), sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+def conditional_json(etag, build):
+    """
+    Return 304 if the request's If-None-Match matches etag, else jsonify(build()) tagged with it.
+
+    build may return a (body, status) tuple for error responses; those are passed through untagged.
+    Compute etag from versions read *before* build runs: a write racing the request can then only
+    leave the ETag older than the body (the next poll refetches), never newer.
+    """
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+    else:
+        result = build()
+        if isinstance(result, tuple):
+            return result
+        response = jsonify(result)
+    response.set_etag(etag)
+    # Clients may keep the body but must revalidate before reusing it
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def versioned_json(keys, build, *extra):
+    """
+    conditional_json with an ETag over the versions of keys, the request path and query string,
+    and any extra parts. Without a complete scope (e.g. no company) the response is built as usual.
+    """
+    if any(scope_id is None for _, scope_id in keys):
+        result = build()
+        return result if isinstance(result, tuple) else jsonify(result)
+    versions = get_resource_versions(keys)
+    etag = make_etag(request.path, sorted(request.args.items(multi=True)), keys, versions, *extra)
+    return conditional_json(etag, build)
@@ -1,6 +1,10 @@
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
 import os
+import threading
+import time
+from contextlib import contextmanager
 from dotenv import load_dotenv
 import logging
 
@@ -9,6 +13,61 @@ load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Called with (query, seconds) after every statement; set by observability.metrics.init_app
+_query_observer = None
+_query_attribution = threading.local()
+
+
+def set_query_observer(observer):
+    """Register the function that receives each statement's execution time (None: no timing)"""
+    global _query_observer
+    _query_observer = observer
+
+def query_attribution():
+    """Name given by attribute_queries() to this thread's queries, if any"""
+    return getattr(_query_attribution, 'name', None)
+
+@contextmanager
+def attribute_queries(name):
+    """Attribute the queries this thread runs outside a request to `name` (e.g. a job type)"""
+    previous = query_attribution()
+    _query_attribution.name = name
+    try:
+        yield
+    finally:
+        _query_attribution.name = previous
+
+
+class _TimedCursorMixin:
+    """Times every statement and reports it to the query observer, when one is registered"""
+
+    def execute(self, query, vars=None):
+        if _query_observer is None:
+            return super().execute(query, vars)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            _query_observer(query, time.perf_counter() - started)
+
+    def executemany(self, query, vars_list):
+        if _query_observer is None:
+            return super().executemany(query, vars_list)
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            _query_observer(query, time.perf_counter() - started)
+
+
+class TimedRealDictCursor(_TimedCursorMixin, psycopg2.extras.RealDictCursor):
+    """The default cursor of get_connection(): rows as dictionaries"""
+
+
+class TimedCursor(_TimedCursorMixin, psycopg2.extensions.cursor):
+    """Rows as tuples, for queries whose column names repeat"""
+
+
 def get_connection():
     """Get a connection to the PostgreSQL database"""
     try:
@@ -21,7 +80,7 @@ def get_connection():
         # Create connection
         conn = psycopg2.connect(
             database_url,
-            cursor_factory=psycopg2.extras.RealDictCursor  # Return rows as dictionaries
+            cursor_factory=TimedRealDictCursor  # Return rows as dictionaries (and time queries)
         )
         
         # Set autocommit for better compatibility
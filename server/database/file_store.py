@@ -0,0 +1,83 @@
+"""
+JSON files shared between server processes.
+
+Timers (and the legacy chat history) are kept in JSON files under server/data. Under a
+multi-process server (several gunicorn workers) each process holds its own in-memory copy,
+so every access goes through SharedJsonFile:
+
+- locked() serializes threads (re-entrant RLock) and processes (fcntl.flock on a side file)
+- changed()/read() reload the file only when its mtime/size/inode differ from the last read
+- write() replaces the file atomically, so readers never see a partially written file
+"""
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+
+class SharedJsonFile:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock_path = self.path.with_name(f'{self.path.name}.lock')
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._lock_file = None
+        self._stamp = None
+
+    @contextmanager
+    def locked(self):
+        """Hold the file exclusively across threads and processes. Re-entrant within a thread."""
+        with self._thread_lock:
+            if self._depth == 0:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._lock_file = open(self.lock_path, 'a')
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                    self._lock_file.close()
+                    self._lock_file = None
+
+    def _current_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def exists(self):
+        return self.path.exists()
+
+    def changed(self):
+        """True if the file was written (by any process) since this process last read or wrote it."""
+        return self._current_stamp() != self._stamp
+
+    def read(self):
+        """Read and return the file contents ({} if the file does not exist)."""
+        stamp = self._current_stamp()
+        if stamp is None:
+            self._stamp = None
+            return {}
+        with open(self.path, 'r') as f:
+            data = json.load(f)
+        self._stamp = stamp
+        return data
+
+    def write(self, data, indent=2):
+        """Atomically replace the file with data."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f'.{self.path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f, indent=indent)
+            os.replace(tmp_path, self.path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+        self._stamp = self._current_stamp()
@@ -0,0 +1,88 @@
+"""
+Instance aggregates: a test instance with its test, candidate, latest report and timer.
+
+load_instance_aggregate() reads the database rows in one joined query. Within a Flask request,
+aggregates are kept in an identity map on flask.g, so repeated lookups of the same instance
+(route, access checks, report rendering) query once; call forget_instance() after writing to
+the instance, its test, candidate or report. Outside a request every call queries.
+"""
+import copy
+
+from flask import g, has_app_context
+
+from database.db_postgresql import TimedCursor, get_connection
+
+# Marker columns split the joined row back into its tables (column names repeat across them)
+AGGREGATE_QUERY = '''
+    SELECT ti.*, NULL AS "__test__", t.*, NULL AS "__candidate__", c.*, NULL AS "__report__", r.*
+    FROM test_instances ti
+    LEFT JOIN tests t ON t.id = ti.test_id
+    LEFT JOIN candidates c ON c.id = ti.candidate_id
+    LEFT JOIN LATERAL (
+        SELECT * FROM reports WHERE instance_id = ti.id ORDER BY created_at DESC, id DESC LIMIT 1
+    ) r ON TRUE
+    WHERE ti.id = %s
+'''
+AGGREGATE_PARTS = ('instance', '__test__', '__candidate__', '__report__')
+
+
+def _split_row(description, row):
+    parts = {}
+    current = 'instance'
+    for column, value in zip(description, row):
+        if column.name in AGGREGATE_PARTS:
+            current = column.name.strip('_')
+            continue
+        parts.setdefault(current, {})[column.name] = value
+    # A LEFT JOIN without a match comes back as a row of NULLs
+    return {
+        name: (values if values.get('id') is not None else None)
+        for name, values in parts.items()
+    }
+
+def _identity_map():
+    if not has_app_context():
+        return None
+    if not hasattr(g, 'instance_aggregates'):
+        g.instance_aggregates = {}
+    return g.instance_aggregates
+
+def _query_aggregate(instance_id):
+    conn = get_connection()
+    # Plain tuples: a dict row would keep only the last of the repeated column names
+    cursor = conn.cursor(cursor_factory=TimedCursor)
+    try:
+        cursor.execute(AGGREGATE_QUERY, (instance_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        aggregate = _split_row(cursor.description, row)
+    finally:
+        conn.close()
+
+    # Timers live outside the database (see timer_controller)
+    from controllers.timer_controller import get_timer_status
+    aggregate['timer'] = get_timer_status(instance_id)
+    return aggregate
+
+def load_instance_aggregate(instance_id):
+    """
+    {'instance', 'test', 'candidate', 'report', 'timer'} for an instance (test, candidate,
+    report and timer may be None), or None if the instance does not exist. Callers get their
+    own copy and may modify it.
+    """
+    instance_id = int(instance_id)
+    identity_map = _identity_map()
+    if identity_map is not None and instance_id in identity_map:
+        aggregate = identity_map[instance_id]
+    else:
+        aggregate = _query_aggregate(instance_id)
+        if identity_map is not None:
+            identity_map[instance_id] = aggregate
+    return copy.deepcopy(aggregate)
+
+def forget_instance(instance_id):
+    """Drop an instance from the request's identity map after changing it"""
+    identity_map = _identity_map()
+    if identity_map is not None:
+        identity_map.pop(int(instance_id), None)
@@ -1,7 +1,20 @@
 """
 Database migrations for PostgreSQL - Supabase version
 This handles any schema changes that might be needed after initial setup.
+
+Each schema change is a versioned step registered with @migration. Applied steps are recorded
+in the schema_migrations table (with a checksum of the step's source), so run_migrations only
+executes steps that are new and is a single query when the schema is up to date. Steps run
+under a Postgres advisory lock, so concurrent deploys/workers never apply the same step twice.
+
+Steps run in a transaction together with their schema_migrations row, unless registered with
+transactional=False: those run in autocommit mode, which CREATE INDEX CONCURRENTLY requires
+(use create_index_concurrently so a half-built index from a failed attempt is rebuilt).
+
+Never edit a step that has been deployed; add a new version instead.
 """
+import hashlib
+import inspect
 import psycopg2
 import psycopg2.extras
 import os
@@ -13,6 +26,12 @@ load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# pg_advisory_lock key serializing migration runs across processes
+MIGRATIONS_LOCK_KEY = 4173021
+
+# Registered steps, in version order (see @migration)
+MIGRATIONS = []
+
 def get_connection():
     """Get a connection to the PostgreSQL database"""
     database_url = os.environ.get('DATABASE_URL')
@@ -26,43 +45,134 @@ def get_connection():
     conn.autocommit = False
     return conn
 
+def migration(version, name, transactional=True):
+    """Register a migration step fn(cursor) under a unique, increasing version number."""
+    def decorator(fn):
+        if any(m['version'] == version for m in MIGRATIONS):
+            raise ValueError(f"Duplicate migration version {version}")
+        MIGRATIONS.append({
+            'version': version,
+            'name': name,
+            'fn': fn,
+            'transactional': transactional,
+            'checksum': hashlib.sha256(inspect.getsource(fn).encode('utf-8')).hexdigest()
+        })
+        MIGRATIONS.sort(key=lambda m: m['version'])
+        return fn
+    return decorator
+
+def get_applied_migrations(cursor):
+    """Return {version: checksum} for applied steps ({} if schema_migrations does not exist yet)"""
+    cursor.execute("SELECT to_regclass('public.schema_migrations') AS table_name")
+    if cursor.fetchone()['table_name'] is None:
+        return {}
+    cursor.execute("SELECT version, checksum FROM schema_migrations")
+    return {row['version']: row['checksum'] for row in cursor.fetchall()}
+
+def check_migration_checksums(applied):
+    """Warn about applied steps whose source changed after they ran (they are not re-run)"""
+    for m in MIGRATIONS:
+        checksum = applied.get(m['version'])
+        if checksum and checksum != m['checksum']:
+            logger.warning(f"Migration {m['version']} ({m['name']}) was modified after it was applied; "
+                           f"add a new migration instead of editing an applied one")
+
+def create_schema_migrations_table(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        checksum VARCHAR(64) NOT NULL,
+        applied_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+def apply_migration(conn, m):
+    """Run one step and record it. Transactional steps commit atomically with their record."""
+    conn.autocommit = not m['transactional']
+    try:
+        cursor = conn.cursor()
+        m['fn'](cursor)
+        cursor.execute(
+            "INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s)",
+            (m['version'], m['name'], m['checksum'])
+        )
+        if m['transactional']:
+            conn.commit()
+    except Exception:
+        if m['transactional']:
+            conn.rollback()
+        raise
+    finally:
+        conn.autocommit = False
+
 def run_migrations():
-    """Run all PostgreSQL migrations in order"""
+    """Apply pending migrations in version order"""
     logger.info("Running PostgreSQL database migrations...")
-    
+
+    conn = get_connection()
     try:
-        conn = get_connection()
         cursor = conn.cursor()
-        
-        # Check if we need to add any missing columns that might not be in the base schema
-        # This is mostly a safety check since the schema should be complete
-        
-        # Check for missing columns and add them if needed
-        ensure_all_columns_exist(cursor, conn)
-        
-        # Set default values where needed
-        set_default_values(cursor, conn)
-        
-        # Add instance_access_tokens table
-        create_instance_access_tokens_table(cursor)
-        
-        # Add chat_history table
-        create_chat_history_table(cursor)
 
-        # Add access_tokens table (invite links)
-        create_access_tokens_table(cursor)
+        # Fast path: nothing pending, no lock taken
+        applied = get_applied_migrations(cursor)
+        conn.commit()
+        if all(m['version'] in applied for m in MIGRATIONS):
+            check_migration_checksums(applied)
+            logger.info(f"PostgreSQL schema is up to date ({len(applied)} migrations applied).")
+            return
 
-        # Add telemetry_events table
-        create_telemetry_events_table(cursor)
-        
-        conn.close()
-        logger.info("PostgreSQL migrations completed successfully.")
-        
+        # Session-level lock: held across the per-step transactions and autocommit steps
+        cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATIONS_LOCK_KEY,))
+        try:
+            create_schema_migrations_table(cursor)
+            conn.commit()
+
+            # Another process may have applied steps while we waited for the lock
+            applied = get_applied_migrations(cursor)
+            conn.commit()
+            check_migration_checksums(applied)
+
+            pending = [m for m in MIGRATIONS if m['version'] not in applied]
+            for m in pending:
+                logger.info(f"Applying migration {m['version']}: {m['name']}")
+                apply_migration(conn, m)
+            logger.info(f"PostgreSQL migrations completed successfully ({len(pending)} applied).")
+        finally:
+            try:
+                conn.rollback()
+                cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATIONS_LOCK_KEY,))
+                conn.commit()
+            except Exception as e:
+                # Closing the connection releases the lock anyway
+                logger.warning(f"Could not release migrations lock: {str(e)}")
     except Exception as e:
         logger.error(f"PostgreSQL migration failed: {str(e)}")
         raise
+    finally:
+        conn.close()
 
-def ensure_all_columns_exist(cursor, conn):
+def create_index_concurrently(cursor, index_name, definition, unique=False):
+    """
+    CREATE INDEX CONCURRENTLY for a transactional=False step; definition is everything after
+    the index name, e.g. "ON jobs(status, run_at)". A failed concurrent build leaves an INVALID
+    index behind, so drop that first rather than letting IF NOT EXISTS skip the rebuild.
+    """
+    cursor.execute("""
+        SELECT NOT i.indisvalid AS invalid
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relname = %s AND n.nspname = 'public'
+    """, (index_name,))
+    row = cursor.fetchone()
+    if row and row['invalid']:
+        logger.warning(f"Dropping invalid index {index_name} left by a failed build")
+        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}")
+    cursor.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX CONCURRENTLY IF NOT EXISTS {index_name} {definition}")
+
+@migration(1, 'ensure_all_columns_exist')
+def ensure_all_columns_exist(cursor):
     """Ensure all expected columns exist in tables"""
     
     # Check companies table
@@ -112,10 +222,9 @@ def ensure_all_columns_exist(cursor, conn):
     if 'project_helper_enabled' not in tests_columns:
         cursor.execute("ALTER TABLE tests ADD COLUMN project_helper_enabled BOOLEAN DEFAULT FALSE")
         logger.info("Added project_helper_enabled to tests table")
-    
-    conn.commit()
 
-def set_default_values(cursor, conn):
+@migration(2, 'set_default_values')
+def set_default_values(cursor):
     """Set default values for any NULL fields that should have defaults"""
     
     # Set default company_id for any records that don't have one
@@ -133,7 +242,6 @@ def set_default_values(cursor, conn):
     # Set approved = 1 for companies that don't have it set
     cursor.execute("UPDATE companies SET approved = 1 WHERE approved IS NULL")
     
-    conn.commit()
     logger.info("Default values set for all tables")
 
 def test_migration():
@@ -166,6 +274,7 @@ def test_migration():
         }
 
 # Add instance_access_tokens table
+@migration(3, 'create_instance_access_tokens_table')
 def create_instance_access_tokens_table(cursor):
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS instance_access_tokens (
@@ -182,6 +291,7 @@ def create_instance_access_tokens_table(cursor):
     logger.info("Added instance_access_tokens table")
 
 # Add chat_history table
+@migration(4, 'create_chat_history_table')
 def create_chat_history_table(cursor):
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS chat_history (
@@ -198,6 +308,7 @@ def create_chat_history_table(cursor):
     logger.info("Added chat_history table")
 
 # Add access_tokens table (invite tokens)
+@migration(5, 'create_access_tokens_table')
 def create_access_tokens_table(cursor):
     cursor.execute(
         """
@@ -216,6 +327,7 @@ def create_access_tokens_table(cursor):
     logger.info("Added access_tokens table")
 
 # Add telemetry_events table
+@migration(6, 'create_telemetry_events_table')
 def create_telemetry_events_table(cursor):
     cursor.execute(
         """
@@ -254,14 +366,443 @@ def create_reports_table(cursor):
         """
     )
     logger.info("Added telemetry_events table")
-# List of all migrations
-migrations = [
-    # ... existing migrations ...
-    create_instance_access_tokens_table,
-    create_chat_history_table,
-    create_access_tokens_table,
-    create_telemetry_events_table,
-]
+
+# Add jobs table (background job queue)
+@migration(7, 'create_jobs_table')
+def create_jobs_table(cursor):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id BIGSERIAL PRIMARY KEY,
+            job_type VARCHAR(100) NOT NULL,
+            payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+            status VARCHAR(20) NOT NULL DEFAULT 'queued',
+            priority INTEGER NOT NULL DEFAULT 100,
+            run_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 5,
+            unique_key VARCHAR(255),
+            company_id INTEGER REFERENCES companies(id) ON DELETE CASCADE,
+            result JSONB,
+            last_error TEXT,
+            locked_by VARCHAR(255),
+            locked_at TIMESTAMP WITH TIME ZONE,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP WITH TIME ZONE,
+            CONSTRAINT jobs_status_check CHECK (status IN ('queued', 'running', 'completed', 'failed'))
+        );
+        CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs(priority, run_at, id) WHERE status = 'queued';
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_unique_key_active ON jobs(unique_key)
+            WHERE unique_key IS NOT NULL AND status IN ('queued', 'running');
+        CREATE INDEX IF NOT EXISTS idx_jobs_company_created ON jobs(company_id, created_at DESC);
+        CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs(finished_at) WHERE status IN ('completed', 'failed');
+        """
+    )
+    logger.info("Added jobs table")
+
+# Index for the streaming report export (company + created_at range, ordered by created_at, id)
+@migration(8, 'idx_test_instances_company_created', transactional=False)
+def create_test_instances_company_created_index(cursor):
+    create_index_concurrently(cursor, 'idx_test_instances_company_created', 'ON test_instances(company_id, created_at, id)')
+
+# Indexes used by refresh_test_stats and the admin tests list
+@migration(9, 'test_stats_indexes', transactional=False)
+def create_test_stats_indexes(cursor):
+    create_index_concurrently(cursor, 'idx_test_candidates_test_candidate', 'ON test_candidates(test_id, candidate_id)')
+    create_index_concurrently(cursor, 'idx_test_instances_test_candidate', 'ON test_instances(test_id, candidate_id)')
+    create_index_concurrently(cursor, 'idx_chat_history_phase_markers', "ON chat_history(instance_id) WHERE message LIKE 'PHASE_MARKER:%'")
+    create_index_concurrently(cursor, 'idx_tests_company_created', 'ON tests(company_id, created_at DESC)')
+
+# Per-test dashboard statistics, maintained by triggers
+@migration(10, 'create_test_stats')
+def create_test_stats_table(cursor):
+    """
+    test_stats holds one row per test, recomputed by refresh_test_stats(test_id) whenever an
+    assignment, instance, report or phase marker of that test changes. Counts are per assignment
+    (test_candidates row), using the same rules as the candidate list in get_test:
+      invited   - has an instance
+      started   - has a PHASE_MARKER chat message
+      completed - test_candidates.completed, a 'final_completed' marker or a report
+      reported  - has a report
+    avg_score averages every numeric quantitative criterion score in the test's reports.
+    The legacy tests.candidates_assigned/candidates_completed columns are kept in sync.
+
+    The refresh locks the stats row before counting, so concurrent writers to the same test
+    serialize and the last one to commit counts everyone's rows: the counters cannot drift.
+    """
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS test_stats (
+        test_id INTEGER PRIMARY KEY REFERENCES tests(id) ON DELETE CASCADE,
+        assigned INTEGER NOT NULL DEFAULT 0,
+        invited INTEGER NOT NULL DEFAULT 0,
+        started INTEGER NOT NULL DEFAULT 0,
+        completed INTEGER NOT NULL DEFAULT 0,
+        reported INTEGER NOT NULL DEFAULT 0,
+        avg_score NUMERIC(10, 2),
+        updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE OR REPLACE FUNCTION refresh_test_stats(p_test_id INTEGER) RETURNS VOID AS $$
+    BEGIN
+        INSERT INTO test_stats (test_id)
+        SELECT id FROM tests WHERE id = p_test_id
+        ON CONFLICT (test_id) DO NOTHING;
+
+        -- Serialize refreshes of this test (see create_test_stats_table)
+        PERFORM 1 FROM test_stats WHERE test_id = p_test_id FOR UPDATE;
+        IF NOT FOUND THEN
+            RETURN;  -- test is being deleted
+        END IF;
+
+        WITH assignments AS (
+            SELECT
+                EXISTS (
+                    SELECT 1 FROM test_instances ti
+                    WHERE ti.test_id = tc.test_id AND ti.candidate_id = tc.candidate_id
+                ) AS invited,
+                EXISTS (
+                    SELECT 1 FROM test_instances ti
+                    JOIN chat_history ch ON ch.instance_id = ti.id
+                    WHERE ti.test_id = tc.test_id AND ti.candidate_id = tc.candidate_id
+                      AND ch.message LIKE 'PHASE_MARKER:%'
+                ) AS started,
+                (
+                    COALESCE(tc.completed, FALSE)
+                    OR EXISTS (
+                        SELECT 1 FROM test_instances ti
+                        JOIN chat_history ch ON ch.instance_id = ti.id
+                        WHERE ti.test_id = tc.test_id AND ti.candidate_id = tc.candidate_id
+                          AND ch.message LIKE 'PHASE_MARKER:%'
+                          AND ch.message ILIKE 'PHASE_MARKER: final_completed%'
+                    )
+                    OR EXISTS (
+                        SELECT 1 FROM test_instances ti
+                        JOIN reports r ON r.instance_id = ti.id
+                        WHERE ti.test_id = tc.test_id AND ti.candidate_id = tc.candidate_id
+                    )
+                ) AS completed,
+                EXISTS (
+                    SELECT 1 FROM test_instances ti
+                    JOIN reports r ON r.instance_id = ti.id
+                    WHERE ti.test_id = tc.test_id AND ti.candidate_id = tc.candidate_id
+                ) AS reported
+            FROM test_candidates tc
+            WHERE tc.test_id = p_test_id
+        ),
+        counts AS (
+            SELECT
+                COUNT(*) AS assigned,
+                COUNT(*) FILTER (WHERE invited) AS invited,
+                COUNT(*) FILTER (WHERE started) AS started,
+                COUNT(*) FILTER (WHERE completed) AS completed,
+                COUNT(*) FILTER (WHERE reported) AS reported
+            FROM assignments
+        ),
+        scores AS (
+            SELECT ROUND(AVG((q->>'score')::numeric), 2) AS avg_score
+            FROM test_instances ti
+            JOIN reports r ON r.instance_id = ti.id
+            CROSS JOIN LATERAL jsonb_array_elements(
+                CASE WHEN jsonb_typeof(r.content->'quantitative_criteria') = 'array'
+                     THEN r.content->'quantitative_criteria' ELSE '[]'::jsonb END
+            ) q
+            WHERE ti.test_id = p_test_id AND jsonb_typeof(q->'score') = 'number'
+        )
+        UPDATE test_stats s
+        SET assigned = counts.assigned,
+            invited = counts.invited,
+            started = counts.started,
+            completed = counts.completed,
+            reported = counts.reported,
+            avg_score = scores.avg_score,
+            updated_at = NOW()
+        FROM counts, scores
+        WHERE s.test_id = p_test_id;
+
+        UPDATE tests t
+        SET candidates_assigned = s.assigned, candidates_completed = s.completed
+        FROM test_stats s
+        WHERE s.test_id = p_test_id AND t.id = p_test_id
+          AND (t.candidates_assigned IS DISTINCT FROM s.assigned
+               OR t.candidates_completed IS DISTINCT FROM s.completed);
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION refresh_test_stats_many(p_test_ids INTEGER[]) RETURNS VOID AS $$
+    DECLARE
+        v_test_id INTEGER;
+    BEGIN
+        -- Sorted, so transactions touching several tests lock them in the same order
+        FOR v_test_id IN SELECT DISTINCT unnest(p_test_ids) AS id ORDER BY id LOOP
+            IF v_test_id IS NOT NULL THEN
+                PERFORM refresh_test_stats(v_test_id);
+            END IF;
+        END LOOP;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION test_stats_on_test_insert() RETURNS TRIGGER AS $$
+    BEGIN
+        INSERT INTO test_stats (test_id) VALUES (NEW.id) ON CONFLICT (test_id) DO NOTHING;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    -- Statement-level triggers read the affected rows from the changed_rows transition table
+    CREATE OR REPLACE FUNCTION test_stats_on_test_rows_change() RETURNS TRIGGER AS $$
+    BEGIN
+        PERFORM refresh_test_stats_many(ARRAY(SELECT test_id FROM changed_rows));
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION test_stats_on_instance_rows_change() RETURNS TRIGGER AS $$
+    BEGIN
+        PERFORM refresh_test_stats_many(ARRAY(
+            SELECT ti.test_id FROM changed_rows cr JOIN test_instances ti ON ti.id = cr.instance_id
+        ));
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION test_stats_on_phase_marker_insert() RETURNS TRIGGER AS $$
+    BEGIN
+        PERFORM refresh_test_stats(test_id) FROM test_instances WHERE id = NEW.instance_id;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION test_stats_on_phase_marker_delete() RETURNS TRIGGER AS $$
+    BEGIN
+        PERFORM refresh_test_stats_many(ARRAY(
+            SELECT ti.test_id FROM changed_rows cr JOIN test_instances ti ON ti.id = cr.instance_id
+            WHERE cr.message LIKE 'PHASE_MARKER:%'
+        ));
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS test_stats_test_insert ON tests;
+    CREATE TRIGGER test_stats_test_insert AFTER INSERT ON tests
+        FOR EACH ROW EXECUTE FUNCTION test_stats_on_test_insert();
+
+    DROP TRIGGER IF EXISTS test_stats_test_candidates_insert ON test_candidates;
+    CREATE TRIGGER test_stats_test_candidates_insert AFTER INSERT ON test_candidates
+        REFERENCING NEW TABLE AS changed_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION test_stats_on_test_rows_change();
+    DROP TRIGGER IF EXISTS test_stats_test_candidates_update ON test_candidates;
+    CREATE TRIGGER test_stats_test_candidates_update AFTER UPDATE ON test_candidates
+        REFERENCING NEW TABLE AS changed_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION test_stats_on_test_rows_change();
+    DROP TRIGGER IF EXISTS test_stats_test_candidates_delete ON test_candidates;
+    CREATE TRIGGER test_stats_test_candidates_delete AFTER DELETE ON test_candidates
+        REFERENCING OLD TABLE AS changed_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION test_stats_on_test_rows_change();
+
+    DROP TRIGGER IF EXISTS test_stats_test_instances_insert ON test_instances;
+    CREATE TRIGGER test_stats_test_instances_insert AFTER INSERT ON test_instances
+        REFERENCING NEW TABLE AS changed_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION test_stats_on_test_rows_change();
+    DROP TRIGGER IF EXISTS test_stats_test_instances_delete ON test_instances;
+    CREATE TRIGGER test_stats_test_instances_delete AFTER DELETE ON test_instances
+        REFERENCING OLD TABLE AS changed_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION test_stats_on_test_rows_change();
+
+    DROP TRIGGER IF EXISTS test_stats_reports_insert ON reports;
+    CREATE TRIGGER test_stats_reports_insert AFTER INSERT ON reports
+        REFERENCING NEW TABLE AS changed_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION test_stats_on_instance_rows_change();
+    DROP TRIGGER IF EXISTS test_stats_reports_update ON reports;
+    CREATE TRIGGER test_stats_reports_update AFTER UPDATE ON reports
+        REFERENCING NEW TABLE AS changed_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION test_stats_on_instance_rows_change();
+    DROP TRIGGER IF EXISTS test_stats_reports_delete ON reports;
+    CREATE TRIGGER test_stats_reports_delete AFTER DELETE ON reports
+        REFERENCING OLD TABLE AS changed_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION test_stats_on_instance_rows_change();
+
+    -- Chat messages are frequent; only phase markers affect the stats
+    DROP TRIGGER IF EXISTS test_stats_phase_marker_insert ON chat_history;
+    CREATE TRIGGER test_stats_phase_marker_insert AFTER INSERT ON chat_history
+        FOR EACH ROW WHEN (NEW.message LIKE 'PHASE_MARKER:%')
+        EXECUTE FUNCTION test_stats_on_phase_marker_insert();
+    DROP TRIGGER IF EXISTS test_stats_phase_marker_delete ON chat_history;
+    CREATE TRIGGER test_stats_phase_marker_delete AFTER DELETE ON chat_history
+        REFERENCING OLD TABLE AS changed_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION test_stats_on_phase_marker_delete();
+
+    -- Backfill (also corrects any drift in tests.candidates_assigned/completed)
+    SELECT refresh_test_stats_many(ARRAY(SELECT id FROM tests));
+    """)
+    logger.info("Added test_stats table and triggers")
+
+# Keyset pagination orders by (sort expression, id) and needs non-null sort values
+@migration(11, 'created_at_not_null')
+def set_created_at_not_null(cursor):
+    for table in ('tests', 'candidates', 'test_instances'):
+        cursor.execute(f"ALTER TABLE {table} ALTER COLUMN created_at SET DEFAULT CURRENT_TIMESTAMP")
+        cursor.execute(f"UPDATE {table} SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL")
+        cursor.execute(f"ALTER TABLE {table} ALTER COLUMN created_at SET NOT NULL")
+    logger.info("Made created_at NOT NULL on tests, candidates and test_instances")
+
+# Indexes matching the admin list sorts (see database/pagination.py)
+@migration(12, 'list_indexes', transactional=False)
+def create_list_indexes(cursor):
+    create_index_concurrently(cursor, 'idx_candidates_company_created', 'ON candidates(company_id, created_at, id)')
+    create_index_concurrently(cursor, 'idx_candidates_company_name', "ON candidates(company_id, (COALESCE(name, '')), id)")
+    create_index_concurrently(cursor, 'idx_candidates_company_email', "ON candidates(company_id, (COALESCE(email, '')), id)")
+    create_index_concurrently(cursor, 'idx_tests_company_created_id', 'ON tests(company_id, created_at, id)')
+    create_index_concurrently(cursor, 'idx_tests_company_name', "ON tests(company_id, (COALESCE(name, '')), id)")
+    create_index_concurrently(cursor, 'idx_test_instances_created', 'ON test_instances(created_at, id)')
+    create_index_concurrently(cursor, 'idx_test_candidates_candidate', 'ON test_candidates(candidate_id)')
+
+# Version counters behind the ETags of polled endpoints (see controllers/versions_controller.py)
+@migration(13, 'create_resource_versions')
+def create_resource_versions_table(cursor):
+    """
+    resource_versions holds one counter per (resource, scope_id), bumped by statement-level
+    triggers whenever rows behind that resource change:
+      chat        instance_id  chat_history
+      instance    instance id  test_instances
+      instances   0            test_instances, tests, candidates (the admin instance list)
+      test        test id      tests, test_stats (every assignment/instance/report/phase change
+                               of a test refreshes its stats row)
+      tests       company_id   tests, test_stats
+      candidates  company_id   candidates, test_candidates, tests (testsAssigned names)
+    A resource without a row has version 0.
+
+    bump_resource_versions takes (resource, scope expression over changed_rows) argument pairs
+    and bumps every affected counter with one upsert, in key order, so concurrent writers lock
+    the counter rows in the same order.
+    """
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS resource_versions (
+        resource VARCHAR(50) NOT NULL,
+        scope_id INTEGER NOT NULL,
+        version BIGINT NOT NULL DEFAULT 1,
+        updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (resource, scope_id)
+    );
+
+    CREATE OR REPLACE FUNCTION bump_resource_versions() RETURNS TRIGGER AS $$
+    DECLARE
+        keys_sql TEXT := '';
+    BEGIN
+        FOR i IN 0 .. TG_NARGS / 2 - 1 LOOP
+            IF i > 0 THEN
+                keys_sql := keys_sql || ' UNION ';
+            END IF;
+            keys_sql := keys_sql || format(
+                'SELECT %L::varchar AS resource, (%s)::integer AS scope_id FROM changed_rows',
+                TG_ARGV[2 * i], TG_ARGV[2 * i + 1]
+            );
+        END LOOP;
+        EXECUTE 'INSERT INTO resource_versions AS rv (resource, scope_id) '
+            || 'SELECT resource, scope_id FROM (' || keys_sql || ') keys '
+            || 'WHERE scope_id IS NOT NULL ORDER BY resource, scope_id '
+            || 'ON CONFLICT (resource, scope_id) DO UPDATE SET version = rv.version + 1, updated_at = NOW()';
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+
+    # Transition tables need one trigger per event
+    bumps = {
+        'chat_history': (('INSERT', 'DELETE'), "'chat', 'instance_id'"),
+        'test_instances': (('INSERT', 'UPDATE', 'DELETE'), "'instance', 'id', 'instances', '0'"),
+        'tests': (('INSERT', 'UPDATE', 'DELETE'),
+                  "'test', 'id', 'tests', 'company_id', 'candidates', 'company_id', 'instances', '0'"),
+        'test_stats': (('INSERT', 'UPDATE'),
+                       "'test', 'test_id', 'tests', "
+                       "'(SELECT company_id FROM tests WHERE tests.id = changed_rows.test_id)'"),
+        'candidates': (('INSERT', 'UPDATE', 'DELETE'), "'candidates', 'company_id', 'instances', '0'"),
+        'test_candidates': (('INSERT', 'UPDATE', 'DELETE'),
+                            "'candidates', "
+                            "'(SELECT company_id FROM candidates WHERE candidates.id = changed_rows.candidate_id)'"),
+    }
+    for table, (events, args) in bumps.items():
+        for event in events:
+            trigger = f"resource_versions_{table}_{event.lower()}"
+            transition = 'OLD' if event == 'DELETE' else 'NEW'
+            cursor.execute(f"""
+            DROP TRIGGER IF EXISTS {trigger} ON {table};
+            CREATE TRIGGER {trigger} AFTER {event} ON {table}
+                REFERENCING {transition} TABLE AS changed_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION bump_resource_versions({args});
+            """)
+    logger.info("Added resource_versions table and triggers")
+
+# Commit of the template repository new containers start from (see controllers/templates_controller.py)
+@migration(14, 'tests_template_commit')
+def add_tests_template_commit(cursor):
+    cursor.execute("ALTER TABLE tests ADD COLUMN IF NOT EXISTS template_commit VARCHAR(40)")
+    logger.info("Added template_commit to tests")
+
+# Per-test container limits and the provisioning queue (see controllers/capacity_controller.py)
+@migration(15, 'container_resources')
+def add_container_resources(cursor):
+    cursor.execute("""
+    ALTER TABLE tests ADD COLUMN IF NOT EXISTS mem_limit_mb INTEGER;
+    ALTER TABLE tests ADD COLUMN IF NOT EXISTS nano_cpus BIGINT;
+    ALTER TABLE tests ADD COLUMN IF NOT EXISTS pids_limit INTEGER;
+    ALTER TABLE test_instances ADD COLUMN IF NOT EXISTS provisioning_status VARCHAR(20);
+    CREATE INDEX IF NOT EXISTS idx_test_instances_provisioning_queued
+        ON test_instances(id) WHERE provisioning_status = 'queued';
+    """)
+    logger.info("Added container resource limits to tests and provisioning_status to test_instances")
+
+# Docker host each instance's container runs on (see controllers/docker_hosts_controller.py)
+@migration(16, 'test_instances_docker_host')
+def add_test_instances_docker_host(cursor):
+    cursor.execute("ALTER TABLE test_instances ADD COLUMN IF NOT EXISTS docker_host VARCHAR(100)")
+    logger.info("Added docker_host to test_instances")
+
+# Hibernation of idle instance containers (see controllers/idle_controller.py)
+@migration(17, 'instance_hibernation')
+def add_instance_hibernation(cursor):
+    cursor.execute("""
+    ALTER TABLE test_instances ADD COLUMN IF NOT EXISTS hibernated_at TIMESTAMP WITH TIME ZONE;
+    ALTER TABLE test_instances ADD COLUMN IF NOT EXISTS hibernation_mode VARCHAR(10);
+    ALTER TABLE test_instances ADD COLUMN IF NOT EXISTS resumed_at TIMESTAMP WITH TIME ZONE;
+    ALTER TABLE test_instances ADD COLUMN IF NOT EXISTS hibernation_count INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE test_instances ADD COLUMN IF NOT EXISTS resume_count INTEGER NOT NULL DEFAULT 0;
+    CREATE INDEX IF NOT EXISTS idx_telemetry_events_instance_created ON telemetry_events(instance_id, created_at);
+    CREATE INDEX IF NOT EXISTS idx_chat_history_instance_created ON chat_history(instance_id, created_at);
+    """)
+    logger.info("Added hibernation columns to test_instances")
+
+# Instances whose container vanished (see controllers/reconcile_controller.py)
+@migration(18, 'test_instances_container_missing_at')
+def add_test_instances_container_missing_at(cursor):
+    cursor.execute("ALTER TABLE test_instances ADD COLUMN IF NOT EXISTS container_missing_at TIMESTAMP WITH TIME ZONE")
+    logger.info("Added container_missing_at to test_instances")
+
+# One instance per (test, candidate): replaces the plain index of migration 9 with a unique one
+# that create_instance's INSERT ... ON CONFLICT relies on
+@migration(19, 'unique_test_instances_test_candidate', transactional=False)
+def create_unique_test_instances_test_candidate_index(cursor):
+    cursor.execute("""
+        SELECT test_id, candidate_id, array_agg(id ORDER BY id) AS instance_ids
+        FROM test_instances
+        GROUP BY test_id, candidate_id
+        HAVING COUNT(*) > 1
+    """)
+    duplicates = cursor.fetchall()
+    if duplicates:
+        listing = '; '.join(
+            f"test {row['test_id']} / candidate {row['candidate_id']}: instances {row['instance_ids']}"
+            for row in duplicates
+        )
+        raise Exception(
+            f"Cannot add the unique (test_id, candidate_id) index: {len(duplicates)} duplicate(s) "
+            f"in test_instances. Delete the extra instances and rerun migrations. {listing}"
+        )
+    create_index_concurrently(
+        cursor, 'idx_test_instances_test_candidate_unique', 'ON test_instances(test_id, candidate_id)', unique=True
+    )
+    cursor.execute("DROP INDEX CONCURRENTLY IF EXISTS idx_test_instances_test_candidate")
+    logger.info("Added unique (test_id, candidate_id) index to test_instances")
 
 if __name__ == "__main__":
     """Run migrations when script is executed directly"""
@@ -0,0 +1,189 @@
+"""
+Keyset pagination, sparse fieldsets, sorting and filtering for admin list endpoints.
+
+A list endpoint describes itself with a spec dict:
+
+    fields        {name: SQL expression} selectable with ?fields=a,b (always includes the id)
+    default       field names returned when ?fields= is absent
+    default_select  optional SQL select list used instead of 'default' (e.g. "c.*" to keep a
+                  legacy SELECT * response shape)
+    select        optional fixed SQL select list; fields= is then applied to the output only
+    sorts         {name: SQL expression} allowed in ?sort=name / ?sort=-name. Expressions must
+                  be NOT NULL and backed by an index (see the list indexes migration)
+    default_sort  e.g. '-created_at'
+    filters       {param: (SQL condition with %s placeholders, converter)}
+    id            SQL expression of the unique tiebreaker (the primary key)
+
+Pages are addressed with an opaque cursor (base64 of the last row's sort value and id) and
+fetched with a row-value comparison, `(sort, id) > (%s, %s)`, so page N costs the same as
+page 1 (no OFFSET scans). Without ?limit= or ?cursor= an endpoint returns every row as a bare
+list, exactly like before; with either it returns {"items": [...], "next_cursor": ...}.
+"""
+import base64
+import binascii
+import json
+from datetime import date, datetime
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def iso_datetime(value):
+    """Filter converter: ISO 8601 date or datetime ('Z' suffix allowed)"""
+    if len(value) == 10:
+        return datetime.combine(date.fromisoformat(value), datetime.min.time())
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+def contains(value):
+    """Filter converter: substring match for ILIKE (LIKE wildcards in the input are escaped)"""
+    escaped = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+def _encode_cursor(sort, value, row_id):
+    if isinstance(value, (datetime, date)):
+        value = value.isoformat()
+    payload = json.dumps({'s': sort, 'v': value, 'id': row_id}, separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def _decode_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        return data['s'], data['v'], data['id']
+    except (binascii.Error, ValueError, KeyError, TypeError, UnicodeError):
+        raise ValueError('Invalid cursor')
+
+def _split_param(value):
+    return [part.strip() for part in (value or '').split(',') if part.strip()]
+
+def parse_list_params(args, spec, ignore_unknown_fields=False):
+    """
+    Validate list query parameters (a dict-like, e.g. request.args) against spec.
+
+    Raises ValueError for unknown fields/sorts, bad limits or a cursor from another sort.
+    """
+    # Sort
+    sort = args.get('sort') or spec['default_sort']
+    sort_name = sort[1:] if sort.startswith('-') else sort
+    if sort_name not in spec['sorts']:
+        raise ValueError(f"Cannot sort by '{sort_name}' (allowed: {', '.join(sorted(spec['sorts']))})")
+
+    # Sparse fieldset
+    fields = None
+    if args.get('fields'):
+        requested = _split_param(args.get('fields'))
+        unknown = [name for name in requested if name not in spec['fields']]
+        if unknown and not ignore_unknown_fields:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)} (allowed: {', '.join(sorted(spec['fields']))})")
+        fields = [name for name in requested if name in spec['fields']]
+
+    # Filters
+    filters = []
+    for param, (condition, convert) in spec.get('filters', {}).items():
+        raw = args.get(param)
+        if raw is None or raw == '':
+            continue
+        try:
+            value = convert(raw)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid value for '{param}': {raw}")
+        filters.append((condition, [value] * condition.count('%s')))
+
+    # Page
+    paginated = args.get('limit') is not None or args.get('cursor') is not None
+    limit = None
+    if paginated:
+        try:
+            limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+        except (TypeError, ValueError):
+            raise ValueError("'limit' must be an integer")
+        if limit < 1 or limit > MAX_PAGE_SIZE:
+            raise ValueError(f"'limit' must be between 1 and {MAX_PAGE_SIZE}")
+
+    after = None
+    if args.get('cursor'):
+        cursor_sort, value, row_id = _decode_cursor(args.get('cursor'))
+        if cursor_sort != sort:
+            raise ValueError('Cursor was issued for a different sort order')
+        after = (value, row_id)
+
+    return {
+        'sort': sort,
+        'sort_name': sort_name,
+        'descending': sort.startswith('-'),
+        'fields': fields,
+        'filters': filters,
+        'paginated': paginated,
+        'limit': limit,
+        'after': after
+    }
+
+def fetch_list(cursor, spec, from_sql, conditions, params, list_params):
+    """
+    Run a list query: spec's projection FROM from_sql WHERE conditions (+ filters and keyset),
+    ordered by the requested sort and limited to one page (+1 row to detect the next page).
+
+    Returns (rows, next_cursor); next_cursor is None on the last page or when not paginated.
+    """
+    sort_expr = spec['sorts'][list_params['sort_name']]
+    id_expr = spec['id']
+    direction = 'DESC' if list_params['descending'] else 'ASC'
+
+    if spec.get('select'):
+        select_sql = spec['select']
+    elif not list_params['fields'] and spec.get('default_select'):
+        select_sql = spec['default_select']
+    else:
+        names = list_params['fields'] or spec['default']
+        if 'id' not in names:
+            names = ['id'] + list(names)
+        select_sql = ', '.join(f'{spec["fields"][name]} AS "{name}"' for name in names)
+
+    where = list(conditions)
+    query_params = list(params)
+    for condition, values in list_params['filters']:
+        where.append(condition)
+        query_params.extend(values)
+    if list_params['after']:
+        value, row_id = list_params['after']
+        op = '<' if list_params['descending'] else '>'
+        if sort_expr == id_expr:
+            where.append(f'{id_expr} {op} %s')
+            query_params.append(row_id)
+        else:
+            where.append(f'({sort_expr}, {id_expr}) {op} (%s, %s)')
+            query_params.extend([value, row_id])
+
+    query = f'''
+        SELECT {select_sql}, {sort_expr} AS _page_sort, {id_expr} AS _page_id
+        FROM {from_sql}
+        {'WHERE ' + ' AND '.join(where) if where else ''}
+        ORDER BY {sort_expr} {direction}, {id_expr} {direction}
+    '''
+    if list_params['limit']:
+        query += ' LIMIT %s'
+        query_params.append(list_params['limit'] + 1)
+
+    cursor.execute(query, query_params)
+    rows = [dict(row) for row in cursor.fetchall()]
+
+    next_cursor = None
+    if list_params['limit'] and len(rows) > list_params['limit']:
+        rows = rows[:list_params['limit']]
+        last = rows[-1]
+        next_cursor = _encode_cursor(list_params['sort'], last['_page_sort'], last['_page_id'])
+    for row in rows:
+        row.pop('_page_sort', None)
+        row.pop('_page_id', None)
+    return rows, next_cursor
+
+def project_fields(item, fields):
+    """Keep only the requested fields of an already formatted item (None keeps everything)"""
+    if not fields:
+        return item
+    return {name: item[name] for name in fields if name in item}
+
+def list_response(items, next_cursor, list_params):
+    """Bare list (legacy) or the paginated envelope"""
+    if not list_params['paginated']:
+        return items
+    return {'items': items, 'next_cursor': next_cursor}
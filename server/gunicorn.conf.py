@@ -0,0 +1,77 @@
+"""
+Gunicorn settings for the API server. Every setting can be overridden with an environment variable.
+
+Worker model: the API is I/O bound (Postgres, Docker API, git pushes, OpenAI calls), so the
+default is a few `gthread` processes with a pool of threads each. `gevent` can be selected with
+GUNICORN_WORKER_CLASS=gevent (requires the gevent and psycogreen packages).
+
+Open /timer/stream and /timer/poll requests hold a thread (or greenlet) while they wait; with
+gthread only TIMER_MAX_WAITERS of them wait per process (see routes/timer.py) and the rest are
+answered immediately. Use gevent workers to push updates to hundreds of candidates at once.
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+bind = f"0.0.0.0:{os.getenv('PORT', '3000')}"
+
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+
+# Processes: WEB_CONCURRENCY is the conventional knob on PaaS hosts
+workers = int(os.getenv('WEB_CONCURRENCY', str(min(multiprocessing.cpu_count() * 2 + 1, 4))))
+
+# Threads per process (gthread) / concurrent greenlets per process (gevent)
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '1000'))
+
+# Report generation and submission uploads can legitimately take a while
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+
+# Recycle workers periodically to bound memory growth (jitter avoids restarting all at once)
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '2000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '200'))
+
+# Preloading imports the app once in the master; background threads are started per worker below
+preload_app = os.getenv('GUNICORN_PRELOAD', 'false').lower() == 'true'
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG') or None
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+# Railway (and most PaaS routers) terminate TLS in front of the app
+forwarded_allow_ips = os.getenv('FORWARDED_ALLOW_IPS', '*')
+
+# Workers write their metrics here so /metrics can add them up (see observability/metrics.py).
+# Set before the app is imported: prometheus_client reads it at import time.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'gunicorn-metrics'))
+
+
+def on_starting(server):
+    # Samples of a previous run would otherwise be added to this one's
+    metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def post_fork(server, worker):
+    if worker_class == 'gevent':
+        try:
+            from psycogreen.gevent import patch_psycopg
+            patch_psycopg()
+        except ImportError:
+            server.log.warning("psycogreen is not installed; database calls will block gevent workers")
+
+
+def post_worker_init(worker):
+    # Threads do not survive fork, so per-process background services start in each worker
+    from railway_deploy import start_background_services
+    start_background_services()
+
+
+def child_exit(server, worker):
+    # Drop the in-flight gauge of a dead worker; its counters and histograms are kept
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+One-shot management commands.
+
+    cd server && python manage.py migrate
+    cd server && python manage.py nginx-map --host vm1 --output /etc/nginx/instance-hosts.map
+
+Run `migrate` once per deploy (Railway preDeployCommand) rather than from every web process.
+Run `nginx-map` periodically on each Docker host (followed by `nginx -s reload`) when instances
+are spread over several hosts (DOCKER_HOSTS).
+"""
+import argparse
+import logging
+import os
+import sys
+
+from dotenv import load_dotenv
+
+logger = logging.getLogger('manage')
+
+
+def migrate():
+    """Test the database connection, initialize the database and run migrations. Returns True on success."""
+    from database.db_postgresql import init_database, test_connection
+    from database.migrations_postgresql import run_migrations
+
+    # Test database connection first
+    logger.info("🔍 MIGRATE: Testing database connection...")
+    try:
+        logger.info(test_connection())
+    except Exception as e:
+        logger.error(f"MIGRATE: Database connection test failed: {str(e)}")
+        logger.error("💡 Make sure DATABASE_URL is set in your .env file")
+        return False
+
+    try:
+        logger.info("🗄️ MIGRATE: Initializing PostgreSQL database...")
+        init_database()
+        logger.info("MIGRATE: Database initialized successfully")
+
+        logger.info("MIGRATE: Running PostgreSQL migrations...")
+        run_migrations()
+        logger.info("MIGRATE: Migrations completed successfully")
+    except Exception as e:
+        logger.error(f"MIGRATE: Database initialization failed: {str(e)}")
+        logger.error("💡 Check your DATABASE_URL and Supabase connection")
+        return False
+    return True
+
+
+def nginx_map(host_name, output=None):
+    """Write the nginx routing map for one Docker host's proxy (to stdout without output). Returns True on success."""
+    from controllers.instances_controller import get_instance_routing_map
+
+    try:
+        content = get_instance_routing_map(host_name)
+    except Exception as e:
+        logger.error(f"NGINX-MAP: Could not build the map for {host_name}: {str(e)}")
+        return False
+
+    if not output:
+        sys.stdout.write(content)
+        return True
+    # Replace atomically so nginx never reads a partial file
+    tmp_path = f'{output}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(content)
+    os.replace(tmp_path, output)
+    logger.info(f"NGINX-MAP: Wrote {len(content.splitlines()) - 1} entries to {output}")
+    return True
+
+
+COMMANDS = {
+    'migrate': lambda args: migrate(),
+    'nginx-map': lambda args: nginx_map(args.host, args.output),
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='AI OA server management commands')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('migrate', help='Initialize the database and apply pending migrations')
+    nginx_map_parser = subparsers.add_parser('nginx-map', help='Generate the instance routing map of a Docker host')
+    nginx_map_parser.add_argument('--host', help='Docker host name from DOCKER_HOSTS (default: the first one)')
+    nginx_map_parser.add_argument('--output', help='File to write (default: stdout)')
+    args = parser.parse_args(argv)
+
+    return 0 if COMMANDS[args.command](args) else 1
+
+
+if __name__ == '__main__':
+    from observability.logs import configure_logging
+    configure_logging()
+    load_dotenv('../server/.env')
+    load_dotenv()
+    sys.exit(main())
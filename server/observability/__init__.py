@@ -0,0 +1 @@
+# This file is intentionally left empty to mark this directory as a Python package.
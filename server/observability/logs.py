@@ -0,0 +1,189 @@
+"""
+Logging setup for the server processes (web, worker, manage.py).
+
+configure_logging() routes every record through a bounded in-memory queue: the calling thread
+only formats the message and enqueues it, and a QueueListener thread writes to stdout, so request
+threads do not wait on log I/O. When the queue is full, records below WARNING are dropped (and
+counted in dropped_records()) rather than blocking.
+
+Settings:
+
+- LOG_LEVEL (INFO) and LOG_LEVELS for per-module levels, e.g.
+  "routes.chat=WARNING,controllers.jobs_controller=DEBUG"
+- LOG_SAMPLE_RATES keeps a fraction of a module's records below WARNING, e.g. "routes.chat=0.1"
+- LOG_MAX_MESSAGE_CHARS (2000) truncates messages; LOG_MAX_PAYLOAD_CHARS (300) truncates the
+  strings inside payloads passed through summarize()
+- LOG_FORMAT: text (default) or json (one object per line)
+
+Structured fields go in extra={'fields': {...}}; pass request bodies and rows through
+summarize(), which also redacts tokens and passwords.
+"""
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+LOG_MAX_MESSAGE_CHARS = int(os.getenv('LOG_MAX_MESSAGE_CHARS', '2000'))
+LOG_MAX_PAYLOAD_CHARS = int(os.getenv('LOG_MAX_PAYLOAD_CHARS', '300'))
+LOG_MAX_PAYLOAD_ITEMS = 20
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+SECRET_KEY_PATTERN = re.compile(r'token|password|secret|api[_-]?key|authorization|cookie', re.IGNORECASE)
+
+_state = {'pid': None, 'handler': None, 'listener': None, 'dropped': 0}
+
+
+def _parse_mapping(raw, convert):
+    """'a.b=X,c=Y' -> {'a.b': convert('X'), 'c': convert('Y')}"""
+    mapping = {}
+    for item in (raw or '').split(','):
+        if '=' not in item:
+            continue
+        name, value = item.split('=', 1)
+        mapping[name.strip()] = convert(value.strip())
+    return mapping
+
+def summarize(value, max_chars=None, _depth=0):
+    """
+    Loggable version of a payload: secrets redacted, long strings cut, long collections cut to
+    LOG_MAX_PAYLOAD_ITEMS entries.
+    """
+    max_chars = max_chars or LOG_MAX_PAYLOAD_CHARS
+    if _depth > 4:
+        return '...'
+    if isinstance(value, dict):
+        summary = {}
+        for index, (key, item) in enumerate(value.items()):
+            if index == LOG_MAX_PAYLOAD_ITEMS:
+                summary['...'] = f'{len(value) - index} more'
+                break
+            if isinstance(key, str) and SECRET_KEY_PATTERN.search(key):
+                summary[key] = '[redacted]' if item else item
+            else:
+                summary[key] = summarize(item, max_chars, _depth + 1)
+        return summary
+    if isinstance(value, (list, tuple)):
+        summary = [summarize(item, max_chars, _depth + 1) for item in value[:LOG_MAX_PAYLOAD_ITEMS]]
+        if len(value) > LOG_MAX_PAYLOAD_ITEMS:
+            summary.append(f'... {len(value) - LOG_MAX_PAYLOAD_ITEMS} more')
+        return summary
+    if isinstance(value, (bytes, bytearray)):
+        value = value.decode('utf-8', errors='replace')
+    if isinstance(value, str) and len(value) > max_chars:
+        return f'{value[:max_chars]}... ({len(value)} chars)'
+    return value
+
+def _truncate(text):
+    if len(text) <= LOG_MAX_MESSAGE_CHARS:
+        return text
+    return f'{text[:LOG_MAX_MESSAGE_CHARS]}... ({len(text)} chars)'
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a fraction of the records below WARNING of the loggers in `rates` (longest prefix wins)."""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = sorted(rates.items(), key=lambda item: len(item[0]), reverse=True)
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        for prefix, rate in self.rates:
+            if record.name == prefix or record.name.startswith(prefix + '.'):
+                return random.random() < rate
+        return True
+
+
+class _BoundedQueueHandler(QueueHandler):
+    """QueueHandler that truncates messages and drops low-level records when the queue is full."""
+
+    def prepare(self, record):
+        # Truncate the message only: tracebacks are kept whole
+        message = record.getMessage()
+        if len(message) > LOG_MAX_MESSAGE_CHARS:
+            record = copy.copy(record)
+            record.msg, record.args = _truncate(message), None
+        return super().prepare(record)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if record.levelno >= logging.WARNING:
+                self.queue.put(record)
+            else:
+                _state['dropped'] += 1
+
+
+class TextFormatter(logging.Formatter):
+    """The usual text format, with structured fields appended as key=value"""
+
+    def format(self, record):
+        text = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            text += ' ' + ' '.join(f'{key}={json.dumps(value, default=str)}' for key, value in fields.items())
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry['fields'] = fields
+        return json.dumps(entry, default=str)
+
+
+def configure_logging():
+    """
+    Install the queue-based root handler for this process. Safe to call repeatedly; after a
+    fork (gunicorn workers) it starts a new listener thread, since threads do not survive fork.
+    """
+    if _state['pid'] == os.getpid():
+        return
+    root = logging.getLogger()
+    if _state['handler'] is not None:
+        root.removeHandler(_state['handler'])
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    handler = _BoundedQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(_parse_mapping(os.getenv('LOG_SAMPLE_RATES'), float)))
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else TextFormatter(TEXT_FORMAT))
+    listener = QueueListener(log_queue, output, respect_handler_level=False)
+    listener.start()
+    atexit.register(listener.stop)
+
+    # Replace basicConfig-style handlers so records are not written twice
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    # Flask's per-request logs
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    for name, level in _parse_mapping(os.getenv('LOG_LEVELS'), str.upper).items():
+        logging.getLogger(name).setLevel(level)
+
+    _state.update(pid=os.getpid(), handler=handler, listener=listener)
+
+def dropped_records():
+    """Records dropped in this process because the log queue was full"""
+    return _state['dropped']
@@ -0,0 +1,161 @@
+"""
+Request and database metrics in Prometheus format.
+
+init_app(app) adds middleware that records, per endpoint (the Flask endpoint name, e.g.
+'instances.get_instance'):
+
+- http_request_duration_seconds: latency histogram, by method, endpoint and status
+- http_requests_in_flight: requests being served
+- http_request_db_seconds: time each request spent in database queries
+
+and serves everything on GET /metrics with Authorization: Bearer METRICS_TOKEN. Without a
+METRICS_TOKEN the endpoint is not registered (metrics are still recorded for the slow-query log).
+
+init_app() also registers observe_query() as the query observer of database.db_postgresql, so
+cursors from get_connection() report each query:
+
+- db_query_duration_seconds: histogram by endpoint and operation (SELECT, INSERT, ...)
+- db_slow_queries_total, and a warning log for every query slower than DB_SLOW_QUERY_MS
+  (0 turns the log off)
+
+Queries outside a request are attributed to 'background', or to what
+database.db_postgresql.attribute_queries() names (the job worker uses 'job:<job type>'). Processes
+that never call init_app (worker.py, manage.py) do not time queries.
+
+Gunicorn runs several worker processes; with PROMETHEUS_MULTIPROC_DIR set (gunicorn.conf.py sets
+a default) every worker writes its samples there and /metrics adds them up across workers.
+"""
+import hmac
+import logging
+import os
+import re
+import time
+
+from flask import Response, g, has_request_context, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+)
+from prometheus_client import multiprocess
+
+from database.db_postgresql import query_attribution, set_query_observer
+from observability.logs import summarize
+
+logger = logging.getLogger(__name__)
+
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+DB_SLOW_QUERY_MS = float(os.getenv('DB_SLOW_QUERY_MS', '500'))
+
+REQUEST_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUERY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'Time spent serving HTTP requests',
+    ['method', 'endpoint', 'status'], buckets=REQUEST_BUCKETS
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    'http_requests_in_flight', 'HTTP requests being served',
+    ['method', 'endpoint'], multiprocess_mode='livesum'
+)
+REQUEST_DB_TIME = Histogram(
+    'http_request_db_seconds', 'Time each HTTP request spent in database queries',
+    ['endpoint'], buckets=REQUEST_BUCKETS
+)
+QUERY_DURATION = Histogram(
+    'db_query_duration_seconds', 'Database query execution time',
+    ['endpoint', 'operation'], buckets=QUERY_BUCKETS
+)
+SLOW_QUERIES = Counter(
+    'db_slow_queries_total', 'Database queries slower than DB_SLOW_QUERY_MS',
+    ['endpoint', 'operation']
+)
+
+# Leading keyword of a statement; anything else is counted as 'OTHER'
+OPERATION_PATTERN = re.compile(r'\s*(?:--[^\n]*\n\s*)*(\w+)')
+OPERATIONS = {'SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'CREATE', 'ALTER', 'DROP', 'LOCK'}
+
+
+def current_endpoint():
+    """What the current query belongs to: the request's endpoint, a job, or 'background'"""
+    if has_request_context():
+        return request.endpoint or 'unmatched'
+    return query_attribution() or 'background'
+
+def _operation(query):
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', errors='replace')
+    if not isinstance(query, str):
+        return 'OTHER'
+    match = OPERATION_PATTERN.match(query)
+    operation = match.group(1).upper() if match else 'OTHER'
+    return operation if operation in OPERATIONS else 'OTHER'
+
+def observe_query(query, seconds):
+    """Record one executed query (the query observer of get_connection()'s cursors)"""
+    endpoint = current_endpoint()
+    operation = _operation(query)
+    QUERY_DURATION.labels(endpoint, operation).observe(seconds)
+    if has_request_context():
+        g.metrics_db_seconds = g.get('metrics_db_seconds', 0.0) + seconds
+
+    if DB_SLOW_QUERY_MS > 0 and seconds * 1000 >= DB_SLOW_QUERY_MS:
+        SLOW_QUERIES.labels(endpoint, operation).inc()
+        # The statement only: parameters may hold personal data or secrets
+        logger.warning(
+            f"Slow query ({seconds * 1000:.0f} ms) in {endpoint}",
+            extra={'fields': {
+                'endpoint': endpoint,
+                'duration_ms': round(seconds * 1000, 1),
+                'query': summarize(' '.join(str(query).split()))
+            }}
+        )
+
+
+def _before_request():
+    if request.endpoint == 'metrics':
+        return
+    g.metrics_started = time.perf_counter()
+    g.metrics_in_flight = (request.method, request.endpoint or 'unmatched')
+    REQUESTS_IN_FLIGHT.labels(*g.metrics_in_flight).inc()
+
+def _after_request(response):
+    started = g.get('metrics_started')
+    if started is not None:
+        endpoint = request.endpoint or 'unmatched'
+        REQUEST_DURATION.labels(request.method, endpoint, str(response.status_code)).observe(
+            time.perf_counter() - started
+        )
+        REQUEST_DB_TIME.labels(endpoint).observe(g.get('metrics_db_seconds', 0.0))
+    return response
+
+def _teardown_request(error=None):
+    # Runs once the response is sent, so streamed responses stay in flight until they finish
+    in_flight = g.pop('metrics_in_flight', None)
+    if in_flight is not None:
+        REQUESTS_IN_FLIGHT.labels(*in_flight).dec()
+
+def _collect():
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+def metrics():
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    if not hmac.compare_digest(supplied, METRICS_TOKEN):
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(_collect(), content_type=CONTENT_TYPE_LATEST)
+
+def init_app(app):
+    """
+    Install the request metrics middleware and the query observer, and the /metrics endpoint
+    when METRICS_TOKEN is set (endpoint names, traffic and slow queries are not public).
+    """
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    set_query_observer(observe_query)
+    if METRICS_TOKEN:
+        app.add_url_rule('/metrics', 'metrics', metrics, methods=['GET'])
+    else:
+        logger.info("METRICS_TOKEN is not set: /metrics is disabled")
@@ -10,7 +10,7 @@ from controllers.candidates_controller import (
     handle_duplicate_resolution
 )
 from controllers.auth_controller import require_session_auth
-import pandas as pd
+from controllers.versions_controller import versioned_json
 from werkzeug.utils import secure_filename
 import os
 import logging
@@ -28,14 +28,15 @@ def get_user_company_id():
         return request.user.get('company_id')
     return None
 
-# GET /candidates - Get all candidates
+# GET /candidates - Get all candidates (?fields=&sort=&q=&email=&created_after=&created_before=&limit=&cursor=)
 @candidates_bp.route('/', methods=['GET'])
 @require_session_auth
 def get_candidates():
     try:
         company_id = get_user_company_id()
-        candidates = get_all_candidates(company_id)
-        return jsonify(candidates)
+        return versioned_json([('candidates', company_id)], lambda: get_all_candidates(company_id, request.args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f'Error getting candidates: {str(e)}')
         return jsonify({'error': str(e)}), 500
@@ -46,10 +47,14 @@ def get_candidates():
 def get_single_candidate(candidate_id):
     try:
         company_id = get_user_company_id()
-        candidate = get_candidate(candidate_id, company_id)
-        if not candidate:
-            return jsonify({'error': f'Candidate {candidate_id} not found'}), 404
-        return jsonify(candidate)
+        
+        def build():
+            candidate = get_candidate(candidate_id, company_id)
+            if not candidate:
+                return jsonify({'error': f'Candidate {candidate_id} not found'}), 404
+            return candidate
+        
+        return versioned_json([('candidates', company_id)], build)
     except Exception as e:
         print(f'Error getting candidate: {str(e)}')
         return jsonify({'error': str(e)}), 500
@@ -1,11 +1,17 @@
 from flask import Blueprint, request, jsonify
 import asyncio
+import logging
 from controllers.chat_controller import (
     get_chat_response,
     get_chat_history,
+    get_chat_history_version,
     add_chat_message,
     get_project_helper_flag
 )
+from controllers.versions_controller import conditional_json, make_etag
+from observability.logs import summarize
+
+logger = logging.getLogger(__name__)
 
 # Create a Blueprint for chat routes
 chat_bp = Blueprint('chat', __name__)
@@ -15,7 +21,7 @@ chat_bp = Blueprint('chat', __name__)
 def chat():
     try:
         data = request.json
-        print(f'Received chat request: {data}')
+        logger.debug('Received chat request', extra={'fields': {'body': summarize(data)}})
         
         # Only accept the standardized format: { payload: { messages: [...] } }
         if not data.get('payload') or not isinstance(data.get('payload'), dict) or not data.get('payload').get('messages'):
@@ -27,9 +33,9 @@ def chat():
         # Check if we should skip history save
         skip_history_save = data.get('skipHistorySave', False)
         if skip_history_save:
-            print(f'Skipping history save for this request as requested')
+            logger.debug('Skipping history save for this request as requested')
         
-        print(f'Processing chat with {len(messages)} messages for instance {instance_id or "unknown"}')
+        logger.info(f'Processing chat with {len(messages)} messages for instance {instance_id or "unknown"}')
         
         # Use asyncio to run the async function
         loop = asyncio.new_event_loop()
@@ -47,16 +53,16 @@ def chat():
             
             # Then add the AI response
             add_chat_message(instance_id, {'role': 'assistant', 'content': reply})
-            print(f'Saved messages to history for instance {instance_id}')
+            logger.debug('Saved messages to history for instance %s', instance_id)
         else:
             if not instance_id:
-                print('Skipping history save: No instance ID provided')
+                logger.debug('Skipping history save: No instance ID provided')
             elif skip_history_save:
-                print('Skipping history save: skipHistorySave flag set to true')
+                logger.debug('Skipping history save: skipHistorySave flag set to true')
         
         return jsonify({'reply': reply})
     except Exception as e:
-        print(f'Error in chat route: {str(e)}')
+        logger.error(f'Error in chat route: {str(e)}')
         return jsonify({'error': str(e)}), 500
 
 # GET /chat/history - Get chat history for an instance
@@ -71,18 +77,22 @@ def history():
                 'error': 'Instance ID is required'
             }), 400
         
-        print(f'Getting chat history for instance {instance_id}')
-        history = get_chat_history(instance_id)
-        project_helper_enabled = get_project_helper_flag(instance_id)
+        logger.debug('Getting chat history for instance %s', instance_id)
+        etag = make_etag('chat', instance_id, *get_chat_history_version(instance_id))
         
-        return jsonify({
-            'success': True,
-            'instanceId': instance_id,
-            'history': history,
-            'project_helper_enabled': project_helper_enabled
-        })
+        def build():
+            history = get_chat_history(instance_id)
+            project_helper_enabled = get_project_helper_flag(instance_id)
+            return {
+                'success': True,
+                'instanceId': instance_id,
+                'history': history,
+                'project_helper_enabled': project_helper_enabled
+            }
+        
+        return conditional_json(etag, build)
     except Exception as e:
-        print(f'Error getting chat history: {str(e)}')
+        logger.error(f'Error getting chat history: {str(e)}')
         return jsonify({
             'success': False,
             'error': str(e)
@@ -108,11 +118,11 @@ def message():
                 'error': 'Valid message with role and content is required'
             }), 400
         
-        print(f'Adding message to chat history for instance {instance_id}')
+        logger.debug('Adding message to chat history for instance %s', instance_id)
         
         # Handle metadata if provided
         if 'metadata' in message:
-            print(f'Message includes metadata: {message["metadata"]}')
+            logger.debug('Message includes metadata', extra={'fields': {'metadata': summarize(message['metadata'])}})
         
         history = add_chat_message(instance_id, message)
         
@@ -122,7 +132,7 @@ def message():
             'history': history
         })
     except Exception as e:
-        print(f'Error adding chat message: {str(e)}')
+        logger.error(f'Error adding chat message: {str(e)}')
         return jsonify({
             'success': False,
             'error': str(e)
@@ -1,8 +1,19 @@
-from flask import Blueprint, request, jsonify, redirect, render_template_string
-from controllers.instances_controller import get_all_instances, create_instance, get_instance, stop_instance, upload_project_to_github, get_project_from_github, get_report, create_report, resolve_instance_id_by_test_and_candidate
-from controllers.timer_controller import delete_timer, load_timers
+import logging
+
+from flask import Blueprint, Response, request, jsonify, redirect, render_template_string
+from controllers.instances_controller import get_all_instances, instance_list_needs_docker, create_instance, get_instance, stop_instance, upload_project_to_github, get_project_from_github, get_report, create_report, resolve_instance_id_by_test_and_candidate, get_instance_capacity, get_instance_routing_map
+from controllers.timer_controller import delete_timer
 from controllers.email_controller import send_test_invitations
 from controllers.access_controller import validate_access_token_for_redirect, check_deadline_expired, get_instance_url, validate_instance_access
+from controllers.versions_controller import versioned_json
+from controllers.capacity_controller import CapacityError
+from controllers.auth_controller import require_bearer_token
+from controllers.idle_controller import get_hibernation_metrics, resume_instance
+from controllers.reconcile_controller import enqueue_reconcile
+from controllers.jobs_controller import get_system_job
+from observability.logs import summarize
+
+logger = logging.getLogger(__name__)
 
 # Create a Blueprint for instances routes
 instances_bp = Blueprint('instances', __name__)
@@ -30,6 +41,17 @@ def access_test_instance(token):
                 message = "There was an issue with the deadline configuration. Please contact the administrator."
             return render_error_page("Assessment Deadline Passed", message)
         
+        # Wake the container if it was hibernated while idle
+        try:
+            resume_instance(token_data['instance_id'])
+        except CapacityError as e:
+            print(f"Cannot resume instance {token_data['instance_id']} yet: {str(e)}")
+            return render_error_page("Environment Starting",
+                                   "Your test environment is waking up. Please try this link again in a minute.")
+        except Exception as e:
+            # Resuming is best effort (missing container, unreachable host): still redirect
+            logger.warning(f"Could not resume instance {token_data['instance_id']}: {str(e)}")
+        
         # Generate the secure instance URL with access token
         instance_url = get_instance_url(
             token_data['port'],
@@ -115,16 +137,81 @@ def render_error_page(title, message):
     """
     return render_template_string(html_template, title=title, message=message), 400
 
-# GET /instances - Get all instances
+# GET /instances - Get all instances (?fields=&sort=&test_id=&candidate_id=&created_after=&created_before=&limit=&cursor=)
 @instances_bp.route('/', methods=['GET'])
 def get_instances():
     try:
-        instances = get_all_instances()
-        return jsonify(instances)
+        # Container state changes without database writes, so only database-only lists are versioned
+        if instance_list_needs_docker(request.args):
+            return jsonify(get_all_instances(request.args))
+        return versioned_json([('instances', 0)], lambda: get_all_instances(request.args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f'Error getting instances: {str(e)}')
         return jsonify({'error': str(e)}), 500
 
+# GET /instances/capacity - Container density and headroom of each Docker host (operators: OPS_API_TOKEN)
+@instances_bp.route('/capacity', methods=['GET'])
+@require_bearer_token('OPS_API_TOKEN')
+def get_capacity_route():
+    try:
+        return jsonify(get_instance_capacity())
+    except Exception as e:
+        print(f'Error getting capacity: {str(e)}')
+        return jsonify({'error': str(e)}), 500
+
+# GET /instances/hibernation - Idle containers hibernated and the capacity they free (operators: OPS_API_TOKEN)
+@instances_bp.route('/hibernation', methods=['GET'])
+@require_bearer_token('OPS_API_TOKEN')
+def get_hibernation_route():
+    try:
+        return jsonify(get_hibernation_metrics())
+    except Exception as e:
+        print(f'Error getting hibernation metrics: {str(e)}')
+        return jsonify({'error': str(e)}), 500
+
+# Operator endpoints (OPS_API_TOKEN). Reconciling scans every Docker host, so it runs as a job:
+# POST /instances/reconcile - Queue a run that removes the orphans and marks the instances
+#                             ({"dry_run": true} to only report); returns the job id
+# GET /instances/reconcile?job_id= - Status and report of that run (default: the latest run)
+@instances_bp.route('/reconcile', methods=['POST'])
+@require_bearer_token('OPS_API_TOKEN')
+def reconcile_route():
+    try:
+        dry_run = bool((request.get_json(silent=True) or {}).get('dry_run'))
+        job_id = enqueue_reconcile(dry_run=dry_run)
+        if job_id is None:
+            return jsonify({'error': 'A reconcile run of this kind is already queued or running'}), 409
+        return jsonify({'job_id': job_id, 'dry_run': dry_run}), 202
+    except Exception as e:
+        print(f'Error queueing reconciliation: {str(e)}')
+        return jsonify({'error': str(e)}), 500
+
+@instances_bp.route('/reconcile', methods=['GET'])
+@require_bearer_token('OPS_API_TOKEN')
+def get_reconcile_route():
+    try:
+        return jsonify(get_system_job('instances.reconcile', request.args.get('job_id', type=int)))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        print(f'Error getting reconciliation: {str(e)}')
+        return jsonify({'error': str(e)}), 500
+
+# GET /instances/routing/nginx-map?host=<name> - nginx map of a Docker host's proxy (ROUTING_MAP_TOKEN)
+@instances_bp.route('/routing/nginx-map', methods=['GET'])
+@require_bearer_token('ROUTING_MAP_TOKEN')
+def get_routing_map_route():
+    try:
+        content = get_instance_routing_map(request.args.get('host'))
+        return Response(content, mimetype='text/plain')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f'Error building routing map: {str(e)}')
+        return jsonify({'error': str(e)}), 500
+
 # POST /instances - Create a new instance
 @instances_bp.route('/', methods=['POST'])
 def instances_create():
@@ -147,14 +234,28 @@ def instances_create():
 @instances_bp.route('/<int:instance_id>', methods=['GET'])
 def get_single_instance(instance_id):
     try:
-        instance = get_instance(instance_id)
-        if not instance:
-            return jsonify({'error': f'Instance {instance_id} not found'}), 404
-        return jsonify(instance)
+        def build():
+            instance = get_instance(instance_id)
+            if not instance:
+                return jsonify({'error': f'Instance {instance_id} not found'}), 404
+            return instance
+        
+        return versioned_json([('instance', instance_id)], build)
     except Exception as e:
         print(f'Error getting instance: {str(e)}')
         return jsonify({'error': str(e)}), 500
 
+# POST /instances/:id/resume - Wake a hibernated instance
+@instances_bp.route('/<int:instance_id>/resume', methods=['POST'])
+def resume_instance_route(instance_id):
+    try:
+        return jsonify({'success': True, 'resumed': resume_instance(instance_id)})
+    except CapacityError as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        print(f'Error resuming instance: {str(e)}')
+        return jsonify({'error': str(e)}), 500
+
 # POST /instances/:id/stop - Stop an instance
 @instances_bp.route('/<int:instance_id>/stop', methods=['POST'])
 def stop_instance_route(instance_id):
@@ -214,7 +315,8 @@ def instance_report(instance_id):
     else:  # POST
         try:
             data = request.json
-            print(f'Received report create request: {data}')
+            # The body carries the whole workspace: log a truncated summary
+            logger.debug('Received report create request', extra={'fields': {'body': summarize(data)}})
             if not data:
                 return jsonify({'error': 'Instance content is required to generate a report'}), 400
             workspace_content = data['workspaceContent']
@@ -0,0 +1,46 @@
+from flask import Blueprint, request, jsonify
+from controllers.jobs_controller import get_job, list_jobs
+from controllers.auth_controller import require_session_auth
+
+# Create a Blueprint for background job status routes
+jobs_bp = Blueprint('jobs', __name__)
+
+def get_user_company_id():
+    """Get the company_id from the authenticated user"""
+    if hasattr(request, 'user') and request.user:
+        return request.user.get('company_id')
+    return None
+
+# GET /jobs - List recent jobs for the user's company (?status=&type=&limit=)
+@jobs_bp.route('/', methods=['GET'])
+@require_session_auth
+def get_jobs():
+    try:
+        company_id = get_user_company_id()
+        if not company_id:
+            return jsonify({'error': 'User not associated with a company'}), 403
+        jobs = list_jobs(
+            company_id,
+            status=request.args.get('status'),
+            job_type=request.args.get('type'),
+            limit=request.args.get('limit', 50, type=int)
+        )
+        return jsonify(jobs)
+    except Exception as e:
+        print(f'Error getting jobs: {str(e)}')
+        return jsonify({'error': str(e)}), 500
+
+# GET /jobs/:id - Get a single job's status, result and last error
+@jobs_bp.route('/<int:job_id>', methods=['GET'])
+@require_session_auth
+def get_single_job(job_id):
+    try:
+        company_id = get_user_company_id()
+        if not company_id:
+            return jsonify({'error': 'User not associated with a company'}), 403
+        return jsonify(get_job(job_id, company_id))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        print(f'Error getting job: {str(e)}')
+        return jsonify({'error': str(e)}), 500
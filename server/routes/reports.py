@@ -1,9 +1,17 @@
-from flask import Blueprint, request, jsonify
-from controllers.reports_controller import get_report
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from datetime import datetime
+from controllers.reports_controller import get_report, export_reports
+from controllers.auth_controller import require_session_auth
 
 # Create a Blueprint for reports routes
 reports_bp = Blueprint('reports', __name__)
 
+def get_user_company_id():
+    """Get the company_id from the authenticated user"""
+    if hasattr(request, 'user') and request.user:
+        return request.user.get('company_id')
+    return None
+
 # GET /reports/:instance_id - Get a report for an instance
 @reports_bp.route('/<int:instance_id>', methods=['GET'])
 def get_instance_report(instance_id):
@@ -12,4 +20,35 @@ def get_instance_report(instance_id):
         return jsonify(report)
     except Exception as e:
         print(f'Error getting report: {str(e)}')
-        return jsonify({'error': str(e)}), 500 
\ No newline at end of file
+        return jsonify({'error': str(e)}), 500 
+# GET /reports/export - Stream the company's instances and reports (?format=ndjson|csv&test_id=&from=&to=)
+@reports_bp.route('/export', methods=['GET'])
+@require_session_auth
+def export_company_reports():
+    try:
+        fmt = request.args.get('format', 'ndjson').lower()
+        chunks = export_reports(
+            get_user_company_id(),
+            fmt=fmt,
+            test_id=request.args.get('test_id', type=int),
+            date_from=request.args.get('from'),
+            date_to=request.args.get('to')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f'Error exporting reports: {str(e)}')
+        return jsonify({'error': str(e)}), 500
+
+    # No Content-Length: the body is sent with chunked transfer encoding as rows are fetched
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    filename = f"reports-export-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.{fmt}"
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            'Cache-Control': 'no-store',
+            'X-Accel-Buffering': 'no'
+        }
+    )
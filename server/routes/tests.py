@@ -1,6 +1,12 @@
+import logging
+
 from flask import Blueprint, request, jsonify
 from controllers.tests_controller import get_all_tests, get_test, create_test, update_test, delete_test, get_test_candidates, assign_candidate_to_test, remove_candidate_from_test, update_candidate_deadline
 from controllers.auth_controller import require_session_auth
+from controllers.versions_controller import versioned_json
+from observability.logs import summarize
+
+logger = logging.getLogger(__name__)
 
 # Create a Blueprint for tests routes
 tests_bp = Blueprint('tests', __name__)
@@ -11,14 +17,15 @@ def get_user_company_id():
         return request.user.get('company_id')
     return None
 
-# GET /tests - Get all tests
+# GET /tests - Get all tests (?fields=&sort=&q=&created_after=&created_before=&limit=&cursor=)
 @tests_bp.route('/', methods=['GET'])
 @require_session_auth
 def get_tests():
     try:
         company_id = get_user_company_id()
-        tests = get_all_tests(company_id)
-        return jsonify(tests)
+        return versioned_json([('tests', company_id)], lambda: get_all_tests(company_id, request.args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f'Error getting tests: {str(e)}')
         return jsonify({'error': str(e)}), 500
@@ -29,10 +36,15 @@ def get_tests():
 def get_single_test(test_id):
     try:
         company_id = get_user_company_id()
-        test = get_test(test_id, company_id)
-        if not test:
-            return jsonify({'error': f'Test {test_id} not found'}), 404
-        return jsonify(test)
+        
+        def build():
+            test = get_test(test_id, company_id)
+            if not test:
+                return jsonify({'error': f'Test {test_id} not found'}), 404
+            return test
+        
+        # The candidate list in the test depends on the test and on the company's candidates
+        return versioned_json([('test', test_id), ('candidates', company_id)], build)
     except Exception as e:
         print(f'Error getting test: {str(e)}')
         return jsonify({'error': str(e)}), 500
@@ -69,9 +81,11 @@ def create_new_test():
         
         company_id = get_user_company_id()
         data['company_id'] = company_id  # Add company_id to test data
-        print(f"Creating test with data: {data}")
+        logger.debug("Creating test", extra={'fields': {'data': summarize(data)}})
         test = create_test(data)
         return jsonify(test)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f'Error creating test: {str(e)}')
         return jsonify({'error': str(e)}), 500
@@ -85,6 +99,8 @@ def update_single_test(test_id):
         company_id = get_user_company_id()
         test = update_test(test_id, data, company_id)
         return jsonify(test)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f'Error updating test: {str(e)}')
         return jsonify({'error': str(e)}), 500
@@ -101,14 +117,18 @@ def delete_single_test(test_id):
         print(f'Error deleting test: {str(e)}')
         return jsonify({'error': str(e)}), 500
 
-# GET /tests/:id/candidates - Get candidates for a test
+# GET /tests/:id/candidates - Get candidates for a test (?status=assigned|available&fields=&sort=&q=&limit=&cursor=)
 @tests_bp.route('/<int:test_id>/candidates', methods=['GET'])
 @require_session_auth
 def get_candidates_for_test(test_id):
     try:
         company_id = get_user_company_id()
-        candidates = get_test_candidates(test_id, company_id)
-        return jsonify(candidates)
+        return versioned_json(
+            [('test', test_id), ('candidates', company_id)],
+            lambda: get_test_candidates(test_id, company_id, request.args)
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f'Error getting candidates for test: {str(e)}')
         return jsonify({'error': str(e)}), 500
@@ -210,7 +230,7 @@ def try_test(test_id):
             }
         }
         
-        print(f"Responding with instance data: {response_data}")
+        logger.debug("Responding with instance data", extra={'fields': {'response': summarize(response_data)}})
         return jsonify(response_data)
     except Exception as e:
         print(f'Error trying test: {str(e)}')
@@ -1,5 +1,41 @@
-from flask import Blueprint, request, jsonify
-from controllers.timer_controller import start_instance_timer, get_timer_status, reset_timer, set_interview_started, start_project_timer, set_final_interview_started
+import json
+import os
+import threading
+import time
+from flask import Blueprint, Response, request, jsonify
+from controllers.timer_controller import start_instance_timer, get_timer_status, get_timer_state, reset_timer, set_interview_started, start_project_timer, set_final_interview_started
+from controllers.events_controller import add_event_hook, subscription, wait_for_event
+from controllers.versions_controller import conditional_json, make_etag
+
+# Open streams and long polls each hold a server thread (or greenlet): bound how long they wait,
+# and send SSE comments often enough to keep proxies from closing idle connections
+TIMER_STREAM_MAX_SECONDS = int(os.getenv('TIMER_STREAM_MAX_SECONDS', '300'))
+TIMER_STREAM_HEARTBEAT_SECONDS = int(os.getenv('TIMER_STREAM_HEARTBEAT_SECONDS', '15'))
+TIMER_POLL_MAX_SECONDS = int(os.getenv('TIMER_POLL_MAX_SECONDS', '25'))
+
+# Waiting requests allowed per process. gthread workers have a few threads each, so by default
+# at most half of them wait; beyond that streams and polls are answered immediately from a
+# cached state and the client retries after TIMER_RETRY_SECONDS (never sooner than a held poll
+# would have answered). Run gevent workers to hold hundreds of connections.
+#
+# Request rate per candidate: one /timer/poll every TIMER_POLL_MAX_SECONDS (~2.4 a minute with
+# the default 25s) whether the poll waits or is over the cap, against 6 a minute for the 10s
+# /timer/status polling this replaces. Over the cap a poll only notices changes on its next
+# retry, up to TIMER_RETRY_SECONDS late.
+if os.getenv('GUNICORN_WORKER_CLASS') == 'gevent':
+    _default_max_waiters = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '1000')) // 2
+else:
+    _default_max_waiters = max(1, int(os.getenv('GUNICORN_THREADS', '8')) // 2)
+TIMER_MAX_WAITERS = int(os.getenv('TIMER_MAX_WAITERS', str(_default_max_waiters)))
+TIMER_RETRY_SECONDS = max(int(os.getenv('TIMER_RETRY_SECONDS', str(TIMER_POLL_MAX_SECONDS))), TIMER_POLL_MAX_SECONDS)
+_waiters = threading.BoundedSemaphore(TIMER_MAX_WAITERS)
+
+# Over-cap answers come from this cache, so they cost no timers-file lock or chat_history query.
+# Entries are dropped on the instance's events and live at most TIMER_STATE_CACHE_SECONDS.
+TIMER_STATE_CACHE_SECONDS = int(os.getenv('TIMER_STATE_CACHE_SECONDS', '60'))
+_state_cache = {}  # instance_id (str) -> (state, time.monotonic() it is valid until)
+_state_cache_lock = threading.Lock()
+_state_cache_hooked = False
 
 # Create a Blueprint for timer routes
 timer_bp = Blueprint('timer', __name__)
@@ -91,7 +127,10 @@ def timer_status():
                 'error': 'No timer found for this instance'
             }), 404
         
-        return jsonify({
+        # The ETag follows writes (version) and the whole seconds remaining, so a running timer
+        # changes once per second and a disabled or expired one not at all
+        etag = make_etag('timer', instance_id, timer['version'], timer['timeRemaining'], timer['active'])
+        return conditional_json(etag, lambda: {
             'success': True,
             'timer': timer
         })
@@ -102,6 +141,154 @@ def timer_status():
             'error': str(e)
         }), 500
 
+def _seconds_until_expiry(state):
+    """Seconds until the state's running timer expires (None if it is not running)"""
+    timer = state['timer']
+    if not timer or not timer['active'] or timer['isExpired']:
+        return None
+    return max(0, timer['endTime'] - time.time()) + 0.5
+
+def _forget_cached_state(instance_id):
+    with _state_cache_lock:
+        if instance_id is None:
+            _state_cache.clear()
+        else:
+            _state_cache.pop(str(instance_id), None)
+
+def _cached_timer_state(instance_id):
+    """get_timer_state() through the per-process cache (for answers that do not wait)"""
+    global _state_cache_hooked
+    if not _state_cache_hooked:
+        with _state_cache_lock:
+            if not _state_cache_hooked:
+                add_event_hook(_forget_cached_state)
+                _state_cache_hooked = True
+
+    instance_id = str(instance_id)
+    with _state_cache_lock:
+        cached = _state_cache.get(instance_id)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+
+    state = get_timer_state(instance_id)
+    ttl = TIMER_STATE_CACHE_SECONDS
+    expiry = _seconds_until_expiry(state)
+    if expiry is not None:
+        # The tag changes when the timer expires
+        ttl = min(ttl, expiry)
+    with _state_cache_lock:
+        _state_cache[instance_id] = (state, time.monotonic() + ttl)
+    return state
+
+def _state_payload(state):
+    return {
+        'success': True,
+        'timer': state['timer'],
+        'phase': state['phase'],
+        'tag': state['tag']
+    }
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+# GET /timer/stream - Server-sent events with the timer and phase state of an instance
+@timer_bp.route('/stream', methods=['GET'])
+def timer_stream():
+    instance_id = request.args.get('instanceId')
+    if not instance_id:
+        return jsonify({
+            'success': False,
+            'error': 'Instance ID is required'
+        }), 400
+
+    def generate():
+        if not _waiters.acquire(blocking=False):
+            # Too many open streams: send the state and let EventSource reconnect later
+            yield f"retry: {TIMER_RETRY_SECONDS * 1000}\n\n{_sse('state', _state_payload(_cached_timer_state(instance_id)))}"
+            return
+        try:
+            yield from _stream_state(instance_id)
+        finally:
+            _waiters.release()
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no'
+    })
+
+def _stream_state(instance_id):
+    deadline = time.monotonic() + TIMER_STREAM_MAX_SECONDS
+    with subscription(instance_id) as events:
+        state = get_timer_state(instance_id)
+        # EventSource reconnects after the stream ends; it resends the state on connect
+        yield f"retry: 3000\n\n{_sse('state', _state_payload(state))}"
+        while time.monotonic() < deadline:
+            timeout = min(TIMER_STREAM_HEARTBEAT_SECONDS, deadline - time.monotonic())
+            expiry = _seconds_until_expiry(state)
+            if expiry is not None:
+                timeout = min(timeout, expiry)
+            event = wait_for_event(events, timeout)
+            if event is None and (expiry is None or expiry > timeout):
+                yield ": keepalive\n\n"
+                continue
+            # An event or the timer running out: send the new state once, if it changed
+            new_state = get_timer_state(instance_id)
+            if new_state['tag'] != state['tag']:
+                state = new_state
+                yield _sse('state', _state_payload(state))
+
+# GET /timer/poll - Long-poll fallback for /timer/stream
+@timer_bp.route('/poll', methods=['GET'])
+def timer_poll():
+    """
+    Returns the state ({timer, phase, tag}) as soon as its tag differs from ?tag=, waiting up
+    to ?timeout= seconds (max TIMER_POLL_MAX_SECONDS) for a change; 304 if nothing changed.
+    """
+    try:
+        instance_id = request.args.get('instanceId')
+        if not instance_id:
+            return jsonify({
+                'success': False,
+                'error': 'Instance ID is required'
+            }), 400
+        known_tag = request.args.get('tag')
+        try:
+            timeout = min(float(request.args.get('timeout', TIMER_POLL_MAX_SECONDS)), TIMER_POLL_MAX_SECONDS)
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'error': 'timeout must be a number of seconds'
+            }), 400
+
+        if not _waiters.acquire(blocking=False):
+            # Too many waiting requests: answer now and ask the client to come back later
+            state = _cached_timer_state(instance_id)
+            if state['tag'] == known_tag:
+                return Response(status=304, headers={'Retry-After': str(TIMER_RETRY_SECONDS)})
+            return jsonify(_state_payload(state))
+
+        try:
+            deadline = time.monotonic() + timeout
+            with subscription(instance_id) as events:
+                state = get_timer_state(instance_id)
+                while state['tag'] == known_tag:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return Response(status=304)
+                    expiry = _seconds_until_expiry(state)
+                    wait_for_event(events, remaining if expiry is None else min(remaining, expiry))
+                    state = get_timer_state(instance_id)
+        finally:
+            _waiters.release()
+
+        return jsonify(_state_payload(state))
+    except Exception as e:
+        print(f"Error polling timer state: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 # POST /timer/reset - Reset a timer for an instance
 @timer_bp.route('/reset', methods=['POST'])
 def reset_instance_timer():
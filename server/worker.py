@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Background job worker.
+
+Claims jobs from the Postgres-backed queue (see controllers/jobs_controller.py) and runs
+them until interrupted. Run as many copies as needed; jobs are claimed with SKIP LOCKED.
+
+    python server/worker.py
+"""
+import logging
+import signal
+import threading
+
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+from observability.logs import configure_logging
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+from controllers.jobs_controller import load_job_handlers, run_worker
+
+
+def main():
+    load_job_handlers()
+
+    stop_event = threading.Event()
+
+    def handle_signal(signum, frame):
+        logger.info(f"WORKER: Received signal {signum}, finishing current job and stopping")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    run_worker(stop_event)
+
+
+if __name__ == '__main__':
+    main()
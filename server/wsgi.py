@@ -0,0 +1,10 @@
+"""
+WSGI entry point for production servers.
+
+    cd server && gunicorn -c gunicorn.conf.py wsgi:app
+
+Server settings (workers, threads, timeouts) live in gunicorn.conf.py.
+"""
+from railway_deploy import app
+
+__all__ = ['app']